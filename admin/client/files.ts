@@ -3,6 +3,10 @@ import { getBaseURL } from "./utils";
 export type FileStatus =
   | "uploading"
   | "uploaded"
+  | "queued"
+  | "parsing"
+  | "embedding"
+  | "indexed"
   | "failed"
   | "removing"
   | "removed";
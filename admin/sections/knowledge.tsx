@@ -148,7 +148,10 @@ export const Knowledge = () => {
     setErrorLoadingCollections(false);
     try {
       const collectionsResponse = await client.getCollections();
-      const collectionNames = collectionsResponse.collections.map((collection: { name: string }) => collection.name);
+      const collectionNames = collectionsResponse.collections
+        .map((collection: { name: string }) => collection.name)
+        // Hide the versions built by the re-indexing, they are served under the collection name
+        .filter((name: string) => !/__v\d+$/.test(name));
       setCollections(collectionNames);
       setSelectedCollection(collectionNames[0] || ''); // Set default selected collection if available
     } catch (error) {
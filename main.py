@@ -6,6 +6,7 @@ load_dotenv(dotenv_path=ENV_FILE_PATH, verbose=False)
 import os
 import logging
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
@@ -16,10 +17,32 @@ from src.routers.management.files import files_router
 from src.routers.management.tools import tools_router
 from src.routers.management.vectordb_actions import vectordb_actions_router
 from src.routers.management.loader import loader_router
+from src.routers.management.metrics import metrics_router
+from src.routers.management.reindex import reindex_router
 from src.models.model_config import ModelConfig
+from src.tasks.ingestion import get_ingestion_queue
+from src.tasks.reindex import get_reindexer
+from app.engine.collection_registry import get_collection_registry
+from app.engine.hybrid_retriever import close_sparse_indexes
+from app.engine.vectordb import close_vector_stores
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve the collections built with another embedding model than the configured one
+    # with their model, and continue the re-indexing interrupted by a restart
+    get_collection_registry().load_embed_models()
+    get_reindexer().resume()
+    yield
+    # Stop the background ingestion and close the pooled vector store and sparse index connections
+    get_ingestion_queue().shutdown()
+    get_reindexer().shutdown()
+    await close_vector_stores()
+    close_sparse_indexes()
+
+
+app = FastAPI(lifespan=lifespan)
 init_settings()
 
 environment = os.getenv("ENVIRONMENT")
@@ -39,6 +62,8 @@ app.include_router(vectordb_actions_router, prefix="/api/management/set-collecti
 app.include_router(tools_router, prefix="/api/management/tools", tags=["Agent"])
 app.include_router(files_router, prefix="/api/management/files", tags=["Knowledge"])
 app.include_router(loader_router, prefix="/api/management/loader", tags=["Knowledge"])
+app.include_router(metrics_router, prefix="/api/management/metrics", tags=["Metrics"])
+app.include_router(reindex_router, prefix="/api/management/reindex", tags=["Knowledge"])
 
 
 @app.get("/")
@@ -1,41 +1,80 @@
 import os
+from fastapi import HTTPException
 from llama_index.core.settings import Settings
-from llama_index.core.agent import AgentRunner
-from app.engine.tools import ToolFactory
-from app.engine.index import get_index
+from app.engine.agent import get_agent
+from app.engine.chunking import get_node_postprocessors
+from app.engine.condense import ConditionalCondenseChatEngine
+from app.engine.context_assembly import get_context_assembler
+from app.engine.engine_cache import get_engine_cache_key, get_engine_components
+from app.engine.index import get_embed_model
+from app.engine.retrieval_cache import get_index_version, get_retriever
+from app.engine.semantic_cache import SemanticCacheChatEngine, get_semantic_cache
+from app.engine.vectordb import resolve_collection
 
 
-def get_chat_engine():
+def get_chat_engine(collection: str | None = None):
+    """
+    Create the chat engine of a request. The collection can be selected with
+    the `collection` query parameter, the default collection is used otherwise.
+    """
+    try:
+        collection = resolve_collection(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    chat_engine = _create_chat_engine(collection)
+
+    # Answer the questions similar to the previous ones from the semantic cache
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None:
+        return SemanticCacheChatEngine(
+            chat_engine,
+            cache=semantic_cache,
+            embed_model=get_embed_model(collection),
+            # The index version when the request starts: a response finished after the
+            # documents changed is cached for the previous version and never served again
+            scope=(*get_engine_cache_key(collection), get_index_version(collection)),
+        )
+    return chat_engine
+
+
+def _create_chat_engine(collection: str):
     top_k = int(os.getenv("TOP_K", "3"))
     system_prompt = os.getenv("SYSTEM_PROMPT")
 
-    index = get_index()
-    if index is None:
-        raise RuntimeError("Index is not found")
+    # Reuse the index and tools of the collection, only the engine is created per request
+    index, tools = get_engine_components(collection)
 
-    tools = ToolFactory.from_env()
+    # Reuse the query embeddings and the retrieved nodes of the repeated questions
+    retriever = get_retriever(index, collection, top_k)
+
+    # Merge and deduplicate the retrieved chunks and fit them in the context token budget
+    node_postprocessors = get_node_postprocessors()
+    context_assembler = get_context_assembler(Settings.llm)
+    if context_assembler is not None:
+        node_postprocessors.append(context_assembler)
 
     # Use the context chat engine if no tools are provided
     if len(tools) == 0:
-        from llama_index.core.chat_engine import CondensePlusContextChatEngine
-
-        return CondensePlusContextChatEngine.from_defaults(
-            retriever=index.as_retriever(top_k=top_k),
+        # Only condense the follow-up questions which need the chat history
+        return ConditionalCondenseChatEngine.from_defaults(
+            retriever=retriever,
             system_prompt=system_prompt,
             llm=Settings.llm,
+            node_postprocessors=node_postprocessors,
         )
     else:
-        from llama_index.core.agent import AgentRunner
+        from llama_index.core.query_engine import RetrieverQueryEngine
         from llama_index.core.tools.query_engine import QueryEngineTool
 
         # Add the query engine tool to the list of tools
         query_engine_tool = QueryEngineTool.from_defaults(
-            query_engine=index.as_query_engine(similarity_top_k=top_k)
+            query_engine=RetrieverQueryEngine.from_args(
+                retriever,
+                llm=Settings.llm,
+                node_postprocessors=node_postprocessors,
+            )
         )
         tools.append(query_engine_tool)
-        return AgentRunner.from_llm(
-            llm=Settings.llm,
-            tools=tools,
-            system_prompt=system_prompt,
-            verbose=True,  # Show agent logs to console
-        )
+        # Run the tool calls with a timeout, concurrently if the LLM plans several at once
+        return get_agent(Settings.llm, tools, system_prompt=system_prompt)
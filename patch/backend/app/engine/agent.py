@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import contextvars
+import concurrent.futures
+from typing import Any, Dict, List, Optional, Tuple, Union
+from cachetools import TTLCache
+from llama_index.agent.openai import OpenAIAgentWorker
+from llama_index.agent.openai.step import default_tool_call_parser
+from llama_index.core.agent import AgentRunner
+from llama_index.core.agent.types import Task, TaskStep, TaskStepOutput
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.chat_engine.types import ChatResponseMode
+from llama_index.core.llms import LLM
+from llama_index.core.tools import BaseTool, FunctionTool, ToolMetadata, ToolOutput
+from llama_index.core.tools.types import AsyncBaseTool, adapt_to_async_tool
+from llama_index.llms.openai import OpenAI
+from llama_index.llms.openai.utils import OpenAIToolCall
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_TOOL_TIMEOUT = 30
+DEFAULT_TOOL_CACHE_TTL = 300
+TOOL_CACHE_MAX_ENTRIES = 256
+TOOL_WORKERS = 16
+# The tools only reading external data, their results are cached for TOOL_CACHE_TTL seconds.
+# The interpreter and the requests changing data are run every time, and the query engine
+# tool has the retrieval cache, invalidated when the documents change.
+CACHEABLE_TOOLS = [
+    "duckduckgo_instant_search",
+    "duckduckgo_full_search",
+    "load_data",
+    "search_data",
+    "load_openapi_spec",
+    "get_request",
+]
+
+# The tool calls run in these threads to be timed out, a timed out call keeps its thread
+# until it returns
+_tool_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=TOOL_WORKERS, thread_name_prefix="tool"
+)
+# The agent step running in the current thread or task
+_tool_step: contextvars.ContextVar["ToolStep | None"] = contextvars.ContextVar(
+    "tool_step", default=None
+)
+
+
+def _get_tool_setting(name: str, tool_name: str, default: float) -> float:
+    """
+    Get the value of a tool from a setting like "tool_name=value,other_tool=value".
+    """
+    for item in os.getenv(name, "").split(","):
+        key, _, value = item.partition("=")
+        if key.strip() == tool_name and value.strip():
+            return float(value)
+    return default
+
+
+class GuardedTool(AsyncBaseTool):
+    """
+    Call a tool with a timeout and cache its results for `cache_ttl` seconds.
+    The calls of an agent step can be started ahead with `prefetch`, to run them at once.
+    """
+
+    def __init__(self, tool: BaseTool, timeout: float, cache_ttl: float):
+        self._tool = tool
+        self._timeout = timeout if timeout > 0 else None
+        self._cache: TTLCache | None = (
+            TTLCache(maxsize=TOOL_CACHE_MAX_ENTRIES, ttl=cache_ttl)
+            if cache_ttl > 0
+            else None
+        )
+        # The calls started by `prefetch` with their start time, by (step id, call key)
+        self._pending: Dict[
+            Tuple[str, str], Tuple[concurrent.futures.Future, float]
+        ] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def metadata(self) -> ToolMetadata:
+        return self._tool.metadata
+
+    @staticmethod
+    def _get_key(args: tuple, kwargs: dict) -> str:
+        return json.dumps([args, kwargs], sort_keys=True, default=str)
+
+    def _get_cached(self, key: str) -> ToolOutput | None:
+        if self._cache is None:
+            return None
+        with self._lock:
+            return self._cache.get(key)
+
+    def _put_cached(self, key: str, output: ToolOutput):
+        if self._cache is not None and not output.is_error:
+            with self._lock:
+                self._cache[key] = output
+
+    def _get_error(self, kwargs: dict, message: str, error: Any) -> ToolOutput:
+        return ToolOutput(
+            content=message,
+            tool_name=self.metadata.name,
+            raw_input={"kwargs": kwargs},
+            raw_output=error,
+            is_error=True,
+        )
+
+    def _get_timeout_error(self, kwargs: dict) -> ToolOutput:
+        logger.warning(
+            f"The tool {self.metadata.name} timed out after {self._timeout}s"
+        )
+        return self._get_error(
+            kwargs,
+            f"Error: the tool {self.metadata.name} did not answer in {self._timeout}s",
+            TimeoutError(),
+        )
+
+    def _run(self, key: str, args: tuple, kwargs: dict) -> ToolOutput:
+        try:
+            output = self._tool(*args, **kwargs)
+        except Exception as e:
+            output = self._get_error(kwargs, f"Error: {e!s}", e)
+        self._put_cached(key, output)
+        return output
+
+    def _get_remaining_time(self, started: float) -> float | None:
+        # The timeout counts from the start of a prefetched call
+        if self._timeout is None:
+            return None
+        return max(self._timeout - (time.monotonic() - started), 0)
+
+    def _take_pending(self, key: str) -> Tuple[concurrent.futures.Future, float] | None:
+        # Only the step that started a call gets its result
+        step = _tool_step.get()
+        if step is None:
+            return None
+        with self._lock:
+            return self._pending.pop((step.id, key), None)
+
+    def _submit(
+        self, key: str, args: tuple, kwargs: dict
+    ) -> Tuple[concurrent.futures.Future, float]:
+        # The call started by `prefetch` is used instead of calling the tool again
+        return self._take_pending(key) or (
+            _tool_executor.submit(self._run, key, args, kwargs),
+            time.monotonic(),
+        )
+
+    def prefetch(self, *args: Any, **kwargs: Any):
+        """
+        Start a call in the background during a `ToolStep`, the next call of the step
+        with the same arguments gets its result.
+        """
+        step = _tool_step.get()
+        key = self._get_key(args, kwargs)
+        if step is None or self._get_cached(key) is not None:
+            return
+        with self._lock:
+            if (step.id, key) not in self._pending:
+                self._pending[(step.id, key)] = (
+                    _tool_executor.submit(self._run, key, args, kwargs),
+                    time.monotonic(),
+                )
+
+    def discard_step(self, step_id: str):
+        """
+        Drop the calls started by a step that it didn't use, their result is never returned.
+        """
+        with self._lock:
+            keys = [key for key in self._pending if key[0] == step_id]
+            for key in keys:
+                self._pending.pop(key)
+        if keys:
+            logger.debug(f"Discarded {len(keys)} unused calls of {self.metadata.name}")
+
+    def call(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        key = self._get_key(args, kwargs)
+        output = self._get_cached(key)
+        if output is not None:
+            return output
+        future, started = self._submit(key, args, kwargs)
+        try:
+            return future.result(timeout=self._get_remaining_time(started))
+        except concurrent.futures.TimeoutError:
+            return self._get_timeout_error(kwargs)
+
+    async def acall(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        key = self._get_key(args, kwargs)
+        output = self._get_cached(key)
+        if output is not None:
+            return output
+        pending = self._take_pending(key)
+        try:
+            if pending is not None:
+                future, started = pending
+                return await asyncio.wait_for(
+                    asyncio.wrap_future(future),
+                    timeout=self._get_remaining_time(started),
+                )
+            output = await asyncio.wait_for(
+                adapt_to_async_tool(self._tool).acall(*args, **kwargs),
+                timeout=self._timeout,
+            )
+        except asyncio.TimeoutError:
+            return self._get_timeout_error(kwargs)
+        except Exception as e:
+            return self._get_error(kwargs, f"Error: {e!s}", e)
+        self._put_cached(key, output)
+        return output
+
+
+def guard_tool(tool: BaseTool) -> GuardedTool:
+    """
+    Wrap a tool with its TOOL_TIMEOUT and TOOL_CACHE_TTL, or their value for the tool
+    in TOOL_TIMEOUTS and TOOL_CACHE_TTLS.
+    """
+    name = tool.metadata.name
+    timeout = _get_tool_setting(
+        "TOOL_TIMEOUTS",
+        name,
+        float(os.getenv("TOOL_TIMEOUT", DEFAULT_TOOL_TIMEOUT)),
+    )
+    cache_ttl = _get_tool_setting(
+        "TOOL_CACHE_TTLS",
+        name,
+        (
+            float(os.getenv("TOOL_CACHE_TTL", DEFAULT_TOOL_CACHE_TTL))
+            if name in CACHEABLE_TOOLS
+            else 0
+        ),
+    )
+    return GuardedTool(tool, timeout=timeout, cache_ttl=cache_ttl)
+
+
+class ToolStep:
+    """
+    The scope of the tool calls of an agent step: the calls started by `prefetch` are only
+    used by the step, the ones it didn't use are dropped when it ends.
+    """
+
+    def __init__(self, tools: List[BaseTool]):
+        self.id = uuid.uuid4().hex
+        self.tools = [tool for tool in tools if isinstance(tool, GuardedTool)]
+        self._token: contextvars.Token | None = None
+
+    def __enter__(self) -> "ToolStep":
+        self._token = _tool_step.set(self)
+        return self
+
+    def __exit__(self, *args: Any):
+        _tool_step.reset(self._token)
+        for tool in self.tools:
+            tool.discard_step(self.id)
+
+
+class ParallelOpenAIAgentWorker(OpenAIAgentWorker):
+    """
+    Start all the tool calls of an agent step at once. The worker still handles
+    them one by one, but each one only waits for its already running call.
+    """
+
+    def _should_continue(
+        self, tool_calls: Optional[List[OpenAIToolCall]], n_function_calls: int
+    ) -> bool:
+        should_continue = super()._should_continue(tool_calls, n_function_calls)
+        # The calls are only started if the worker runs them, e.g. not past max_function_calls
+        step = _tool_step.get()
+        if should_continue and step is not None and len(tool_calls) > 1:
+            tools = {tool.metadata.name: tool for tool in step.tools}
+            for tool_call in tool_calls:
+                tool = tools.get(tool_call.function.name)
+                if tool is None:
+                    continue
+                try:
+                    arguments = (self.tool_call_parser or default_tool_call_parser)(
+                        tool_call
+                    )
+                except ValueError:
+                    # The worker reports the invalid arguments to the LLM
+                    continue
+                tool.prefetch(**arguments)
+        return should_continue
+
+    def _run_step(
+        self,
+        step: TaskStep,
+        task: Task,
+        mode: ChatResponseMode = ChatResponseMode.WAIT,
+        tool_choice: Union[str, dict] = "auto",
+    ) -> TaskStepOutput:
+        with ToolStep(self.get_tools(task.input)):
+            return super()._run_step(step, task, mode=mode, tool_choice=tool_choice)
+
+    async def _arun_step(
+        self,
+        step: TaskStep,
+        task: Task,
+        mode: ChatResponseMode = ChatResponseMode.WAIT,
+        tool_choice: Union[str, dict] = "auto",
+    ) -> TaskStepOutput:
+        with ToolStep(self.get_tools(task.input)):
+            return await super()._arun_step(
+                step, task, mode=mode, tool_choice=tool_choice
+            )
+
+
+def get_agent(
+    llm: LLM, tools: List[BaseTool], system_prompt: str | None = None
+) -> AgentRunner:
+    """
+    Get an agent calling the tools with their timeout and cache, the tool calls planned
+    together by an OpenAI function calling model run concurrently.
+    """
+    tools = [
+        tool if isinstance(tool, GuardedTool) else guard_tool(tool) for tool in tools
+    ]
+    if isinstance(llm, OpenAI) and llm.metadata.is_function_calling_model:
+        worker = ParallelOpenAIAgentWorker.from_tools(
+            tools=tools,
+            llm=llm,
+            verbose=True,  # Show agent logs to console
+            prefix_messages=(
+                [ChatMessage(content=system_prompt, role="system")]
+                if system_prompt
+                else []
+            ),
+            callback_manager=llm.callback_manager,
+        )
+        return AgentRunner(worker, llm=llm, callback_manager=llm.callback_manager)
+    return AgentRunner.from_llm(
+        llm=llm,
+        tools=tools,
+        system_prompt=system_prompt,
+        verbose=True,
+    )
+
+
+def benchmark_tool_calls(
+    calls: int = 4, latency: float = 0.5, timeout: float = 2.0
+) -> List[dict]:
+    """
+    Report the time of the tool calls of an agent step with stub tools answering after
+    `latency` seconds: one by one, started at once, and again from the cache.
+    """
+
+    def search(query: str) -> str:
+        time.sleep(latency)
+        return f"Results for {query}"
+
+    tool = FunctionTool.from_defaults(fn=search, name="search")
+    guarded_tool = GuardedTool(tool, timeout=timeout, cache_ttl=60)
+    queries = [f"query {i}" for i in range(calls)]
+    results = []
+    for name in ["sequential", "parallel", "cached"]:
+        start = time.perf_counter()
+        if name == "sequential":
+            outputs = [tool(query=query) for query in queries]
+        else:
+            with ToolStep([guarded_tool]):
+                for query in queries:
+                    guarded_tool.prefetch(query=query)
+                outputs = [guarded_tool(query=query) for query in queries]
+        results.append(
+            {
+                "mode": name,
+                "calls": calls,
+                "errors": sum(output.is_error for output in outputs),
+                "seconds": time.perf_counter() - start,
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    for result in benchmark_tool_calls(calls):
+        logger.info(result)
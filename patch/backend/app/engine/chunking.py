@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+from typing import Any, List, Sequence
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.node_parser import (
+    NodeParser,
+    SentenceSplitter,
+    SentenceWindowNodeParser,
+)
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.postprocessor import MetadataReplacementPostProcessor
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.settings import Settings
+from llama_index.core.utils import get_tqdm_iterable
+
+logger = logging.getLogger(__name__)
+
+# Supported chunking strategies:
+# - document: split each document into sentence chunks of `Settings.chunk_size`
+# - line: like `document`, but CSV documents are split into one chunk per row
+# - sentence_window: one node per sentence, the surrounding sentences are sent to the LLM
+CHUNK_STRATEGIES = ["document", "line", "sentence_window"]
+DEFAULT_CHUNK_STRATEGY = "line"
+
+
+class CSVLineNodeParser(NodeParser):
+    """
+    Split CSV documents into one node per line and the other documents into sentence chunks.
+    The nodes keep the metadata and the source relationship of their document.
+    """
+
+    sentence_splitter: SentenceSplitter = Field(
+        description="The splitter used for the non-CSV documents."
+    )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CSVLineNodeParser"
+
+    @staticmethod
+    def _is_csv(node: BaseNode) -> bool:
+        return node.metadata.get("file_type") == "text/csv" or str(
+            node.metadata.get("file_path", "")
+        ).endswith(".csv")
+
+    def _parse_nodes(
+        self,
+        nodes: Sequence[BaseNode],
+        show_progress: bool = False,
+        **kwargs: Any,
+    ) -> List[BaseNode]:
+        all_nodes: List[BaseNode] = []
+        for node in get_tqdm_iterable(nodes, show_progress, "Parsing nodes"):
+            if self._is_csv(node):
+                lines = [
+                    line
+                    for line in node.get_content(
+                        metadata_mode=MetadataMode.NONE
+                    ).splitlines()
+                    if line.strip()
+                ]
+                all_nodes.extend(
+                    build_nodes_from_splits(lines, node, id_func=self.id_func)
+                )
+            else:
+                all_nodes.extend(self.sentence_splitter._parse_nodes([node]))
+        return all_nodes
+
+
+def get_chunk_strategy() -> str:
+    strategy = os.getenv("CHUNK_STRATEGY", DEFAULT_CHUNK_STRATEGY)
+    if strategy not in CHUNK_STRATEGIES:
+        raise ValueError(
+            f"Unsupported chunk strategy: {strategy}. Use one of {CHUNK_STRATEGIES}"
+        )
+    return strategy
+
+
+def get_node_parser(strategy: str | None = None) -> NodeParser:
+    """
+    Get the node parser of the ingestion pipeline for the configured CHUNK_STRATEGY.
+    """
+    strategy = strategy or get_chunk_strategy()
+    sentence_splitter = SentenceSplitter(
+        chunk_size=Settings.chunk_size,
+        chunk_overlap=Settings.chunk_overlap,
+    )
+    match strategy:
+        case "document":
+            return sentence_splitter
+        case "line":
+            return CSVLineNodeParser(sentence_splitter=sentence_splitter)
+        case "sentence_window":
+            return SentenceWindowNodeParser.from_defaults(
+                window_size=int(os.getenv("CHUNK_WINDOW_SIZE", "3")),
+            )
+        case _:
+            raise ValueError(f"Unsupported chunk strategy: {strategy}")
+
+
+def get_node_postprocessors(strategy: str | None = None) -> list:
+    """
+    Get the postprocessors that the retrieval needs for the configured CHUNK_STRATEGY.
+    """
+    strategy = strategy or get_chunk_strategy()
+    if strategy == "sentence_window":
+        # Replace the retrieved sentence with its window before sending it to the LLM
+        return [MetadataReplacementPostProcessor(target_metadata_key="window")]
+    return []
+
+
+def benchmark_chunking(documents, embed: bool = False) -> List[dict]:
+    """
+    Report the number of nodes, embedding calls and the wall time per MB of input
+    for each chunking strategy. The wall time only includes the embedding if `embed` is set.
+    """
+    input_mb = sum(len(document.text.encode("utf-8")) for document in documents) / (
+        1024 * 1024
+    )
+    input_mb = max(input_mb, 1e-9)
+    embed_batch_size = getattr(Settings.embed_model, "embed_batch_size", 10)
+    results = []
+    for strategy in CHUNK_STRATEGIES:
+        start = time.perf_counter()
+        nodes = get_node_parser(strategy).get_nodes_from_documents(documents)
+        if embed:
+            nodes = Settings.embed_model(nodes)
+        elapsed = time.perf_counter() - start
+        results.append(
+            {
+                "strategy": strategy,
+                "nodes": len(nodes),
+                "nodes_per_mb": len(nodes) / input_mb,
+                "embedding_calls": -(-len(nodes) // embed_batch_size),
+                "seconds_per_mb": elapsed / input_mb,
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    from app.settings import init_settings
+    from app.engine.loaders import get_documents
+
+    logging.basicConfig(level=logging.INFO)
+    init_settings()
+    for result in benchmark_chunking(get_documents(), embed="--embed" in sys.argv):
+        logger.info(result)
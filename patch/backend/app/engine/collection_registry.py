@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, List
+from pydantic import BaseModel, Field
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+logger = logging.getLogger("uvicorn")
+
+REGISTRY_FILE = "collections.json"
+VERSION_SEPARATOR = "__v"
+
+
+class EmbeddingConfig(BaseModel):
+    """
+    The embedding model a collection version is built with, its queries must be embedded
+    with the same model.
+    """
+
+    provider: str | None = None
+    model: str | None = None
+    dimension: int | None = None
+    # The Azure OpenAI deployment serving the model
+    deployment: str | None = None
+
+
+def get_embedding_config() -> EmbeddingConfig:
+    """
+    Get the configured embedding model.
+    """
+    provider = os.getenv("MODEL_PROVIDER")
+    dimension = os.getenv("EMBEDDING_DIM")
+    return EmbeddingConfig(
+        provider=provider,
+        model=os.getenv("EMBEDDING_MODEL"),
+        dimension=int(dimension) if dimension else None,
+        deployment=(
+            os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+            if provider == "azure-openai"
+            else None
+        ),
+    )
+
+
+def build_embed_model(config: EmbeddingConfig) -> BaseEmbedding:
+    """
+    Create the embedding model of a config like `init_settings` does for the configured one,
+    with the credentials of the current settings.
+    """
+    if config.provider == "openai":
+        from llama_index.embeddings.openai import OpenAIEmbedding
+
+        return OpenAIEmbedding(model=config.model, dimensions=config.dimension)
+    if config.provider == "azure-openai":
+        from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
+
+        return AzureOpenAIEmbedding(
+            model=config.model,
+            deployment_name=config.deployment,
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_version=os.getenv("OPENAI_API_VERSION"),
+            dimensions=config.dimension,
+        )
+    if config.provider == "ollama":
+        from llama_index.embeddings.ollama import OllamaEmbedding
+
+        return OllamaEmbedding(
+            base_url=os.getenv("OLLAMA_BASE_URL") or "http://127.0.0.1:11434",
+            model_name=config.model,
+        )
+    if config.provider == "gemini":
+        from llama_index.embeddings.gemini import GeminiEmbedding
+
+        return GeminiEmbedding(model_name=f"models/{config.model}")
+    raise ValueError(f"Unsupported embedding provider: {config.provider}")
+
+
+class CollectionVersion(BaseModel):
+    name: str = Field(description="The name of the collection in the vector store.")
+    embedding: EmbeddingConfig | None = Field(
+        default=None,
+        description="The embedding model the collection was built with, None if it's unknown.",
+    )
+
+
+class CollectionState(BaseModel):
+    """
+    The versions of a collection. The chat requests and uploads use the active version,
+    the building version is indexed with the new embedding model in the background.
+    """
+
+    collection: str
+    active: CollectionVersion
+    building: CollectionVersion | None = None
+    previous: CollectionVersion | None = None
+    version: int = 1
+    status: str = "ready"  # ready, building or failed
+    files_done: int = 0
+    files_total: int = 0
+    error: str | None = None
+    updated_at: float = Field(default_factory=time.time)
+
+
+class CollectionRegistry:
+    """
+    Map the collections to the versioned collections of the vector store (an alias),
+    so a collection can be re-indexed into a new version while the active one keeps serving.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._states: Dict[str, CollectionState] = {}
+        # The embedding models of the versions that were built with another config
+        # than the current one, rebuilt from their config after a restart
+        self._embed_models: Dict[str, BaseEmbedding] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self._states = {
+                    name: CollectionState(**state)
+                    for name, state in json.load(f).items()
+                }
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(
+                {name: state.model_dump() for name, state in self._states.items()}, f
+            )
+        os.replace(temp_path, self.path)
+
+    def get_state(self, collection: str) -> CollectionState:
+        with self._lock:
+            state = self._states.get(collection)
+            if state is None:
+                # A collection that was never re-indexed is its own active version
+                state = CollectionState(
+                    collection=collection,
+                    active=CollectionVersion(name=collection),
+                )
+            return state.model_copy(deep=True)
+
+    def get_states(self) -> List[CollectionState]:
+        with self._lock:
+            return [state.model_copy(deep=True) for state in self._states.values()]
+
+    def get_active_name(self, collection: str) -> str:
+        with self._lock:
+            state = self._states.get(collection)
+            return state.active.name if state is not None else collection
+
+    def get_collection(self, name: str) -> str:
+        """
+        Get the collection of a version name, the name itself if it's not a version.
+        """
+        with self._lock:
+            for state in self._states.values():
+                versions = [state.active, state.building, state.previous]
+                if any(version and version.name == name for version in versions):
+                    return state.collection
+        return name
+
+    def _find_version(self, name: str) -> CollectionVersion | None:
+        for state in self._states.values():
+            for version in [state.active, state.building, state.previous]:
+                if version is not None and version.name == name:
+                    return version
+        return None
+
+    def record_embedding(self, name: str, embedding: EmbeddingConfig):
+        """
+        Record the embedding config of a version (or of a collection that was never re-indexed)
+        if it's not known yet.
+        """
+        with self._lock:
+            version = self._find_version(name)
+            if version is None:
+                state = self.get_state(name)
+                self._states[name] = state
+                version = state.active
+            if version.embedding is None:
+                version.embedding = embedding
+                self._save()
+
+    def get_embed_model(self, name: str) -> BaseEmbedding | None:
+        """
+        Get the embedding model of a version built with another config than the current one,
+        None if it's built with the current one or its config is unknown. Raises a ValueError
+        if the model can't be created anymore, its queries can't be embedded.
+        """
+        with self._lock:
+            version = self._find_version(name)
+            if (
+                version is None
+                or version.embedding is None
+                or version.embedding == get_embedding_config()
+            ):
+                return None
+            embed_model = self._embed_models.get(name)
+            if embed_model is None:
+                try:
+                    embed_model = build_embed_model(version.embedding)
+                except Exception as e:
+                    raise ValueError(
+                        f"The embedding model {version.embedding.provider}:{version.embedding.model} "
+                        f"of {name} is not available: {e}"
+                    )
+                self._embed_models[name] = embed_model
+            return embed_model
+
+    def pin_embed_model(
+        self, name: str, embedding: EmbeddingConfig, embed_model: BaseEmbedding
+    ):
+        """
+        Record the embedding config of a version if it's not known yet, and keep using
+        `embed_model` for its queries if it's the model of its config.
+        """
+        with self._lock:
+            self.record_embedding(name, embedding)
+            if self._find_version(name).embedding == embedding:
+                self._embed_models.setdefault(name, embed_model)
+
+    def load_embed_models(self):
+        """
+        Create the embedding models of the active versions built with another config
+        than the current one, e.g. after a restart during a re-indexing.
+        """
+        for state in self.get_states():
+            try:
+                self.get_embed_model(state.active.name)
+            except ValueError as e:
+                logger.error(f"Collection {state.collection} can't be queried: {e}")
+
+    def start_build(self, collection: str) -> CollectionVersion:
+        with self._lock:
+            state = self._states.get(collection) or self.get_state(collection)
+            if state.status == "building":
+                raise ValueError(f"Collection {collection} is already being built")
+            state.version += 1
+            state.building = CollectionVersion(
+                name=f"{collection}{VERSION_SEPARATOR}{state.version}",
+                embedding=get_embedding_config(),
+            )
+            state.status = "building"
+            state.files_done = state.files_total = 0
+            state.error = None
+            state.updated_at = time.time()
+            self._states[collection] = state
+            self._save()
+            return state.building
+
+    def set_progress(self, collection: str, files_done: int, files_total: int):
+        with self._lock:
+            state = self._states[collection]
+            state.files_done, state.files_total = files_done, files_total
+            state.updated_at = time.time()
+            self._save()
+
+    def finish_build(self, collection: str) -> CollectionVersion | None:
+        """
+        Switch the collection to the built version. Returns the version that is
+        dropped, the one before the previous active version.
+        """
+        with self._lock:
+            state = self._states[collection]
+            dropped = state.previous
+            state.previous = state.active
+            state.active = state.building
+            state.building = None
+            state.status = "ready"
+            state.updated_at = time.time()
+            self._save()
+        if dropped is not None:
+            self._embed_models.pop(dropped.name, None)
+        logger.info(f"Switched collection {collection} to {state.active.name}")
+        return dropped
+
+    def fail_build(self, collection: str, error: str) -> CollectionVersion | None:
+        """
+        Keep the active version, returns the version that failed to build.
+        """
+        with self._lock:
+            state = self._states[collection]
+            failed = state.building
+            state.building = None
+            state.status = "failed"
+            state.error = error
+            state.updated_at = time.time()
+            self._save()
+            return failed
+
+    def rollback(self, collection: str) -> CollectionState:
+        """
+        Switch the collection back to its previous version.
+        """
+        with self._lock:
+            state = self._states.get(collection)
+            if state is None or state.previous is None:
+                raise ValueError(f"Collection {collection} has no previous version")
+            if state.status == "building":
+                raise ValueError(f"Collection {collection} is being built")
+            previous = state.previous
+            # The queries must be embedded with the model the version was built with
+            if previous.embedding is None:
+                raise ValueError(
+                    f"The embedding model {previous.name} was built with is unknown"
+                )
+            self.get_embed_model(previous.name)
+            state.previous, state.active = state.active, previous
+            state.updated_at = time.time()
+            self._save()
+            logger.info(f"Rolled back collection {collection} to {state.active.name}")
+            return state.model_copy(deep=True)
+
+
+_registry: CollectionRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_collection_registry() -> CollectionRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CollectionRegistry(
+                os.path.join(os.getenv("STORAGE_DIR", "storage"), REGISTRY_FILE)
+            )
+        return _registry
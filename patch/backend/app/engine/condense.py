@@ -0,0 +1,183 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List
+from cachetools import LRUCache
+from llama_index.core.base.llms.generic_utils import messages_to_history_str
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.chat_engine import CondensePlusContextChatEngine
+
+logger = logging.getLogger("uvicorn")
+
+# - always: condense every follow-up question with the LLM
+# - heuristic: only the follow-up questions which look like they refer to the conversation
+# - never: send the questions as they are to the retriever
+CONDENSE_MODES = ["always", "heuristic", "never"]
+DEFAULT_CONDENSE_MODE = "heuristic"
+DEFAULT_MAX_ENTRIES = 1024
+# A question of fewer words is likely a follow-up, e.g. "and in 2023?"
+MIN_STANDALONE_WORDS = 4
+FOLLOW_UP_WORDS = frozenset(
+    "it its it's they them their theirs this that these those he him his she her "
+    "there former latter above previous earlier same also too else another other "
+    "more again".split()
+)
+FOLLOW_UP_PREFIXES = ("and ", "but ", "or ", "so ", "then ", "what about", "how about")
+WORD_PATTERN = re.compile(r"[\w']+")
+
+
+def get_condense_mode() -> str:
+    mode = os.getenv("CONDENSE_MODE", DEFAULT_CONDENSE_MODE)
+    if mode not in CONDENSE_MODES:
+        raise ValueError(
+            f"Unsupported condense mode: {mode}. Use one of {CONDENSE_MODES}"
+        )
+    return mode
+
+
+def is_standalone_question(question: str) -> bool:
+    """
+    Guess if a question can be answered without the conversation: long enough and without
+    words referring to a previous message. In doubt, the question is condensed.
+    """
+    text = question.strip().lower()
+    words = WORD_PATTERN.findall(text)
+    if len(words) < MIN_STANDALONE_WORDS or text.startswith(FOLLOW_UP_PREFIXES):
+        return False
+    return FOLLOW_UP_WORDS.isdisjoint(words)
+
+
+class CondenseCache:
+    """
+    In-process LRU cache of the condensed questions, keyed by (LLM, chat history, question),
+    with the number of questions condensed, answered from the cache or not condensed.
+    """
+
+    def __init__(self, max_entries: int):
+        self._questions: LRUCache | None = (
+            LRUCache(maxsize=max_entries) if max_entries > 0 else None
+        )
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+
+    def record_skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            question = self._questions.get(key) if self._questions is not None else None
+            if question is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return question
+
+    def put(self, key: str, question: str):
+        if self._questions is None:
+            return
+        with self._lock:
+            self._questions[key] = question
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.skipped + self.hits + self.misses
+            return {
+                "max_entries": self._questions.maxsize if self._questions else 0,
+                "entries": len(self._questions) if self._questions else 0,
+                "skipped": self.skipped,
+                "cache_hits": self.hits,
+                "llm_calls": self.misses,
+                "llm_call_rate": self.misses / total if total else 0.0,
+            }
+
+
+_condense_cache: CondenseCache | None = None
+_condense_cache_lock = threading.Lock()
+
+
+def get_condense_cache() -> CondenseCache:
+    """
+    Get the process-wide cache of the condensed questions, it only counts them
+    if it's disabled by CONDENSE_CACHE_MAX_ENTRIES=0.
+    """
+    global _condense_cache
+    with _condense_cache_lock:
+        if _condense_cache is None:
+            _condense_cache = CondenseCache(
+                max_entries=int(
+                    os.getenv("CONDENSE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+                )
+            )
+        return _condense_cache
+
+
+class ConditionalCondenseChatEngine(CondensePlusContextChatEngine):
+    """
+    Only condense the follow-up questions that need the conversation to be understood
+    (with CONDENSE_MODE=heuristic), and reuse the questions condensed before for the same
+    conversation. The first question of a conversation is never condensed.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._condense_mode = get_condense_mode()
+        self._condense_cache = get_condense_cache()
+
+    def _get_condense_key(self, chat_history_str: str, question: str) -> str:
+        return hashlib.sha256(
+            "\0".join(
+                [
+                    f"{self._llm.class_name()}:{self._llm.metadata.model_name}",
+                    self._condense_prompt_template.template,
+                    chat_history_str,
+                    question,
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def _skips_condense(self, chat_history: List[ChatMessage], question: str) -> bool:
+        if self._skip_condense or self._condense_mode == "never" or not chat_history:
+            return True
+        if self._condense_mode == "heuristic" and is_standalone_question(question):
+            self._condense_cache.record_skip()
+            return True
+        return False
+
+    def _condense_question(
+        self, chat_history: List[ChatMessage], latest_message: str
+    ) -> str:
+        if self._skips_condense(chat_history, latest_message):
+            return latest_message
+        chat_history_str = messages_to_history_str(chat_history)
+        key = self._get_condense_key(chat_history_str, latest_message)
+        question = self._condense_cache.get(key)
+        if question is None:
+            question = self._llm.predict(
+                self._condense_prompt_template,
+                question=latest_message,
+                chat_history=chat_history_str,
+            )
+            self._condense_cache.put(key, question)
+        return question
+
+    async def _acondense_question(
+        self, chat_history: List[ChatMessage], latest_message: str
+    ) -> str:
+        if self._skips_condense(chat_history, latest_message):
+            return latest_message
+        chat_history_str = messages_to_history_str(chat_history)
+        key = self._get_condense_key(chat_history_str, latest_message)
+        question = self._condense_cache.get(key)
+        if question is None:
+            question = await self._llm.apredict(
+                self._condense_prompt_template,
+                question=latest_message,
+                chat_history=chat_history_str,
+            )
+            self._condense_cache.put(key, question)
+        return question
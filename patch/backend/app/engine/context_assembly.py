@@ -0,0 +1,304 @@
+import os
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.llms import LLM
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import (
+    MetadataMode,
+    NodeRelationship,
+    NodeWithScore,
+    QueryBundle,
+    TextNode,
+)
+from llama_index.core.settings import Settings
+
+logger = logging.getLogger("uvicorn")
+
+# The share of the context window of the LLM given to the retrieved context,
+# unless CONTEXT_TOKEN_BUDGET is set
+DEFAULT_CONTEXT_WINDOW_SHARE = 0.5
+# A node is a near-duplicate if this share of its word shingles are in a node kept before
+DEFAULT_DUPLICATE_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+# A node cut to fit in the budget keeps at least this number of tokens, it's dropped otherwise
+MIN_TRUNCATED_TOKENS = 32
+
+
+class ContextStats:
+    """
+    The number of tokens of the retrieved context before and after the assembly.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.duplicates = 0
+        self.merged = 0
+        self.truncated = 0
+
+    def record(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        duplicates: int,
+        merged: int,
+        truncated: int,
+    ):
+        with self._lock:
+            self.requests += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.duplicates += duplicates
+            self.merged += merged
+            self.truncated += truncated
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            saved = self.input_tokens - self.output_tokens
+            return {
+                "requests": self.requests,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "tokens_saved": saved,
+                "tokens_saved_per_request": (
+                    saved / self.requests if self.requests else 0.0
+                ),
+                "duplicate_nodes": self.duplicates,
+                "merged_nodes": self.merged,
+                "truncated_nodes": self.truncated,
+            }
+
+
+_context_stats = ContextStats()
+
+
+def get_context_stats() -> ContextStats:
+    return _context_stats
+
+
+def _get_shingles(text: str) -> Set[Any]:
+    words = text.lower().split()
+    if len(words) < SHINGLE_SIZE:
+        return set(words)
+    return {
+        tuple(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def _is_text_slice(node: TextNode) -> bool:
+    # The text of the node is exactly its range of the source document,
+    # e.g. not a sentence replaced by its window
+    return (
+        node.start_char_idx is not None
+        and node.end_char_idx is not None
+        and len(node.text) == node.end_char_idx - node.start_char_idx
+    )
+
+
+class ContextAssembler(BaseNodePostprocessor):
+    """
+    Assemble the retrieved nodes into the context sent to the LLM: merge the overlapping
+    and consecutive chunks of a document, drop the near-duplicate nodes and cut the context
+    to `token_budget` tokens, the best ranked nodes first.
+    """
+
+    token_budget: int = Field(description="The maximum number of context tokens.")
+    duplicate_threshold: float = Field(default=DEFAULT_DUPLICATE_THRESHOLD)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextAssembler"
+
+    @staticmethod
+    def _get_content(node: NodeWithScore) -> str:
+        return node.node.get_content(metadata_mode=MetadataMode.LLM).strip()
+
+    def _merge_adjacent(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        """
+        Merge the chunks of a document which overlap or follow each other into the position
+        of the best ranked one.
+        """
+        documents: Dict[str, List[int]] = {}
+        for rank, node in enumerate(nodes):
+            if (
+                isinstance(node.node, TextNode)
+                and node.node.ref_doc_id
+                and _is_text_slice(node.node)
+            ):
+                documents.setdefault(node.node.ref_doc_id, []).append(rank)
+
+        merged_into: Dict[int, int] = {}
+        merged_nodes: Dict[int, NodeWithScore] = {}
+        for ranks in documents.values():
+            ranks.sort(key=lambda rank: nodes[rank].node.start_char_idx)
+            current_rank = ranks[0]
+            current = nodes[current_rank]
+            for rank in ranks[1:]:
+                node = nodes[rank]
+                overlap = current.node.end_char_idx - node.node.start_char_idx
+                is_next = (
+                    current.node.next_node is not None
+                    and current.node.next_node.node_id == node.node.node_id
+                )
+                if overlap < 0 and not is_next:
+                    current_rank, current = rank, node
+                    continue
+                if current_rank not in merged_nodes:
+                    current = NodeWithScore(
+                        node=current.node.copy(), score=current.score
+                    )
+                    merged_nodes[current_rank] = current
+                if overlap >= 0:
+                    current.node.text += node.node.text[overlap:]
+                else:
+                    current.node.text += "\n" + node.node.text
+                current.node.end_char_idx = max(
+                    current.node.end_char_idx, node.node.end_char_idx
+                )
+                if NodeRelationship.NEXT in node.node.relationships:
+                    # The copy shares the relationships of the retrieved node
+                    current.node.relationships = {
+                        **current.node.relationships,
+                        NodeRelationship.NEXT: node.node.relationships[
+                            NodeRelationship.NEXT
+                        ],
+                    }
+                current.score = max(current.score or 0.0, node.score or 0.0)
+                merged_into[rank] = current_rank
+        if not merged_into:
+            return nodes
+
+        # The merged node takes the best rank of its chunks
+        best_ranks: Dict[int, int] = {}
+        for rank, target in merged_into.items():
+            best_ranks[target] = min(best_ranks.get(target, target), rank)
+        ordered = sorted(
+            (best_ranks.get(rank, rank), merged_nodes.get(rank, node))
+            for rank, node in enumerate(nodes)
+            if rank not in merged_into
+        )
+        return [node for _, node in ordered]
+
+    def _drop_duplicates(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        kept, kept_shingles = [], []
+        for node in nodes:
+            shingles = _get_shingles(self._get_content(node))
+            if shingles and any(
+                len(shingles & other) >= self.duplicate_threshold * len(shingles)
+                for other in kept_shingles
+            ):
+                continue
+            kept.append(node)
+            kept_shingles.append(shingles)
+        return kept
+
+    def _fit_budget(
+        self, nodes: List[NodeWithScore], token_counts: List[int]
+    ) -> Tuple[List[NodeWithScore], int]:
+        """
+        Keep the nodes that fit in the token budget, the first one past it is cut
+        if enough of the budget is left. Return the kept nodes and their tokens,
+        never more than the budget.
+        """
+        kept, total = [], 0
+        for node, tokens in zip(nodes, token_counts):
+            remaining = self.token_budget - total
+            if tokens <= remaining:
+                kept.append(node)
+                total += tokens
+                continue
+            if remaining >= MIN_TRUNCATED_TOKENS and isinstance(node.node, TextNode):
+                truncated, tokens = self._truncate(node, remaining)
+                if truncated is not None:
+                    kept.append(truncated)
+                    total += tokens
+            break
+        return kept, total
+
+    def _truncate(
+        self, node: NodeWithScore, remaining: int
+    ) -> Tuple[Optional[NodeWithScore], int]:
+        """
+        Cut the text of a node at a word boundary so the node with its metadata fits in
+        `remaining` tokens. Return the cut node and its tokens, None if less than
+        MIN_TRUNCATED_TOKENS tokens of its text would be left.
+        """
+        tokenizer = Settings.tokenizer
+        text = node.node.text
+        text_tokens = len(tokenizer(text))
+        # Only the text is cut, the metadata of the node is kept whole
+        metadata_tokens = len(tokenizer(self._get_content(node))) - text_tokens
+        text_budget = remaining - metadata_tokens
+        while text and text_budget >= MIN_TRUNCATED_TOKENS:
+            # The tokens are about evenly spread in the text
+            length = int(len(text) * text_budget / max(text_tokens, 1))
+            text = text[: min(length, len(text) - 1)].rsplit(" ", 1)[0]
+            truncated = NodeWithScore(
+                node=node.node.copy(update={"text": text}), score=node.score
+            )
+            tokens = len(tokenizer(self._get_content(truncated)))
+            if tokens <= remaining:
+                return truncated, tokens
+            # Cut the tokens past the budget from the text again
+            text_tokens = len(tokenizer(text))
+            text_budget = text_tokens - (tokens - remaining)
+        return None, 0
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if not nodes:
+            return nodes
+        tokenizer = Settings.tokenizer
+        input_tokens = sum(len(tokenizer(self._get_content(node))) for node in nodes)
+
+        merged = self._merge_adjacent(nodes)
+        unique = self._drop_duplicates(merged)
+        token_counts = [len(tokenizer(self._get_content(node))) for node in unique]
+        assembled, output_tokens = self._fit_budget(unique, token_counts)
+        # The last kept node is a new one if it was cut to fit in the budget
+        cut = bool(assembled) and assembled[-1] is not unique[len(assembled) - 1]
+
+        _context_stats.record(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            duplicates=len(merged) - len(unique),
+            merged=len(nodes) - len(merged),
+            truncated=len(unique) - len(assembled) + cut,
+        )
+        logger.debug(
+            f"Assembled {len(nodes)} nodes of {input_tokens} tokens into "
+            f"{len(assembled)} nodes of {output_tokens} tokens"
+        )
+        return assembled
+
+
+def get_context_token_budget(llm: LLM) -> int:
+    """
+    Get the token budget of the retrieved context, CONTEXT_TOKEN_BUDGET or a share
+    of the context window of the model.
+    """
+    budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+    if budget > 0:
+        return budget
+    return int(llm.metadata.context_window * DEFAULT_CONTEXT_WINDOW_SHARE)
+
+
+def get_context_assembler(llm: LLM) -> ContextAssembler | None:
+    """
+    Get the context assembler for the LLM, None if it's disabled by CONTEXT_ASSEMBLY_ENABLED=false.
+    """
+    if os.getenv("CONTEXT_ASSEMBLY_ENABLED", "true").lower() != "true":
+        return None
+    return ContextAssembler(
+        token_budget=get_context_token_budget(llm),
+        duplicate_threshold=float(
+            os.getenv("CONTEXT_DUPLICATE_THRESHOLD", DEFAULT_DUPLICATE_THRESHOLD)
+        ),
+    )
@@ -0,0 +1,174 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.kvstore.types import BaseKVStore, DEFAULT_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+DOCSTORE_FILE = "docstore.sqlite"
+LEGACY_DOCSTORE_FILE = "docstore.json"
+# The documents are stored as {"__data__": {..., "metadata": {...}}, "__type__": ...}
+FILE_PATH_EXPRESSION = "json_extract(value, '$.__data__.metadata.file_path')"
+
+
+class SQLiteKVStore(BaseKVStore):
+    """
+    A key-value store on SQLite, every write only touches the changed keys
+    and the values are only loaded when they are requested.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kvstore ("
+            "collection TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (collection, key))"
+        )
+        # Find the documents of a file without loading the whole docstore
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS kvstore_file_path "
+            f"ON kvstore (collection, {FILE_PATH_EXPRESSION})"
+        )
+        self._conn.commit()
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put_all([(key, val)], collection=collection)
+
+    async def aput(
+        self, key: str, val: dict, collection: str = DEFAULT_COLLECTION
+    ) -> None:
+        self.put(key, val, collection=collection)
+
+    def put_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = 1,
+    ) -> None:
+        # All the pairs are written in a single transaction, whatever the batch size
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO kvstore (collection, key, value) VALUES (?, ?, ?)",
+                [(collection, key, json.dumps(val)) for key, val in kv_pairs],
+            )
+            self._conn.commit()
+
+    async def aput_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = 1,
+    ) -> None:
+        self.put_all(kv_pairs, collection=collection, batch_size=batch_size)
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kvstore WHERE collection = ? AND key = ?",
+                (collection, key),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def aget(
+        self, key: str, collection: str = DEFAULT_COLLECTION
+    ) -> Optional[dict]:
+        return self.get(key, collection=collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM kvstore WHERE collection = ?", (collection,)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection=collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM kvstore WHERE collection = ? AND key = ?",
+                (collection, key),
+            )
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection=collection)
+
+    def get_keys_by_file_path(
+        self, file_paths: Iterable[str], collection: str
+    ) -> List[str]:
+        file_paths = list(file_paths)
+        if not file_paths:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key FROM kvstore WHERE collection = ? AND {FILE_PATH_EXPRESSION} "
+                f"IN ({','.join('?' * len(file_paths))})",
+                [collection, *file_paths],
+            ).fetchall()
+        return [key for (key,) in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SQLiteDocumentStore(KVDocumentStore):
+    """
+    A document store persisted incrementally in SQLite instead of a single JSON file.
+    """
+
+    def __init__(self, kvstore: SQLiteKVStore, namespace: Optional[str] = None):
+        super().__init__(kvstore, namespace=namespace)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "SQLiteDocumentStore":
+        """
+        Open the docstore in `persist_dir`, migrating a JSON docstore persisted there before.
+        """
+        kvstore = SQLiteKVStore(os.path.join(persist_dir, DOCSTORE_FILE))
+        legacy_path = os.path.join(persist_dir, LEGACY_DOCSTORE_FILE)
+        if os.path.exists(legacy_path):
+            migrate_simple_doc_store(legacy_path, kvstore)
+        return cls(kvstore)
+
+    def get_ref_doc_ids_by_file_path(self, file_paths: Iterable[str]) -> List[str]:
+        """
+        Get the ids of the documents that were loaded from the given files.
+        """
+        # The readers store either the given or the absolute file path
+        candidates = set()
+        for file_path in file_paths:
+            candidates.update({file_path, os.path.abspath(file_path)})
+        return self._kvstore.get_keys_by_file_path(
+            candidates, collection=self._node_collection
+        )
+
+
+def migrate_simple_doc_store(legacy_path: str, kvstore: SQLiteKVStore):
+    """
+    Copy a SimpleDocumentStore JSON file into the SQLite key-value store,
+    then rename the JSON file so it's only migrated once.
+    """
+    logger.info(f"Migrate the docstore {legacy_path} to {kvstore.path}")
+    simple_doc_store = SimpleDocumentStore.from_persist_path(legacy_path)
+    simple_kvstore = simple_doc_store._kvstore
+    for collection in list(simple_kvstore._data):
+        kvstore.put_all(
+            list(simple_kvstore.get_all(collection=collection).items()),
+            collection=collection,
+        )
+    os.replace(legacy_path, f"{legacy_path}.migrated")
@@ -0,0 +1,194 @@
+import os
+import time
+import array
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode, MetadataMode, TransformComponent
+from app.engine.embedding_executor import EmbeddingExecutor, get_embedding_executor
+
+logger = logging.getLogger(__name__)
+
+# Keep the cache out of STORAGE_DIR, so it survives resetting the index
+DEFAULT_CACHE_PATH = "storage/embedding_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 200_000
+
+
+class EmbeddingCache:
+    """
+    A persistent embedding cache on SQLite keyed by (embedding model, text hash)
+    with a least-recently-used eviction once `max_entries` is exceeded.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(
+        self, model_name: str, texts: Sequence[str]
+    ) -> List[Optional[List[float]]]:
+        keys = [self._key(model_name, text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            # Stay below SQLite's limit of variables per query
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array.array("f", blob).tolist()
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+            self._conn.commit()
+            self.hits += len([key for key in keys if key in found])
+            self.misses += len([key for key in keys if key not in found])
+        return [found.get(key) for key in keys]
+
+    def put_many(
+        self,
+        model_name: str,
+        texts: Sequence[str],
+        embeddings: Sequence[List[float]],
+    ):
+        now = time.time()
+        rows = [
+            (self._key(model_name, text), array.array("f", embedding).tobytes(), now)
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries": count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CachedEmbedding(TransformComponent):
+    """
+    Embed the nodes with `embed_model` through the embedding executor and only embed
+    the texts that are not in the embedding cache yet (if the cache is enabled).
+    """
+
+    embed_model: BaseEmbedding = Field(description="The embedding model to use.")
+    _cache: EmbeddingCache | None = PrivateAttr()
+    _executor: EmbeddingExecutor = PrivateAttr()
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        cache: EmbeddingCache | None,
+        executor: EmbeddingExecutor,
+        **kwargs,
+    ):
+        super().__init__(embed_model=embed_model, **kwargs)
+        self._cache = cache
+        self._executor = executor
+
+    @property
+    def model_key(self) -> str:
+        return f"{self.embed_model.class_name()}:{self.embed_model.model_name}"
+
+    def __call__(self, nodes: List[BaseNode], **kwargs: Any) -> List[BaseNode]:
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        if self._cache is not None:
+            embeddings = self._cache.get_many(self.model_key, texts)
+        else:
+            embeddings = [None] * len(texts)
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_embeddings = self._executor.embed(missing_texts)
+            if self._cache is not None:
+                self._cache.put_many(self.model_key, missing_texts, new_embeddings)
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+        logger.info(
+            f"Embedded {len(missing)} nodes, {len(nodes) - len(missing)} nodes from the embedding cache"
+        )
+
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        return nodes
+
+
+_embedding_cache: EmbeddingCache | None = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache | None:
+    """
+    Get the process-wide embedding cache, None if it's disabled by EMBEDDING_CACHE_MAX_ENTRIES=0.
+    """
+    global _embedding_cache
+    max_entries = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    if max_entries <= 0:
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                path=os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_entries=max_entries,
+            )
+        return _embedding_cache
+
+
+def get_embedding_transform(embed_model: BaseEmbedding) -> TransformComponent:
+    """
+    Get the embedding step of the ingestion pipeline, cached if the cache is enabled.
+    """
+    return CachedEmbedding(
+        embed_model=embed_model,
+        cache=get_embedding_cache(),
+        executor=get_embedding_executor(embed_model),
+    )
@@ -0,0 +1,195 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, List, Sequence, Tuple
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+logger = logging.getLogger(__name__)
+
+# Default (batch size, concurrent requests) per MODEL_PROVIDER
+PROVIDER_DEFAULTS: Dict[str, Tuple[int, int]] = {
+    "ollama": (16, 2),
+    "openai": (128, 4),
+    "azure-openai": (64, 4),
+    "gemini": (64, 2),
+}
+FALLBACK_DEFAULTS = (32, 2)
+
+# Grow the batch size back after this many successful batches in a row
+GROW_AFTER_SUCCESSES = 5
+MAX_RETRIES = 6
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """
+    Whether the error is a rate limit or a timeout of the embedding provider,
+    so that retrying with smaller batches can help.
+    """
+    if isinstance(error, TimeoutError):
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(
+        marker in text
+        for marker in (
+            "429",
+            "rate limit",
+            "ratelimit",
+            "too many requests",
+            "resourceexhausted",
+            "resource exhausted",
+            "timeout",
+            "timed out",
+        )
+    )
+
+
+class EmbeddingExecutor:
+    """
+    Embed texts in batches with a bounded number of concurrent requests to the provider.
+    The batch size is halved on rate limits or timeouts and grows back on successive successes.
+    """
+
+    def __init__(self, embed_model: BaseEmbedding, batch_size: int, concurrency: int):
+        self.embed_model = embed_model
+        self.max_batch_size = max(1, batch_size)
+        self.batch_size = self.max_batch_size
+        self.concurrency = max(1, concurrency)
+        self.chunks = 0
+        self.seconds = 0.0
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def throughput(self) -> float:
+        """
+        The embedding throughput in chunks per second.
+        """
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def _on_success(self):
+        with self._lock:
+            self._successes += 1
+            if (
+                self._successes >= GROW_AFTER_SUCCESSES
+                and self.batch_size < self.max_batch_size
+            ):
+                self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+                self._successes = 0
+
+    def _on_throttled(self, failed_batch_size: int):
+        with self._lock:
+            self._successes = 0
+            # Concurrent batches failing together must only halve the batch size once
+            self.batch_size = max(1, min(self.batch_size, failed_batch_size // 2))
+            logger.warning(
+                f"Embedding provider is throttling, reduce the batch size to {self.batch_size}"
+            )
+
+    def _split(self, start: int, end: int) -> List[Tuple[int, int]]:
+        return [
+            (i, min(i + self.batch_size, end))
+            for i in range(start, end, self.batch_size)
+        ]
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        embeddings: List[Any] = [None] * len(texts)
+        if not texts:
+            return embeddings
+
+        started = time.perf_counter()
+        pending = deque((start, end, 0) for start, end in self._split(0, len(texts)))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = {}
+            while pending or in_flight:
+                while pending and len(in_flight) < self.concurrency:
+                    start, end, attempt = pending.popleft()
+                    # Not `get_text_embedding_batch`: it splits the texts again in batches
+                    # of the model's `embed_batch_size` sent one after the other, so the
+                    # provider wouldn't get the batch size learned here in one request.
+                    # `_get_text_embeddings` is the one request hook it calls per batch.
+                    future = pool.submit(
+                        self.embed_model._get_text_embeddings, list(texts[start:end])
+                    )
+                    in_flight[future] = (start, end, attempt)
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end, attempt = in_flight.pop(future)
+                    try:
+                        embeddings[start:end] = future.result()
+                    except Exception as e:
+                        if not is_throttling_error(e) or attempt >= MAX_RETRIES:
+                            raise
+                        self._on_throttled(end - start)
+                        # Back off before sending the smaller batches again
+                        time.sleep(min(30.0, 0.5 * 2**attempt))
+                        pending.extendleft(
+                            (batch_start, batch_end, attempt + 1)
+                            for batch_start, batch_end in reversed(
+                                self._split(start, end)
+                            )
+                        )
+                    else:
+                        self._on_success()
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.chunks += len(texts)
+            self.seconds += elapsed
+        logger.info(
+            f"Embedded {len(texts)} chunks in {elapsed:.2f}s "
+            f"({len(texts) / elapsed if elapsed else 0:.1f} chunks/s, batch size {self.batch_size})"
+        )
+        return embeddings
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "chunks": self.chunks,
+            "seconds": self.seconds,
+            "chunks_per_second": self.throughput,
+            "batch_size": self.batch_size,
+            "max_batch_size": self.max_batch_size,
+            "concurrency": self.concurrency,
+        }
+
+
+_executors: Dict[Tuple[str, str], EmbeddingExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_embedding_executor(embed_model: BaseEmbedding) -> EmbeddingExecutor:
+    """
+    Get the executor of the embedding model, configured for the current MODEL_PROVIDER.
+    The executor is kept per model, so the learned batch size and the throughput stay across runs.
+    """
+    provider = os.getenv("MODEL_PROVIDER", "")
+    default_batch_size, default_concurrency = PROVIDER_DEFAULTS.get(
+        provider, FALLBACK_DEFAULTS
+    )
+    batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", default_batch_size))
+    concurrency = int(os.getenv("EMBEDDING_CONCURRENCY", default_concurrency))
+
+    key = (provider, f"{embed_model.class_name()}:{embed_model.model_name}")
+    with _executors_lock:
+        executor = _executors.get(key)
+        if (
+            executor is None
+            or executor.max_batch_size != batch_size
+            or executor.concurrency != concurrency
+        ):
+            executor = EmbeddingExecutor(embed_model, batch_size, concurrency)
+            _executors[key] = executor
+        # Use the latest model instance, `init_settings` re-creates it
+        executor.embed_model = embed_model
+        return executor
+
+
+def get_embedding_stats() -> List[Dict[str, Any]]:
+    with _executors_lock:
+        return [
+            {"provider": provider, "model": model, **executor.stats()}
+            for (provider, model), executor in _executors.items()
+        ]
@@ -0,0 +1,83 @@
+import os
+import hashlib
+import logging
+import threading
+from typing import List, Tuple
+from cachetools import LRUCache
+from llama_index.core.indices import VectorStoreIndex
+from llama_index.core.tools import BaseTool
+from app.engine.tools import ToolFactory
+from app.engine.agent import guard_tool
+from app.engine.index import get_index
+from app.engine.semantic_cache import invalidate_semantic_cache
+from app.engine.vectordb import get_physical_collection, resolve_collection
+
+logger = logging.getLogger("uvicorn")
+
+TOOLS_CONFIG_FILE = "config/tools.yaml"
+
+# The index (with its vector store client) and the tools are expensive to create,
+# so they are shared by all chat requests of a collection with the same configuration.
+# The chat engines themselves hold the conversation memory and callback handlers
+# of a request, so they are still created per request on top of these components.
+_components: LRUCache = LRUCache(maxsize=int(os.getenv("ENGINE_CACHE_SIZE", "16")))
+_lock = threading.Lock()
+
+
+def _get_tools_config() -> str:
+    try:
+        with open(TOOLS_CONFIG_FILE, "r") as f:
+            return hashlib.sha256(f.read().encode("utf-8")).hexdigest()
+    except FileNotFoundError:
+        return ""
+
+
+def get_engine_cache_key(collection_name: str) -> Tuple:
+    return (
+        collection_name,
+        # The index changes when the collection switches to another version
+        get_physical_collection(collection_name),
+        os.getenv("MODEL_PROVIDER"),
+        os.getenv("MODEL"),
+        os.getenv("EMBEDDING_MODEL"),
+        _get_tools_config(),
+        os.getenv("SYSTEM_PROMPT"),
+    )
+
+
+def get_engine_components(
+    collection_name: str | None = None,
+) -> Tuple[VectorStoreIndex, List[BaseTool]]:
+    """
+    Get the index of the collection and the tools of the chat engine for the current configuration.
+    """
+    collection_name = resolve_collection(collection_name)
+    key = get_engine_cache_key(collection_name)
+    with _lock:
+        components = _components.get(key)
+        if components is None:
+            index = get_index(collection_name)
+            if index is None:
+                raise RuntimeError("Index is not found")
+            # The tools keep their cached results as long as the components are cached
+            components = (index, [guard_tool(tool) for tool in ToolFactory.from_env()])
+            _components[key] = components
+    index, tools = components
+    # Copy the tools, the engine adds its query engine tool to the list
+    return index, list(tools)
+
+
+def invalidate_engine_cache(collection_name: str | None = None):
+    """
+    Drop the cached engine components, must be called when the model, tools or chat config changes.
+    Only drop the components of `collection_name` if it's given.
+    """
+    with _lock:
+        if collection_name is None:
+            _components.clear()
+        else:
+            for key in [key for key in _components if key[0] == collection_name]:
+                _components.pop(key)
+    # The cached responses were generated with the dropped components
+    invalidate_semantic_cache(collection_name)
+    logger.info("Invalidated the chat engine cache")
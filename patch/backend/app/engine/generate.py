@@ -3,84 +3,400 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import yaml
 import logging
+import shutil
+import itertools
+import threading
+from typing import Callable, Dict, Iterable, List
 from llama_index.core.settings import Settings
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import Document
 from llama_index.core.storage import StorageContext
 from app.settings import init_settings
-from app.engine.loaders import get_documents
-from app.engine.vectordb import get_vector_store
+from app.engine.chunking import get_node_parser
+from app.engine.collection_registry import (
+    REGISTRY_FILE,
+    get_collection_registry,
+    get_embedding_config,
+)
+from app.engine.docstore import SQLiteDocumentStore
+from app.engine.embedding_cache import get_embedding_transform
+from app.engine.hybrid_retriever import forget_sparse_index, get_sparse_index
+from app.engine.index import get_embed_model
+from app.engine.vector_store_writer import get_vector_store_writer
+from app.engine.loaders.file import (
+    FileLoaderConfig,
+    get_file_documents,
+    iter_file_documents,
+    list_data_files,
+)
+from app.engine.manifest import FileManifest, ManifestDiff
+from app.engine.retrieval_cache import bump_index_version
+from app.engine.semantic_cache import invalidate_semantic_cache
+from app.engine.sparse_index import SparseIndexWriter
+from app.engine.vectordb import (
+    get_physical_collection,
+    get_vector_store,
+    resolve_collection,
+)
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 
 STORAGE_DIR = os.getenv("STORAGE_DIR", "storage")
+LOADER_CONFIG_FILE = "config/loaders.yaml"
+# The number of documents chunked, embedded and written at a time by the ingestion
+DEFAULT_DOCUMENT_BATCH_SIZE = 16
 
+# The docstore of a collection is loaded, updated and persisted as a whole,
+# so only one ingestion may touch the stores of a collection at a time
+_index_locks: Dict[str, threading.Lock] = {}
+_index_locks_lock = threading.Lock()
 
-def get_doc_store():
 
-    # If the storage directory is there, load the document store from it.
-    # If not, set up an in-memory document store since we can't load from a directory that doesn't exist.
-    if os.path.exists(STORAGE_DIR):
-        return SimpleDocumentStore.from_persist_dir(STORAGE_DIR)
-    else:
-        return SimpleDocumentStore()
+def get_index_lock(collection_name: str) -> threading.Lock:
+    with _index_locks_lock:
+        return _index_locks.setdefault(collection_name, threading.Lock())
 
 
-def run_pipeline(docstore, vector_store, documents):
-    temp_document = []
+def get_storage_dir(collection_name: str) -> str:
+    """
+    Get the directory of the docstore of a collection, the one of its active version
+    if it has been re-indexed.
+    """
+    return os.path.join(STORAGE_DIR, get_physical_collection(collection_name))
+
+
+def migrate_legacy_storage(storage_dir: str):
+    """
+    Move a docstore persisted directly in STORAGE_DIR (before the storage was split
+    per collection) to the directory of the default collection.
+    """
+    legacy_files = [
+        name
+        for name in os.listdir(STORAGE_DIR)
+        if name.endswith(".json")
+        and name != REGISTRY_FILE
+        and os.path.isfile(os.path.join(STORAGE_DIR, name))
+    ]
+    if not legacy_files or os.path.exists(storage_dir):
+        return
+    logger.info(f"Move the docstore in {STORAGE_DIR} to {storage_dir}")
+    os.makedirs(storage_dir)
+    for name in legacy_files:
+        shutil.move(os.path.join(STORAGE_DIR, name), os.path.join(storage_dir, name))
+
+
+def get_doc_store(collection_name: str | None = None):
+    collection_name = resolve_collection(collection_name)
+    storage_dir = get_storage_dir(collection_name)
+    if collection_name == resolve_collection() and os.path.exists(STORAGE_DIR):
+        migrate_legacy_storage(storage_dir)
+
+    # The documents are written to the store as they change and only read when needed,
+    # a JSON docstore of a previous version in the storage directory is migrated first
+    return SQLiteDocumentStore.from_persist_dir(storage_dir)
+
+
+def upsert_documents(
+    docstore, vector_store, documents: List[Document], sparse_index=None
+) -> List[Document]:
+    """
+    Add the new and changed documents to the docstore and return them, the unchanged ones
+    are skipped. The hash of each document is looked up on its own in the docstore,
+    and the previous version of a changed document is deleted from the stores.
+    """
+    changed = {}
     for document in documents:
-        lines = document.text.splitlines()
-        for line in lines:
-            # Create a temporary document for each line
-            temp_document.append(type(document)(text=line))
-
-    pipeline = IngestionPipeline(
-        transformations=[
-            SentenceSplitter(
-                # separator='\n',
-                chunk_size=Settings.chunk_size,
-                chunk_overlap=Settings.chunk_overlap,
-            ),
-            Settings.embed_model,
-        ],
-        docstore=docstore,
-        docstore_strategy="upserts_and_delete",
-        vector_store=vector_store,
+        existing_hash = docstore.get_document_hash(document.doc_id)
+        if existing_hash == document.hash:
+            continue
+        if existing_hash:
+            delete_documents(
+                docstore, vector_store, [document.doc_id], sparse_index=sparse_index
+            )
+        changed[document.doc_id] = document
+    documents = list(changed.values())
+    # Also stores the hashes of the documents
+    docstore.add_documents(documents)
+    return documents
+
+
+def run_pipeline(
+    docstore,
+    vector_store,
+    documents: Iterable[Document],
+    embed_model=None,
+    sparse_index=None,
+):
+    """
+    Index the new and changed documents in batches of INGESTION_DOCUMENT_BATCH_SIZE documents,
+    only the nodes of one batch and the embeddings of the batches being written are in memory.
+    The documents of the docstore that are not given are kept.
+    """
+    transformations = [
+        # Split the documents with the configured CHUNK_STRATEGY,
+        # the nodes keep the id and metadata of their source document
+        get_node_parser(),
+    ]
+    if sparse_index is not None:
+        # Also index the terms of the chunks for the hybrid retrieval
+        transformations.append(SparseIndexWriter(sparse_index))
+    # Only embed the chunks that are not in the embedding cache yet,
+    # and write them to the vector store batch by batch
+    transformations.append(
+        get_vector_store_writer(
+            get_embedding_transform(embed_model or Settings.embed_model),
+            vector_store,
         )
-    pipeline.disable_cache = True
-    nodes = pipeline.run(show_progress=True, documents=temp_document)
-            
-    return nodes
+    )
+    batch_size = max(
+        1,
+        int(os.getenv("INGESTION_DOCUMENT_BATCH_SIZE", DEFAULT_DOCUMENT_BATCH_SIZE)),
+    )
+    documents = iter(documents)
+    while batch := list(itertools.islice(documents, batch_size)):
+        batch = upsert_documents(docstore, vector_store, batch, sparse_index)
+        if batch:
+            run_transformations(batch, transformations, show_progress=True)
 
 
-def persist_storage(docstore, vector_store):
+def persist_storage(docstore, vector_store, collection_name: str | None = None):
     storage_context = StorageContext.from_defaults(
         docstore=docstore,
         vector_store=vector_store,
     )
-    storage_context.persist(STORAGE_DIR)
+    storage_dir = get_storage_dir(resolve_collection(collection_name))
+    storage_context.persist(storage_dir)
+    # The next query reopens the sparse index, its directory may have been rebuilt (reset)
+    forget_sparse_index(storage_dir)
+    # The cached retrieval results and chat responses may be outdated by the changed documents
+    collection_name = get_collection_registry().get_collection(
+        resolve_collection(collection_name)
+    )
+    bump_index_version(collection_name)
+    invalidate_semantic_cache(collection_name)
+
+
+def record_embedding(collection_name: str):
+    """
+    Record the embedding model of the served version of a collection before it's first written,
+    its queries are embedded with the same model after the embedding config changes.
+    """
+    get_collection_registry().record_embedding(
+        get_physical_collection(collection_name), get_embedding_config()
+    )
+
+
+def get_file_ref_doc_ids(docstore, file_paths: List[str]) -> List[str]:
+    """
+    Get the ids of the documents in the docstore that were loaded from the given files.
+    """
+    return docstore.get_ref_doc_ids_by_file_path(file_paths)
+
+
+def delete_documents(docstore, vector_store, ref_doc_ids: List[str], sparse_index=None):
+    """
+    Delete the documents and their nodes from the docstore, the vector store
+    and the sparse index if there is one.
+    """
+    for ref_doc_id in ref_doc_ids:
+        vector_store.delete(ref_doc_id)
+        docstore.delete_document(ref_doc_id, raise_error=False)
+    if sparse_index is not None:
+        sparse_index.delete_ref_docs(ref_doc_ids)
+
+
+def get_file_loader_config(**kwargs) -> FileLoaderConfig:
+    with open(LOADER_CONFIG_FILE, "r") as f:
+        config = yaml.safe_load(f) or {}
+    return FileLoaderConfig(**{**config.get("file", {}), **kwargs})
+
+
+def get_documents_from_files(file_paths: List[str]):
+    return get_file_documents(get_file_loader_config(), input_files=file_paths)
 
 
-def generate_datasource():
-    init_settings()
-    logger.info("Generate index for the provided data")
+def index_documents(
+    file_paths: List[str], documents, collection_name: str | None = None
+):
+    """
+    Index the already loaded documents of the given files in a collection.
+    """
+    collection_name = resolve_collection(collection_name)
+    with get_index_lock(collection_name):
+        init_settings()
+        logger.info(f"Generate index of {collection_name} for the files: {file_paths}")
+
+        docstore = get_doc_store(collection_name)
+        vector_store = get_vector_store(collection_name)
+        sparse_index = get_sparse_index(get_storage_dir(collection_name))
+        record_embedding(collection_name)
+
+        # Drop the previous version of the files (e.g. re-uploaded files) first,
+        # so that documents which don't exist anymore don't stay in the index
+        delete_documents(
+            docstore,
+            vector_store,
+            get_file_ref_doc_ids(docstore, file_paths),
+            sparse_index=sparse_index,
+        )
+        # Only upsert the new documents, the other documents in the stores must be kept
+        run_pipeline(
+            docstore,
+            vector_store,
+            documents,
+            embed_model=get_embed_model(collection_name),
+            sparse_index=sparse_index,
+        )
+
+        persist_storage(docstore, vector_store, collection_name)
+
+        manifest = FileManifest.load(get_storage_dir(collection_name))
+        for file_path in file_paths:
+            manifest.remove_file(file_path)
+        manifest.set_documents(documents)
+        manifest.save()
+
+        logger.info("Finished indexing the files")
+
+
+def remove_files(file_paths: List[str], collection_name: str | None = None):
+    """
+    Remove the nodes of the given files from the vector store and the docstore of a collection.
+    """
+    collection_name = resolve_collection(collection_name)
+    with get_index_lock(collection_name):
+        init_settings()
+        logger.info(
+            f"Remove the files from the index of {collection_name}: {file_paths}"
+        )
+
+        docstore = get_doc_store(collection_name)
+        vector_store = get_vector_store(collection_name)
+        sparse_index = get_sparse_index(get_storage_dir(collection_name))
+
+        ref_doc_ids = get_file_ref_doc_ids(docstore, file_paths)
+        delete_documents(docstore, vector_store, ref_doc_ids, sparse_index=sparse_index)
+
+        persist_storage(docstore, vector_store, collection_name)
+
+        manifest = FileManifest.load(get_storage_dir(collection_name))
+        for file_path in file_paths:
+            manifest.remove_file(file_path)
+        manifest.save()
+
+        logger.info(f"Removed {len(ref_doc_ids)} documents from the index")
+
+
+def get_collection_loader_config(collection_name: str) -> FileLoaderConfig | None:
+    """
+    Get the file loader config of a collection, only its files in `data/{collection_name}`.
+    The default collection too: the data folder has the folders of the other collections.
+    """
+    # The versions of a collection share its files
+    collection_name = get_collection_registry().get_collection(collection_name)
+    data_dir = os.path.join("data", collection_name)
+    if not os.path.exists(data_dir):
+        return None
+    return get_file_loader_config(data_dir=data_dir)
+
+
+def get_collection_diff(collection_name: str | None = None) -> ManifestDiff:
+    """
+    Get the files of a collection that changed since they were indexed, without indexing them.
+    """
+    collection_name = resolve_collection(collection_name)
+    loader_config = get_collection_loader_config(collection_name)
+    file_paths = list_data_files(loader_config) if loader_config else []
+    return FileManifest.load(get_storage_dir(collection_name)).diff(file_paths)
+
+
+def generate_datasource(
+    collection_name: str | None = None,
+    on_progress: Callable[[int, int], None] | None = None,
+):
+    """
+    Index the new, modified and deleted files of a collection (or of one of its versions).
+    `on_progress` is called with the number of indexed and changed files.
+    """
+    collection_name = resolve_collection(collection_name)
+    with get_index_lock(collection_name):
+        init_settings()
+        logger.info(f"Generate index of {collection_name} for the provided data")
+
+        # Get the stores or create new ones
+        docstore = get_doc_store(collection_name)
+        vector_store = get_vector_store(collection_name)
+        sparse_index = get_sparse_index(get_storage_dir(collection_name))
+        record_embedding(collection_name)
+
+        # Only parse the files that changed since the last run
+        loader_config = get_collection_loader_config(collection_name)
+        file_paths = list_data_files(loader_config) if loader_config else []
+        manifest = FileManifest.load(get_storage_dir(collection_name))
+        diff = manifest.diff(file_paths)
+        logger.info(
+            f"{len(diff.new)} new, {len(diff.modified)} modified, {len(diff.deleted)} deleted "
+            f"and {diff.unchanged} unchanged files"
+        )
+
+        # Drop the previous version of the modified and deleted files
+        for file_path in diff.modified + diff.deleted:
+            delete_documents(
+                docstore,
+                vector_store,
+                manifest.get_doc_ids(file_path)
+                + get_file_ref_doc_ids(docstore, [file_path]),
+                sparse_index=sparse_index,
+            )
+            manifest.remove_file(file_path)
 
-    # Get the stores and documents or create new ones
-    documents = get_documents()
-    docstore = get_doc_store()
-    vector_store = get_vector_store()
+        # Run the ingestion pipeline on the documents as soon as they are parsed,
+        # the other files are still being parsed in the meantime
+        doc_ids = set()
+        files_done = 0
+        if on_progress:
+            on_progress(files_done, len(diff.changed))
+        if diff.changed:
+            for documents in iter_file_documents(
+                loader_config, input_files=diff.changed
+            ):
+                run_pipeline(
+                    docstore,
+                    vector_store,
+                    documents,
+                    embed_model=get_embed_model(collection_name),
+                    sparse_index=sparse_index,
+                )
+                doc_ids.update(document.doc_id for document in documents)
+                manifest.set_documents(documents)
+                if on_progress:
+                    files_done += len(
+                        {document.metadata.get("file_path") for document in documents}
+                    )
+                    on_progress(min(files_done, len(diff.changed)), len(diff.changed))
+        # Also remember the files without any documents (e.g. empty files)
+        for file_path in diff.changed:
+            if file_path not in manifest:
+                manifest.set_file(file_path, [])
 
-    # Run the ingestion pipeline
-    _ = run_pipeline(docstore, vector_store, documents)
+        if not manifest.exists:
+            # Without a manifest, the index may still have documents of files deleted before
+            stale_doc_ids = set(docstore.get_all_document_hashes().values()) - doc_ids
+            delete_documents(
+                docstore, vector_store, list(stale_doc_ids), sparse_index=sparse_index
+            )
 
-    # Build the index and persist storage
-    persist_storage(docstore, vector_store)
+        # Build the index and persist storage
+        persist_storage(docstore, vector_store, collection_name)
+        manifest.save()
+        if on_progress:
+            on_progress(len(diff.changed), len(diff.changed))
 
-    logger.info("Finished generating the index")
+        logger.info("Finished generating the index")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,212 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, List
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.indices import VectorStoreIndex
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from app.engine.sparse_index import SparseIndex
+
+logger = logging.getLogger("uvicorn")
+
+RETRIEVAL_MODES = ["dense", "hybrid"]
+DEFAULT_RETRIEVAL_MODE = "dense"
+# The number of results fetched from each retriever per result of the fusion
+FETCH_FACTOR = 2
+# The rank constant of the reciprocal rank fusion
+RRF_K = 60
+
+# One sparse index per storage directory, shared by the queries and the ingestion
+# of the collection instead of connecting to SQLite for each query
+_sparse_indexes: Dict[str, SparseIndex] = {}
+_sparse_indexes_lock = threading.Lock()
+
+
+def get_retrieval_mode() -> str:
+    mode = os.getenv("RETRIEVAL_MODE", DEFAULT_RETRIEVAL_MODE)
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(
+            f"Unsupported retrieval mode: {mode}. Use one of {RETRIEVAL_MODES}"
+        )
+    return mode
+
+
+def get_sparse_index(storage_dir: str) -> SparseIndex | None:
+    """
+    Get the sparse index of a collection, only maintained in the hybrid retrieval mode.
+    """
+    if get_retrieval_mode() != "hybrid":
+        return None
+    return open_sparse_index(storage_dir)
+
+
+def open_sparse_index(storage_dir: str) -> SparseIndex:
+    """
+    Get the shared sparse index of a storage directory, opened on first use.
+    """
+    with _sparse_indexes_lock:
+        sparse_index = _sparse_indexes.get(storage_dir)
+        if sparse_index is None:
+            sparse_index = SparseIndex.from_persist_dir(storage_dir)
+            _sparse_indexes[storage_dir] = sparse_index
+        return sparse_index
+
+
+def forget_sparse_index(storage_dir: str):
+    """
+    Drop the shared sparse index of a storage directory, e.g. after the directory has been
+    rebuilt or deleted. Its connection is closed once the running queries are done with it.
+    """
+    with _sparse_indexes_lock:
+        _sparse_indexes.pop(storage_dir, None)
+
+
+def close_sparse_indexes():
+    """
+    Close the shared sparse indexes, called on the application shutdown.
+    """
+    with _sparse_indexes_lock:
+        sparse_indexes = list(_sparse_indexes.values())
+        _sparse_indexes.clear()
+    for sparse_index in sparse_indexes:
+        sparse_index.close()
+
+
+def reciprocal_rank_fusion(
+    results: List[List[NodeWithScore]], top_k: int, k: int = RRF_K
+) -> List[NodeWithScore]:
+    """
+    Merge ranked lists of nodes, the nodes ranked high in several lists come first.
+    """
+    scores: Dict[str, float] = {}
+    nodes: Dict[str, NodeWithScore] = {}
+    for ranked_nodes in results:
+        for rank, node in enumerate(ranked_nodes):
+            scores[node.node_id] = scores.get(node.node_id, 0.0) + 1 / (k + rank + 1)
+            nodes.setdefault(node.node_id, node)
+    best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [
+        NodeWithScore(node=nodes[node_id].node, score=scores[node_id])
+        for node_id in best
+    ]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieve with both the vector store and the BM25 sparse index of the collection,
+    so that the exact identifiers and codes are found even if their embedding is not close.
+    """
+
+    def __init__(
+        self, dense_retriever: BaseRetriever, collection_name: str, top_k: int
+    ):
+        super().__init__(callback_manager=dense_retriever.callback_manager)
+        self._dense_retriever = dense_retriever
+        self._collection_name = collection_name
+        self._top_k = top_k
+
+    def _query_sparse_index(self, query_str: str) -> List[NodeWithScore]:
+        # Imported here, the ingestion imports the retrieval modules
+        from app.engine.generate import get_storage_dir
+
+        sparse_index = open_sparse_index(get_storage_dir(self._collection_name))
+        return sparse_index.query(query_str, self._top_k * FETCH_FACTOR)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        dense_nodes = self._dense_retriever._retrieve(query_bundle)
+        sparse_nodes = self._query_sparse_index(query_bundle.query_str)
+        return reciprocal_rank_fusion([dense_nodes, sparse_nodes], self._top_k)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        # The sparse index is queried in a thread while the vector store is queried
+        dense_nodes, sparse_nodes = await asyncio.gather(
+            self._dense_retriever._aretrieve(query_bundle),
+            asyncio.to_thread(self._query_sparse_index, query_bundle.query_str),
+        )
+        return reciprocal_rank_fusion([dense_nodes, sparse_nodes], self._top_k)
+
+
+def get_base_retriever(
+    index: VectorStoreIndex, collection_name: str, top_k: int
+) -> BaseRetriever:
+    """
+    Get the dense or hybrid retriever of a collection for the configured RETRIEVAL_MODE.
+    """
+    if get_retrieval_mode() == "hybrid":
+        return HybridRetriever(
+            index.as_retriever(similarity_top_k=top_k * FETCH_FACTOR),
+            collection_name=collection_name,
+            top_k=top_k,
+        )
+    return index.as_retriever(similarity_top_k=top_k)
+
+
+def benchmark_retrieval(
+    collection_name: str, samples: int = 50, top_k: int = 3
+) -> List[dict]:
+    """
+    Report the recall@k and the latency of the dense, sparse and hybrid retrieval.
+    The queries are the first words of nodes sampled from the sparse index of the collection,
+    a query is recalled if its node is in the top k results.
+    """
+    from app.engine.generate import get_storage_dir
+    from app.engine.index import get_index
+
+    index = get_index(collection_name)
+    sparse_index = SparseIndex.from_persist_dir(get_storage_dir(collection_name))
+    queries = [
+        (" ".join(node.get_content().split()[:12]), node.node_id)
+        for node in sparse_index.sample_nodes(samples)
+    ]
+    retrievers = {
+        "dense": index.as_retriever(similarity_top_k=top_k),
+        "hybrid": HybridRetriever(
+            index.as_retriever(similarity_top_k=top_k * FETCH_FACTOR),
+            collection_name=collection_name,
+            top_k=top_k,
+        ),
+    }
+    results = []
+    for mode in ["dense", "sparse", "hybrid"]:
+        latencies, recalled = [], 0
+        for query, node_id in queries:
+            start = time.perf_counter()
+            if mode == "sparse":
+                nodes = sparse_index.query(query, top_k)
+            else:
+                nodes = retrievers[mode].retrieve(query)
+            latencies.append(time.perf_counter() - start)
+            recalled += node_id in [node.node_id for node in nodes]
+        latencies.sort()
+        results.append(
+            {
+                "mode": mode,
+                "queries": len(queries),
+                f"recall@{top_k}": recalled / len(queries) if queries else 0.0,
+                "mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+                "p95_ms": (
+                    1000 * latencies[int(0.95 * (len(latencies) - 1))]
+                    if latencies
+                    else 0.0
+                ),
+            }
+        )
+    sparse_index.close()
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from app.settings import init_settings
+
+    logging.basicConfig(level=logging.INFO)
+    init_settings()
+    collection = sys.argv[1] if len(sys.argv) > 1 else None
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for result in benchmark_retrieval(collection, samples=samples):
+        logger.info(result)
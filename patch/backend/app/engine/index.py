@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from typing import List
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.indices import VectorStoreIndex
+from llama_index.core.settings import Settings
+from app.engine.collection_registry import get_collection_registry
+from app.engine.vectordb import get_physical_collection, get_vector_store
+
+logger = logging.getLogger("uvicorn")
+
+# The embedding models whose async methods call the provider synchronously
+BLOCKING_ASYNC_EMBEDDINGS = {"OllamaEmbedding", "GeminiEmbedding"}
+
+
+def get_embed_model(collection_name: str | None = None):
+    """
+    Get the embedding model of a collection, the model its active version was built with
+    if it's not the configured one, e.g. while it's being re-indexed with a new one.
+    Raises a ValueError if that model isn't available anymore.
+    """
+    embed_model = get_collection_registry().get_embed_model(
+        get_physical_collection(collection_name)
+    )
+    return embed_model or Settings.embed_model
+
+
+async def aget_query_embedding(
+    embed_model: BaseEmbedding, queries: List[str]
+) -> List[float]:
+    """
+    Embed the query strings without blocking the event loop,
+    in a thread if the async methods of the embedding model are blocking.
+    """
+    if embed_model.class_name() in BLOCKING_ASYNC_EMBEDDINGS:
+        return await asyncio.to_thread(
+            embed_model.get_agg_embedding_from_queries, queries
+        )
+    return await embed_model.aget_agg_embedding_from_queries(queries)
+
+
+def get_index(collection_name: str | None = None):
+    logger.info(f"Connecting to index of collection {collection_name or 'default'}...")
+    store = get_vector_store(collection_name)
+    # Embed the queries with the model the served version was built with
+    index = VectorStoreIndex.from_vector_store(
+        store, embed_model=get_embed_model(collection_name)
+    )
+    logger.info("Finished connecting to index from vector store.")
+    return index
@@ -0,0 +1,213 @@
+"""
+Patching:
+Allow loading an explicit list of files so single uploads can be indexed incrementally
+Parse the files in a pool of processes and stream the documents as they are parsed
+"""
+
+import os
+import time
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, List, Optional
+from pydantic import BaseModel, validator
+from llama_index.core.schema import Document
+
+logger = logging.getLogger(__name__)
+
+
+class FileLoaderConfig(BaseModel):
+    data_dir: str = "data"
+    use_llama_parse: bool = False
+
+    @validator("data_dir")
+    def data_dir_must_exist(cls, v):
+        if not os.path.isdir(v):
+            raise ValueError(f"Directory '{v}' does not exist")
+        return v
+
+
+def llama_parse_parser():
+    from llama_parse import LlamaParse
+
+    if os.getenv("LLAMA_CLOUD_API_KEY") is None:
+        raise ValueError(
+            "LLAMA_CLOUD_API_KEY environment variable is not set. "
+            "Please set it in .env file or in your shell environment then run again!"
+        )
+    parser = LlamaParse(result_type="markdown", verbose=True, language="en")
+    return parser
+
+
+def get_loader_workers() -> int:
+    """
+    Get the number of processes parsing the files, LOADER_WORKERS or up to 4 by default.
+    """
+    return max(1, int(os.getenv("LOADER_WORKERS", min(4, os.cpu_count() or 1))))
+
+
+def _get_reader(config: FileLoaderConfig, input_files: Optional[List[str]] = None):
+    from llama_index.core.readers import SimpleDirectoryReader
+
+    if input_files:
+        reader = SimpleDirectoryReader(
+            input_files=input_files,
+            filename_as_id=True,
+        )
+    else:
+        reader = SimpleDirectoryReader(
+            config.data_dir,
+            recursive=True,
+            filename_as_id=True,
+        )
+    if config.use_llama_parse:
+        parser = llama_parse_parser()
+        reader.file_extractor = {".pdf": parser}
+    return reader
+
+
+def list_data_files(config: FileLoaderConfig) -> List[str]:
+    """
+    List the files of the data folder that the loader would parse.
+    """
+    from llama_index.core.readers import SimpleDirectoryReader
+
+    try:
+        reader = SimpleDirectoryReader(config.data_dir, recursive=True)
+    except ValueError as e:
+        if "No files found" not in str(e):
+            raise e
+        return []
+    return [str(input_file) for input_file in reader.input_files]
+
+
+def _load_file(input_file: str) -> List[Document]:
+    # Runs in a worker process, it's imported by name in the spawned worker processes.
+    # The reader of a single file gives the same document ids
+    from llama_index.core.readers import SimpleDirectoryReader
+
+    return SimpleDirectoryReader(
+        input_files=[input_file],
+        filename_as_id=True,
+    ).load_data()
+
+
+_process_pool: ProcessPoolExecutor | None = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool(workers: int) -> ProcessPoolExecutor:
+    # Keep the worker processes around, starting them costs more than parsing a small file
+    global _process_pool
+    with _process_pool_lock:
+        if (
+            _process_pool is None
+            or _process_pool._max_workers != workers
+            # A crashed worker breaks the whole pool
+            or _process_pool._broken
+        ):
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False)
+            # Spawn the workers instead of forking the server: a forked child inherits
+            # the locks held by its other threads (logging, SQLite, HTTP client pools)
+            # and can deadlock on them
+            _process_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def iter_file_documents(
+    config: FileLoaderConfig,
+    input_files: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+) -> Iterator[List[Document]]:
+    """
+    Parse the files in a pool of processes and yield the documents as the files are parsed,
+    every batch holds the documents of all the files finished since the previous batch.
+    """
+    try:
+        reader = _get_reader(config, input_files)
+    except ValueError as e:
+        # SimpleDirectoryReader raises a ValueError when there are no files to load
+        if "No files found" not in str(e):
+            raise e
+        logger.warning(
+            f"Failed to load file documents, error message: {e}. Return as empty document list."
+        )
+        return
+
+    workers = workers or get_loader_workers()
+    # LlamaParse parses in the cloud and its parser can't be sent to other processes
+    if config.use_llama_parse or workers == 1 or len(reader.input_files) == 1:
+        yield reader.load_data()
+        return
+
+    pool = _get_process_pool(workers)
+    # Only parse a bounded number of files ahead of the consumer, so the parsed
+    # documents don't pile up in memory when the embedding is slower than the parsing
+    max_pending = max(1, int(os.getenv("LOADER_MAX_PENDING", workers * 2)))
+    input_files = iter(reader.input_files)
+    pending = set()
+    try:
+        while True:
+            for input_file in itertools.islice(input_files, max_pending - len(pending)):
+                pending.add(pool.submit(_load_file, str(input_file)))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield [document for future in done for document in future.result()]
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def get_file_documents(
+    config: FileLoaderConfig, input_files: Optional[List[str]] = None
+):
+    """
+    Load the documents from the data folder, or only from `input_files` if given.
+    """
+    return [
+        document
+        for documents in iter_file_documents(config, input_files)
+        for document in documents
+    ]
+
+
+def benchmark_file_loading(data_dir: str, workers: List[int]) -> List[dict]:
+    """
+    Report the wall time of parsing the files of `data_dir` with each number of worker processes.
+    """
+    config = FileLoaderConfig(data_dir=data_dir)
+    results = []
+    for worker_count in workers:
+        start = time.perf_counter()
+        documents = [
+            document
+            for batch in iter_file_documents(config, workers=worker_count)
+            for document in batch
+        ]
+        elapsed = time.perf_counter() - start
+        results.append(
+            {
+                "workers": worker_count,
+                "documents": len(documents),
+                "seconds": elapsed,
+            }
+        )
+    for result in results:
+        result["speedup"] = results[0]["seconds"] / result["seconds"]
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else "data"
+    # The first run also starts the worker processes, run the pool twice to see the warm time
+    for result in benchmark_file_loading(data_dir, [1, get_loader_workers()] * 2):
+        logger.info(result)
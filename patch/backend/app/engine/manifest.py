@@ -0,0 +1,145 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Tuple
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+
+
+class ManifestEntry(BaseModel):
+    size: int
+    mtime: float
+    hash: str
+    doc_ids: List[str] = Field(default_factory=list)
+
+
+class ManifestDiff(BaseModel):
+    new: List[str] = Field(default_factory=list)
+    modified: List[str] = Field(default_factory=list)
+    deleted: List[str] = Field(default_factory=list)
+    unchanged: int = 0
+
+    @property
+    def changed(self) -> List[str]:
+        return self.new + self.modified
+
+
+def get_file_hash(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class FileManifest:
+    """
+    The indexed files of a collection with their size, modification time, content hash
+    and document ids, so that only the new, modified or deleted files are indexed again.
+    A file is only hashed if its size or modification time changed.
+    """
+
+    def __init__(self, path: str, entries: Dict[str, ManifestEntry], exists: bool):
+        self.path = path
+        self.entries = entries
+        # Whether the manifest was persisted before, i.e. the index is in sync with it
+        self.exists = exists
+        # The (size, mtime, hash) of the files checked by `diff`
+        self._scanned: Dict[str, Tuple[int, float, str]] = {}
+
+    @classmethod
+    def load(cls, storage_dir: str) -> "FileManifest":
+        path = os.path.join(storage_dir, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return cls(path, {}, exists=False)
+        with open(path, "r") as f:
+            data = json.load(f)
+        entries = {key: ManifestEntry(**entry) for key, entry in data.items()}
+        return cls(path, entries, exists=True)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(
+                {key: entry.model_dump() for key, entry in self.entries.items()}, f
+            )
+        os.replace(temp_path, self.path)
+        self.exists = True
+
+    @staticmethod
+    def _key(file_path: str) -> str:
+        # The readers give either relative or absolute file paths
+        return os.path.relpath(os.path.abspath(file_path))
+
+    def _scan(self, file_path: str) -> Tuple[int, float, str]:
+        stat = os.stat(file_path)
+        entry = self.entries.get(self._key(file_path))
+        if entry is not None and (entry.size, entry.mtime) == (
+            stat.st_size,
+            stat.st_mtime,
+        ):
+            return stat.st_size, stat.st_mtime, entry.hash
+        file_hash = get_file_hash(file_path)
+        self._scanned[self._key(file_path)] = (stat.st_size, stat.st_mtime, file_hash)
+        return stat.st_size, stat.st_mtime, file_hash
+
+    def diff(self, file_paths: Iterable[str]) -> ManifestDiff:
+        """
+        Compare the files in the data folder with the manifest.
+        """
+        diff = ManifestDiff()
+        seen = set()
+        for file_path in file_paths:
+            key = self._key(file_path)
+            seen.add(key)
+            size, mtime, file_hash = self._scan(file_path)
+            entry = self.entries.get(key)
+            if entry is None:
+                diff.new.append(file_path)
+            elif entry.hash != file_hash:
+                diff.modified.append(file_path)
+            else:
+                # Only touched, don't hash it again next time
+                entry.size, entry.mtime = size, mtime
+                diff.unchanged += 1
+        diff.deleted = [key for key in self.entries if key not in seen]
+        return diff
+
+    def __contains__(self, file_path: str) -> bool:
+        return self._key(file_path) in self.entries
+
+    def get_doc_ids(self, file_path: str) -> List[str]:
+        entry = self.entries.get(self._key(file_path))
+        return entry.doc_ids if entry is not None else []
+
+    def set_file(self, file_path: str, doc_ids: List[str]):
+        key = self._key(file_path)
+        scanned = self._scanned.pop(key, None)
+        stat = os.stat(file_path)
+        if scanned is None or scanned[:2] != (stat.st_size, stat.st_mtime):
+            scanned = (stat.st_size, stat.st_mtime, get_file_hash(file_path))
+        size, mtime, file_hash = scanned
+        self.entries[key] = ManifestEntry(
+            size=size, mtime=mtime, hash=file_hash, doc_ids=doc_ids
+        )
+
+    def remove_file(self, file_path: str):
+        self.entries.pop(self._key(file_path), None)
+
+    def set_documents(self, documents):
+        """
+        Record the document ids of the files the documents were loaded from.
+        """
+        doc_ids: Dict[str, List[str]] = {}
+        for document in documents:
+            file_path = document.metadata.get("file_path")
+            if file_path:
+                doc_ids.setdefault(file_path, []).append(document.doc_id)
+        for file_path, ids in doc_ids.items():
+            if os.path.exists(file_path):
+                self.set_file(file_path, ids)
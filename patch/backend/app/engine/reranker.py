@@ -0,0 +1,313 @@
+import os
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from typing import Dict, List, Optional, Tuple
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from app.engine.sparse_index import tokenize
+
+logger = logging.getLogger("uvicorn")
+
+RERANKERS = ["none", "fusion", "cross_encoder"]
+DEFAULT_RERANKER = "none"
+# The number of candidates fetched per result of the reranking, unless RERANK_CANDIDATES is set
+RERANK_FETCH_FACTOR = 4
+# The weight of the query terms found in a node against its retrieval score in the fusion
+LEXICAL_WEIGHT = 0.5
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+DEFAULT_RERANK_TIMEOUT_MS = 500
+RERANK_WORKERS = 4
+
+_rerankers: Dict[Tuple[str, str], BaseNodePostprocessor] = {}
+_rerankers_lock = threading.Lock()
+_rerank_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=RERANK_WORKERS, thread_name_prefix="rerank"
+)
+
+
+def get_reranker_name() -> str:
+    name = os.getenv("RERANKER", DEFAULT_RERANKER)
+    if name not in RERANKERS:
+        raise ValueError(f"Unsupported reranker: {name}. Use one of {RERANKERS}")
+    return name
+
+
+def get_rerank_candidates(top_k: int) -> int:
+    """
+    Get the number of nodes retrieved for the reranking, at least `top_k`.
+    """
+    candidates = int(os.getenv("RERANK_CANDIDATES", "0"))
+    return max(candidates or top_k * RERANK_FETCH_FACTOR, top_k)
+
+
+def get_rerank_timeout() -> float | None:
+    """
+    Get the latency budget of the reranking in seconds, None if it's unlimited.
+    """
+    timeout_ms = int(os.getenv("RERANK_TIMEOUT_MS", DEFAULT_RERANK_TIMEOUT_MS))
+    return timeout_ms / 1000 if timeout_ms > 0 else None
+
+
+class LexicalFusionRerank(BaseNodePostprocessor):
+    """
+    Rerank the nodes by the fusion of their retrieval score and of the share of the query terms
+    they contain, weighted by the rarity of the terms among the nodes. It needs no model,
+    so it adds no noticeable latency.
+    """
+
+    lexical_weight: float = Field(default=LEXICAL_WEIGHT)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LexicalFusionRerank"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        terms = set(tokenize(query_bundle.query_str))
+        if not terms or not nodes:
+            return nodes
+
+        node_terms = [
+            terms.intersection(
+                tokenize(node.node.get_content(metadata_mode=MetadataMode.EMBED))
+            )
+            for node in nodes
+        ]
+        # The terms found in all the nodes don't tell them apart
+        weights = {
+            term: math.log(
+                1 + len(nodes) / (1 + sum(term in found for found in node_terms))
+            )
+            for term in terms
+        }
+        total_weight = sum(weights.values())
+        scores = [node.score or 0.0 for node in nodes]
+        low, high = min(scores), max(scores)
+        for node, score, found in zip(nodes, scores, node_terms):
+            coverage = sum(weights[term] for term in found) / total_weight
+            retrieval_score = (score - low) / (high - low) if high > low else 1.0
+            node.score = (
+                1 - self.lexical_weight
+            ) * retrieval_score + self.lexical_weight * coverage
+        # The sort is stable, the nodes with the same score keep their retrieval order
+        return sorted(nodes, key=lambda node: node.score, reverse=True)
+
+
+def get_reranker(name: str | None = None) -> BaseNodePostprocessor | None:
+    """
+    Get the process-wide reranker of the configured RERANKER, None if the reranking is disabled.
+    The cross-encoder needs the `sentence-transformers` package, its model is loaded once.
+    """
+    name = name or get_reranker_name()
+    if name == "none":
+        return None
+    model = os.getenv("RERANK_MODEL", DEFAULT_RERANK_MODEL)
+    key = (name, model)
+    with _rerankers_lock:
+        if key not in _rerankers:
+            if name == "fusion":
+                _rerankers[key] = LexicalFusionRerank()
+            else:
+                from llama_index.core.postprocessor import SentenceTransformerRerank
+
+                logger.info(f"Loading the reranking model {model}")
+                # All the candidates are scored and sorted, the retriever keeps the top k
+                _rerankers[key] = SentenceTransformerRerank(
+                    model=model, top_n=2**31 - 1, device="cpu"
+                )
+        return _rerankers[key]
+
+
+class RerankingRetriever(BaseRetriever):
+    """
+    Rerank the candidates retrieved by `retriever` and keep the best `top_k` of them.
+    If the reranking exceeds its latency budget, the first `top_k` candidates are kept instead.
+    """
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        reranker: BaseNodePostprocessor,
+        top_k: int,
+        timeout: float | None = None,
+    ):
+        super().__init__(callback_manager=retriever.callback_manager)
+        self._retriever = retriever
+        self._reranker = reranker
+        self._top_k = top_k
+        self._timeout = timeout
+
+    def _rerank(
+        self, nodes: List[NodeWithScore], query_bundle: QueryBundle
+    ) -> List[NodeWithScore]:
+        # The rerankers change the scores, the nodes are kept as retrieved for the fallback
+        nodes = [NodeWithScore(node=node.node, score=node.score) for node in nodes]
+        return self._reranker.postprocess_nodes(nodes, query_bundle)[: self._top_k]
+
+    def _on_timeout(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        logger.warning(
+            f"Reranking {len(nodes)} nodes took more than {self._timeout}s, "
+            "keeping the retrieval order"
+        )
+        return nodes[: self._top_k]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        nodes = self._retriever._retrieve(query_bundle)
+        if not nodes:
+            return nodes
+        future = _rerank_executor.submit(self._rerank, nodes, query_bundle)
+        try:
+            return future.result(timeout=self._timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return self._on_timeout(nodes)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        nodes = await self._retriever._aretrieve(query_bundle)
+        if not nodes:
+            return nodes
+        # The model runs in a thread, the event loop isn't blocked while it scores the nodes
+        future = _rerank_executor.submit(self._rerank, nodes, query_bundle)
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), timeout=self._timeout
+            )
+        except asyncio.TimeoutError:
+            return self._on_timeout(nodes)
+
+
+def get_reranking_retriever(
+    retriever: BaseRetriever, top_k: int
+) -> BaseRetriever | None:
+    """
+    Wrap a retriever of `get_rerank_candidates(top_k)` nodes with the configured reranker,
+    None if the reranking is disabled.
+    """
+    reranker = get_reranker()
+    if reranker is None:
+        return None
+    return RerankingRetriever(
+        retriever, reranker=reranker, top_k=top_k, timeout=get_rerank_timeout()
+    )
+
+
+def _get_benchmark_queries(
+    collection_name: str, samples: int, query_words: int = 12
+) -> List[str]:
+    from app.engine.generate import get_doc_store
+
+    # Spans of words of random documents, a node containing the span answers the query
+    documents = [
+        document
+        for document in get_doc_store(collection_name).docs.values()
+        if len(document.get_content().split()) >= query_words
+    ]
+    rng = random.Random(0)
+    queries = []
+    for document in rng.sample(documents, min(samples, len(documents))):
+        words = document.get_content().split()
+        start = rng.randrange(len(words) - query_words + 1)
+        queries.append(" ".join(words[start : start + query_words]))
+    return queries
+
+
+def benchmark_reranking(
+    collection_name: str | None = None, samples: int = 50, top_k: int = 3
+) -> List[dict]:
+    """
+    Report the context tokens sent to the LLM, the answer quality (hit rate and MRR of the node
+    containing the query) and the retrieval latency with and without the rerankers.
+    """
+    from llama_index.core.utils import get_tokenizer
+    from app.engine.hybrid_retriever import get_base_retriever
+    from app.engine.index import get_embed_model, get_index
+    from app.engine.vectordb import resolve_collection
+
+    collection_name = resolve_collection(collection_name)
+    index = get_index(collection_name)
+    embed_model = get_embed_model(collection_name)
+    tokenizer = get_tokenizer()
+    candidates = get_rerank_candidates(top_k)
+    candidate_retriever = get_base_retriever(index, collection_name, candidates)
+    retrievers = {
+        f"top_{top_k}": get_base_retriever(index, collection_name, top_k),
+        f"top_{candidates}": candidate_retriever,
+        "fusion": RerankingRetriever(
+            candidate_retriever, reranker=get_reranker("fusion"), top_k=top_k
+        ),
+    }
+    try:
+        retrievers["cross_encoder"] = RerankingRetriever(
+            candidate_retriever, reranker=get_reranker("cross_encoder"), top_k=top_k
+        )
+    except ImportError as e:
+        logger.warning(f"Skipping the cross-encoder: {e}")
+
+    queries = [
+        QueryBundle(query, embedding=embed_model.get_query_embedding(query))
+        for query in _get_benchmark_queries(collection_name, samples)
+    ]
+    results = []
+    for name, retriever in retrievers.items():
+        latencies, tokens, hits, reciprocal_ranks = [], 0, 0, 0.0
+        for query_bundle in queries:
+            start = time.perf_counter()
+            nodes = retriever.retrieve(query_bundle)
+            latencies.append(time.perf_counter() - start)
+            contents = [" ".join(node.node.get_content().split()) for node in nodes]
+            tokens += sum(len(tokenizer(content)) for content in contents)
+            rank = next(
+                (
+                    rank
+                    for rank, content in enumerate(contents, 1)
+                    if query_bundle.query_str in content
+                ),
+                None,
+            )
+            hits += rank is not None
+            reciprocal_ranks += 1 / rank if rank else 0.0
+        latencies.sort()
+        count = max(len(queries), 1)
+        results.append(
+            {
+                "retriever": name,
+                "queries": len(queries),
+                "context_tokens": tokens / count,
+                "hit_rate": hits / count,
+                "mrr": reciprocal_ranks / count,
+                "mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+                "p95_ms": (
+                    1000 * latencies[int(0.95 * (len(latencies) - 1))]
+                    if latencies
+                    else 0.0
+                ),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from app.settings import init_settings
+
+    logging.basicConfig(level=logging.INFO)
+    init_settings()
+    collection = sys.argv[1] if len(sys.argv) > 1 else None
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for result in benchmark_reranking(collection, samples=samples):
+        logger.info(result)
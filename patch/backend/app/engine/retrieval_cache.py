@@ -0,0 +1,261 @@
+import os
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from cachetools import LRUCache
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.indices import VectorStoreIndex
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from app.engine.hybrid_retriever import get_base_retriever
+from app.engine.index import aget_query_embedding, get_embed_model
+from app.engine.reranker import (
+    get_rerank_candidates,
+    get_reranker_name,
+    get_reranking_retriever,
+)
+from app.engine.vectordb import get_physical_collection
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_MAX_ENTRIES = 1024
+
+# Bumped whenever the ingestion changes the documents of a collection,
+# so the cached results of the previous version are never returned
+_index_versions: Dict[str, int] = {}
+_index_versions_lock = threading.Lock()
+
+
+def get_index_version(collection_name: str) -> int:
+    return _index_versions.get(collection_name, 0)
+
+
+def bump_index_version(collection_name: str):
+    with _index_versions_lock:
+        _index_versions[collection_name] = _index_versions.get(collection_name, 0) + 1
+
+
+class RetrievalCache:
+    """
+    In-process LRU caches of the query embeddings, keyed by (embedding model, query text),
+    and of the retrieved nodes, keyed by (collection, index version, top k, query embedding).
+    """
+
+    def __init__(self, max_entries: int):
+        self._embeddings: LRUCache = LRUCache(maxsize=max_entries)
+        self._results: LRUCache = LRUCache(maxsize=max_entries)
+        self._lock = threading.Lock()
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+        self.result_hits = 0
+        self.result_misses = 0
+
+    def get_embedding(self, key: Tuple) -> List[float] | None:
+        with self._lock:
+            embedding = self._embeddings.get(key)
+            if embedding is None:
+                self.embedding_misses += 1
+            else:
+                self.embedding_hits += 1
+            return embedding
+
+    def put_embedding(self, key: Tuple, embedding: List[float]):
+        with self._lock:
+            self._embeddings[key] = embedding
+
+    def get_results(self, key: Tuple) -> List[NodeWithScore] | None:
+        with self._lock:
+            nodes = self._results.get(key)
+            if nodes is None:
+                self.result_misses += 1
+            else:
+                self.result_hits += 1
+        return copy_nodes(nodes) if nodes is not None else None
+
+    def put_results(self, key: Tuple, nodes: List[NodeWithScore]):
+        nodes = copy_nodes(nodes)
+        with self._lock:
+            self._results[key] = nodes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            embedding_total = self.embedding_hits + self.embedding_misses
+            result_total = self.result_hits + self.result_misses
+            return {
+                "max_entries": self._results.maxsize,
+                "embedding_entries": len(self._embeddings),
+                "embedding_hit_rate": (
+                    self.embedding_hits / embedding_total if embedding_total else 0.0
+                ),
+                "result_entries": len(self._results),
+                "result_hits": self.result_hits,
+                "result_misses": self.result_misses,
+                "result_hit_rate": (
+                    self.result_hits / result_total if result_total else 0.0
+                ),
+            }
+
+
+def copy_nodes(nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+    """
+    Copy the cached nodes, the postprocessors may change the nodes of a request,
+    e.g. replace a sentence with its window.
+    """
+    return [
+        NodeWithScore(node=node.node.copy(deep=True), score=node.score)
+        for node in nodes
+    ]
+
+
+class QueryEmbeddingRetriever(BaseRetriever):
+    """
+    Embed the query with the embedding model of the collection before retrieving from `retriever`,
+    the async retrieval doesn't block the event loop with a synchronous embedding model.
+    """
+
+    def __init__(self, retriever: BaseRetriever, embed_model: BaseEmbedding):
+        super().__init__(callback_manager=retriever.callback_manager)
+        self._retriever = retriever
+        self._embed_model = embed_model
+
+    def _embed(self, query_bundle: QueryBundle) -> List[float]:
+        return self._embed_model.get_agg_embedding_from_queries(
+            query_bundle.embedding_strs
+        )
+
+    async def _aembed(self, query_bundle: QueryBundle) -> List[float]:
+        return await aget_query_embedding(
+            self._embed_model, query_bundle.embedding_strs
+        )
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self._embed(query_bundle)
+        # Not `retrieve`, the callback events are already sent by this retriever
+        return self._retriever._retrieve(query_bundle)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = await self._aembed(query_bundle)
+        return await self._retriever._aretrieve(query_bundle)
+
+
+class CachedRetriever(QueryEmbeddingRetriever):
+    """
+    Retrieve from `retriever` unless the same query was retrieved from the same version
+    of the collection before.
+    """
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        cache: RetrievalCache,
+        collection_name: str,
+        embed_model: BaseEmbedding,
+        top_k: int,
+    ):
+        super().__init__(retriever, embed_model)
+        self._cache = cache
+        self._collection_name = collection_name
+        self._top_k = top_k
+
+    def _get_embedding_key(self, query_bundle: QueryBundle) -> Tuple:
+        return (
+            f"{self._embed_model.class_name()}:{self._embed_model.model_name}",
+            # The embedding strings are the query string unless they are customized
+            tuple(query_bundle.embedding_strs),
+        )
+
+    def _get_results_key(self, embedding: List[float]) -> Tuple:
+        embedding_hash = hashlib.sha256(
+            np.asarray(embedding, dtype=np.float32).tobytes()
+        ).hexdigest()
+        return (
+            self._collection_name,
+            get_physical_collection(self._collection_name),
+            get_index_version(self._collection_name),
+            self._top_k,
+            embedding_hash,
+        )
+
+    def _embed(self, query_bundle: QueryBundle) -> List[float]:
+        key = self._get_embedding_key(query_bundle)
+        embedding = self._cache.get_embedding(key)
+        if embedding is None:
+            embedding = super()._embed(query_bundle)
+            self._cache.put_embedding(key, embedding)
+        return embedding
+
+    async def _aembed(self, query_bundle: QueryBundle) -> List[float]:
+        key = self._get_embedding_key(query_bundle)
+        embedding = self._cache.get_embedding(key)
+        if embedding is None:
+            embedding = await super()._aembed(query_bundle)
+            self._cache.put_embedding(key, embedding)
+        return embedding
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self._embed(query_bundle)
+        # Take the key before retrieving, an ingestion in the meantime bumps the version
+        results_key = self._get_results_key(query_bundle.embedding)
+        nodes = self._cache.get_results(results_key)
+        if nodes is None:
+            nodes = super()._retrieve(query_bundle)
+            self._cache.put_results(results_key, nodes)
+        return nodes
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = await self._aembed(query_bundle)
+        results_key = self._get_results_key(query_bundle.embedding)
+        nodes = self._cache.get_results(results_key)
+        if nodes is None:
+            nodes = await super()._aretrieve(query_bundle)
+            self._cache.put_results(results_key, nodes)
+        return nodes
+
+
+_retrieval_cache: RetrievalCache | None = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> RetrievalCache | None:
+    """
+    Get the process-wide retrieval cache, None if it's disabled by RETRIEVAL_CACHE_MAX_ENTRIES=0.
+    """
+    global _retrieval_cache
+    max_entries = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    if max_entries <= 0:
+        return None
+    with _retrieval_cache_lock:
+        if _retrieval_cache is None:
+            _retrieval_cache = RetrievalCache(max_entries=max_entries)
+        return _retrieval_cache
+
+
+def get_retriever(
+    index: VectorStoreIndex, collection_name: str, top_k: int
+) -> BaseRetriever:
+    """
+    Get the retriever of a collection, cached if the retrieval cache is enabled.
+    With a RERANKER, more candidates are retrieved (and cached) and the best `top_k` are kept.
+    """
+    reranking = get_reranker_name() != "none"
+    candidates = get_rerank_candidates(top_k) if reranking else top_k
+    retriever = get_base_retriever(index, collection_name, candidates)
+    embed_model = get_embed_model(collection_name)
+    cache = get_retrieval_cache()
+    if cache is None:
+        retriever = QueryEmbeddingRetriever(retriever, embed_model=embed_model)
+    else:
+        retriever = CachedRetriever(
+            retriever,
+            cache=cache,
+            collection_name=collection_name,
+            embed_model=embed_model,
+            top_k=candidates,
+        )
+    return get_reranking_retriever(retriever, top_k) or retriever
@@ -0,0 +1,309 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from cachetools import TTLCache
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse, MessageRole
+from llama_index.core.chat_engine.types import (
+    AgentChatResponse,
+    BaseChatEngine,
+    StreamingAgentChatResponse,
+)
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.schema import NodeWithScore
+from app.engine.index import aget_query_embedding
+from app.engine.retrieval_cache import copy_nodes
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 3600
+
+
+@dataclass
+class CachedResponse:
+    scope: Tuple
+    embedding: np.ndarray
+    response: str
+    source_nodes: List[NodeWithScore]
+    # How long the chat engine took to answer
+    latency: float
+
+
+class SemanticCache:
+    """
+    An in-memory cache of the chat responses, looked up by the similarity of the query
+    embeddings within a scope of (collection, index version, system prompt, LLM).
+    The entries expire after `ttl` seconds and the least recently used ones are evicted
+    once `max_entries` is exceeded.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl: float):
+        self.threshold = threshold
+        self._entries: TTLCache = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    def lookup(self, scope: Tuple, embedding: np.ndarray) -> CachedResponse | None:
+        with self._lock:
+            candidates = [
+                (key, entry)
+                for key, entry in self._entries.items()
+                if entry.scope == scope
+            ]
+            best = None
+            if candidates:
+                similarities = (
+                    np.stack([entry.embedding for _, entry in candidates]) @ embedding
+                )
+                i = int(np.argmax(similarities))
+                if similarities[i] >= self.threshold:
+                    key, best = candidates[i]
+                    # Mark the entry as recently used
+                    _ = self._entries[key]
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def put(self, entry: CachedResponse):
+        with self._lock:
+            self._entries[uuid.uuid4().hex] = entry
+
+    def record_latency_saved(self, latency: float):
+        with self._lock:
+            self.latency_saved += max(0.0, latency)
+
+    def invalidate(self, collection: str | None = None):
+        """
+        Drop the responses of a collection, of all the collections if none is given.
+        """
+        with self._lock:
+            if collection is None:
+                self._entries.clear()
+            else:
+                for key in [
+                    key
+                    for key, entry in self._entries.items()
+                    if entry.scope[0] == collection
+                ]:
+                    self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._entries.maxsize,
+                "ttl": self._entries.ttl,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "latency_saved": self.latency_saved,
+            }
+
+
+class SemanticCacheChatEngine(BaseChatEngine):
+    """
+    Answer the questions that are similar enough to a previous one from the semantic cache,
+    the other questions are answered by `chat_engine` and cached.
+    Only the first message of a conversation is cached, the answers to the following
+    messages depend on the chat history.
+    """
+
+    def __init__(
+        self,
+        chat_engine: BaseChatEngine,
+        cache: SemanticCache,
+        embed_model: BaseEmbedding,
+        scope: Tuple,
+    ):
+        self._chat_engine = chat_engine
+        self._cache = cache
+        self._embed_model = embed_model
+        self._scope = scope
+
+    def __getattr__(self, name: str) -> Any:
+        # e.g. the callback manager of the chat engine
+        return getattr(self._chat_engine, name)
+
+    @property
+    def chat_history(self) -> List[ChatMessage]:
+        return self._chat_engine.chat_history
+
+    def reset(self) -> None:
+        self._chat_engine.reset()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _put(self, embedding: np.ndarray, response: str, source_nodes, latency: float):
+        if response:
+            self._cache.put(
+                CachedResponse(
+                    scope=self._scope,
+                    embedding=embedding,
+                    response=response,
+                    source_nodes=copy_nodes(source_nodes),
+                    latency=latency,
+                )
+            )
+
+    def chat(
+        self, message: str, chat_history: Optional[List[ChatMessage]] = None
+    ) -> AgentChatResponse:
+        if chat_history:
+            return self._chat_engine.chat(message, chat_history)
+        start = time.perf_counter()
+        embedding = self._normalize(self._embed_model.get_query_embedding(message))
+        cached = self._cache.lookup(self._scope, embedding)
+        if cached is not None:
+            self._cache.record_latency_saved(
+                cached.latency - (time.perf_counter() - start)
+            )
+            return AgentChatResponse(
+                response=cached.response, source_nodes=copy_nodes(cached.source_nodes)
+            )
+        response = self._chat_engine.chat(message, chat_history)
+        self._put(
+            embedding,
+            response.response,
+            response.source_nodes,
+            time.perf_counter() - start,
+        )
+        return response
+
+    async def achat(
+        self, message: str, chat_history: Optional[List[ChatMessage]] = None
+    ) -> AgentChatResponse:
+        if chat_history:
+            return await self._chat_engine.achat(message, chat_history)
+        start = time.perf_counter()
+        embedding = self._normalize(
+            await aget_query_embedding(self._embed_model, [message])
+        )
+        cached = self._cache.lookup(self._scope, embedding)
+        if cached is not None:
+            self._cache.record_latency_saved(
+                cached.latency - (time.perf_counter() - start)
+            )
+            return AgentChatResponse(
+                response=cached.response, source_nodes=copy_nodes(cached.source_nodes)
+            )
+        response = await self._chat_engine.achat(message, chat_history)
+        self._put(
+            embedding,
+            response.response,
+            response.source_nodes,
+            time.perf_counter() - start,
+        )
+        return response
+
+    def stream_chat(
+        self, message: str, chat_history: Optional[List[ChatMessage]] = None
+    ) -> StreamingAgentChatResponse:
+        # The chat API only streams asynchronously
+        return self._chat_engine.stream_chat(message, chat_history)
+
+    async def astream_chat(
+        self, message: str, chat_history: Optional[List[ChatMessage]] = None
+    ) -> StreamingAgentChatResponse:
+        if chat_history:
+            return await self._chat_engine.astream_chat(message, chat_history)
+        start = time.perf_counter()
+        embedding = self._normalize(
+            await aget_query_embedding(self._embed_model, [message])
+        )
+        cached = self._cache.lookup(self._scope, embedding)
+        if cached is not None:
+            self._cache.record_latency_saved(
+                cached.latency - (time.perf_counter() - start)
+            )
+            return self._replay(cached)
+
+        response = await self._chat_engine.astream_chat(message, chat_history)
+        response_gen = response.async_response_gen
+
+        async def caching_response_gen():
+            async for token in response_gen():
+                yield token
+            # Only cache the responses that were streamed completely
+            if response.exception is None:
+                self._put(
+                    embedding,
+                    response.response,
+                    response.source_nodes,
+                    time.perf_counter() - start,
+                )
+
+        response.async_response_gen = caching_response_gen
+        return response
+
+    @staticmethod
+    def _replay(cached: CachedResponse) -> StreamingAgentChatResponse:
+        """
+        Stream a cached response the same way the chat engines stream the LLM response.
+        """
+
+        async def achat_stream():
+            yield ChatResponse(
+                message=ChatMessage(
+                    role=MessageRole.ASSISTANT, content=cached.response
+                ),
+                delta=cached.response,
+            )
+
+        response = StreamingAgentChatResponse(
+            achat_stream=achat_stream(), source_nodes=copy_nodes(cached.source_nodes)
+        )
+        asyncio.create_task(
+            response.awrite_response_to_history(ChatMemoryBuffer.from_defaults())
+        )
+        return response
+
+
+_semantic_cache: SemanticCache | None = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache | None:
+    """
+    Get the process-wide semantic cache, None if it's not enabled by SEMANTIC_CACHE_ENABLED=true.
+    """
+    global _semantic_cache
+    if os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() != "true":
+        return None
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = SemanticCache(
+                threshold=float(
+                    os.getenv("SEMANTIC_CACHE_THRESHOLD", DEFAULT_THRESHOLD)
+                ),
+                max_entries=int(
+                    os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+                ),
+                ttl=float(os.getenv("SEMANTIC_CACHE_TTL", DEFAULT_TTL)),
+            )
+        return _semantic_cache
+
+
+def invalidate_semantic_cache(collection: str | None = None):
+    """
+    Drop the cached responses of a collection, e.g. after its index changed.
+    """
+    if _semantic_cache is not None:
+        _semantic_cache.invalidate(collection)
@@ -0,0 +1,203 @@
+import os
+import re
+import math
+import json
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import (
+    BaseNode,
+    MetadataMode,
+    NodeWithScore,
+    TransformComponent,
+)
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+logger = logging.getLogger(__name__)
+
+SPARSE_INDEX_FILE = "sparse.sqlite"
+# Words, with the identifiers and codes like "INV-2024/0042" or "v1.2.3" kept whole
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+TOKEN_SEPARATOR_PATTERN = re.compile(r"[-./:_]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this "
+    "to was were will with what which who how when where why do does did".split()
+)
+# The ids bound in one `IN (...)` statement, under the SQLite limit of host parameters
+MAX_SQL_PARAMETERS = 500
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase terms. The compound tokens are indexed both whole
+    and split, so an identifier matches exactly and by its parts.
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        parts = [part for part in TOKEN_SEPARATOR_PATTERN.split(token) if part]
+        if len(parts) > 1:
+            terms.append(token)
+        terms.extend(part for part in parts if part not in STOPWORDS)
+    return terms
+
+
+class SparseIndex:
+    """
+    A BM25 inverted index of the nodes of a collection on SQLite,
+    updated incrementally with the nodes written to the vector store.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS nodes ("
+            "node_id TEXT PRIMARY KEY, ref_doc_id TEXT, length INTEGER NOT NULL, "
+            "node TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS nodes_ref_doc_id ON nodes (ref_doc_id)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, node_id TEXT NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term, node_id)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS postings_node_id ON postings (node_id)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "SparseIndex":
+        return cls(os.path.join(persist_dir, SPARSE_INDEX_FILE))
+
+    def _delete_nodes(self, where: str, params: List[Any]):
+        self._conn.execute(
+            f"DELETE FROM postings WHERE node_id IN (SELECT node_id FROM nodes WHERE {where})",
+            params,
+        )
+        self._conn.execute(f"DELETE FROM nodes WHERE {where}", params)
+
+    def add(self, nodes: List[BaseNode]):
+        """
+        Index the nodes, replacing the nodes indexed before for their source documents.
+        """
+        ref_doc_ids = {node.ref_doc_id for node in nodes if node.ref_doc_id}
+        rows, postings = [], []
+        for node in nodes:
+            terms = Counter(
+                tokenize(node.get_content(metadata_mode=MetadataMode.EMBED))
+            )
+            data = doc_to_json(node)
+            # The embedding is in the vector store already
+            data["__data__"]["embedding"] = None
+            rows.append(
+                (node.node_id, node.ref_doc_id, sum(terms.values()), json.dumps(data))
+            )
+            postings.extend((term, node.node_id, tf) for term, tf in terms.items())
+        with self._lock:
+            for ref_doc_id in ref_doc_ids:
+                self._delete_nodes("ref_doc_id = ?", [ref_doc_id])
+            for start in range(0, len(rows), MAX_SQL_PARAMETERS):
+                node_ids = [row[0] for row in rows[start : start + MAX_SQL_PARAMETERS]]
+                self._delete_nodes(
+                    f"node_id IN ({','.join('?' * len(node_ids))})", node_ids
+                )
+            self._conn.executemany(
+                "INSERT INTO nodes (node_id, ref_doc_id, length, node) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.executemany(
+                "INSERT INTO postings (term, node_id, tf) VALUES (?, ?, ?)", postings
+            )
+            self._conn.commit()
+
+    def delete_ref_docs(self, ref_doc_ids: Iterable[str]):
+        with self._lock:
+            for ref_doc_id in ref_doc_ids:
+                self._delete_nodes("ref_doc_id = ?", [ref_doc_id])
+            self._conn.commit()
+
+    def query(self, query: str, top_k: int) -> List[NodeWithScore]:
+        """
+        Get the `top_k` nodes with the best BM25 score for the query.
+        """
+        terms = Counter(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            node_count, average_length = self._conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM nodes"
+            ).fetchone()
+            if not node_count:
+                return []
+            postings = self._conn.execute(
+                "SELECT p.term, p.node_id, p.tf, n.length FROM postings p "
+                "JOIN nodes n ON n.node_id = p.node_id "
+                f"WHERE p.term IN ({','.join('?' * len(terms))})",
+                list(terms),
+            ).fetchall()
+        document_frequencies = Counter(term for term, _, _, _ in postings)
+        scores: Dict[str, float] = {}
+        for term, node_id, tf, length in postings:
+            df = document_frequencies[term]
+            idf = math.log(1 + (node_count - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (average_length or 1))
+            scores[node_id] = scores.get(node_id, 0.0) + terms[term] * idf * (
+                tf * (BM25_K1 + 1) / (tf + norm)
+            )
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [
+            NodeWithScore(node=node, score=scores[node.node_id])
+            for node in self.get_nodes([node_id for node_id, _ in best])
+        ]
+
+    def get_nodes(self, node_ids: List[str]) -> List[BaseNode]:
+        if not node_ids:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT node_id, node FROM nodes WHERE node_id IN ({','.join('?' * len(node_ids))})",
+                node_ids,
+            ).fetchall()
+        nodes = {node_id: json_to_doc(json.loads(node)) for node_id, node in rows}
+        return [nodes[node_id] for node_id in node_ids if node_id in nodes]
+
+    def sample_nodes(self, count: int) -> List[BaseNode]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT node FROM nodes ORDER BY RANDOM() LIMIT ?", (count,)
+            ).fetchall()
+        return [json_to_doc(json.loads(node)) for (node,) in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SparseIndexWriter(TransformComponent):
+    """
+    Add the nodes of the ingestion pipeline to the sparse index of the collection.
+    """
+
+    _sparse_index: SparseIndex = PrivateAttr()
+
+    def __init__(self, sparse_index: SparseIndex, **kwargs):
+        super().__init__(**kwargs)
+        self._sparse_index = sparse_index
+
+    def __call__(self, nodes: List[BaseNode], **kwargs: Any) -> List[BaseNode]:
+        if nodes:
+            self._sparse_index.add(nodes)
+        return nodes
@@ -0,0 +1,65 @@
+import os
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, List
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode, TransformComponent
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INGESTION_BATCH_SIZE = 256
+
+
+class VectorStoreWriter(TransformComponent):
+    """
+    Embed the nodes and write them to the vector store in batches of `batch_size`.
+    A batch is written while the next one is embedded, and the embeddings are dropped
+    once they are written, so at most two batches of embeddings are held in memory.
+    It's the last step of the ingestion, it returns no nodes.
+    """
+
+    batch_size: int = Field(description="The number of nodes per batch.")
+    _embed_transform: TransformComponent = PrivateAttr()
+    _vector_store: BasePydanticVectorStore = PrivateAttr()
+
+    def __init__(
+        self,
+        embed_transform: TransformComponent,
+        vector_store: BasePydanticVectorStore,
+        batch_size: int,
+        **kwargs,
+    ):
+        super().__init__(batch_size=max(1, batch_size), **kwargs)
+        self._embed_transform = embed_transform
+        self._vector_store = vector_store
+
+    def _write(self, batch: List[BaseNode]):
+        self._vector_store.add(batch)
+        for node in batch:
+            node.embedding = None
+
+    def __call__(self, nodes: List[BaseNode], **kwargs: Any) -> List[BaseNode]:
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            write: Future | None = None
+            for start in range(0, len(nodes), self.batch_size):
+                batch = nodes[start : start + self.batch_size]
+                self._embed_transform(batch)
+                # Wait for the previous batch to be written before queuing the next one
+                if write is not None:
+                    write.result()
+                write = writer.submit(self._write, batch)
+            if write is not None:
+                write.result()
+        # The nodes are in the vector store, they're not kept until the end of the ingestion
+        return []
+
+
+def get_vector_store_writer(
+    embed_transform: TransformComponent, vector_store: BasePydanticVectorStore
+) -> VectorStoreWriter:
+    return VectorStoreWriter(
+        embed_transform=embed_transform,
+        vector_store=vector_store,
+        batch_size=int(os.getenv("INGESTION_BATCH_SIZE", DEFAULT_INGESTION_BATCH_SIZE)),
+    )
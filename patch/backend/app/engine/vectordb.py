@@ -1,16 +1,117 @@
 import os
+import re
 import importlib
 import logging
+from app.engine.collection_registry import get_collection_registry
 
 logger = logging.getLogger(__name__)
 
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
 
-def get_vector_store():
+QUANTIZATION_MODES = ["none", "int8", "binary"]
+# The number of quantized results per result rescored with the original vectors
+DEFAULT_QUANTIZATION_OVERSAMPLING = 3.0
+
+# The collection used by the requests that don't select one,
+# can be changed at runtime with `set_default_collection`
+_default_collection: str | None = None
+
+
+def get_vector_store_module():
     provider = os.getenv("VECTOR_STORE_PROVIDER", "qdrant")
     try:
-        module = importlib.import_module(f"app.engine.vectordbs.{provider}")
-        logger.info(f"Using vector provider: {provider}")
-        collection_name = os.environ['QDRANT_COLLECTION']
-        return module.get_vector_store(collection_name)
+        return importlib.import_module(f"app.engine.vectordbs.{provider}")
     except ImportError:
         raise ValueError(f"Unsupported vector provider: {provider}")
+
+
+def get_quantization_mode() -> str:
+    """
+    Get the configured VECTOR_QUANTIZATION of the vectors searched by the vector stores.
+    """
+    mode = os.getenv("VECTOR_QUANTIZATION", "none")
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(
+            f"Unsupported vector quantization: {mode}. Use one of {QUANTIZATION_MODES}"
+        )
+    return mode
+
+
+def get_quantization_oversampling() -> float:
+    return float(
+        os.getenv("VECTOR_QUANTIZATION_OVERSAMPLING", DEFAULT_QUANTIZATION_OVERSAMPLING)
+    )
+
+
+def get_default_collection() -> str:
+    return _default_collection or os.getenv("QDRANT_COLLECTION") or "default"
+
+
+def set_default_collection(collection_name: str):
+    global _default_collection
+    _default_collection = validate_collection_name(collection_name)
+
+
+def validate_collection_name(collection_name: str) -> str:
+    """
+    Check the collection name, it's used in the storage paths of the collection.
+    """
+    if not COLLECTION_NAME_PATTERN.match(collection_name):
+        raise ValueError(
+            f"Invalid collection name: {collection_name}. "
+            "Use up to 64 letters, digits, underscores or dashes."
+        )
+    return collection_name
+
+
+def resolve_collection(collection_name: str | None = None) -> str:
+    """
+    Get the collection of a request, the default collection if none is given.
+    """
+    if not collection_name:
+        return get_default_collection()
+    return validate_collection_name(collection_name)
+
+
+def get_physical_collection(collection_name: str | None = None) -> str:
+    """
+    Get the name of the vector store collection serving a collection,
+    its active version if it has been re-indexed.
+    """
+    return get_collection_registry().get_active_name(
+        resolve_collection(collection_name)
+    )
+
+
+def get_vector_store(collection_name: str | None = None):
+    module = get_vector_store_module()
+    return module.get_vector_store(get_physical_collection(collection_name))
+
+
+def delete_vector_store_collection(collection_name: str):
+    """
+    Delete a collection from the vector store, without resolving it to its active version.
+    """
+    module = get_vector_store_module()
+    if not hasattr(module, "delete_collection"):
+        raise ValueError(f"Unsupported vector provider: {module.__name__}")
+    module.delete_collection(validate_collection_name(collection_name))
+
+
+def check_vector_store_health() -> bool:
+    """
+    Check the connection of the pooled vector store clients, if the provider has any.
+    """
+    module = get_vector_store_module()
+    if hasattr(module, "check_health"):
+        return module.check_health()
+    return True
+
+
+async def close_vector_stores():
+    """
+    Close the pooled vector store clients, if the provider has any.
+    """
+    module = get_vector_store_module()
+    if hasattr(module, "close_clients"):
+        await module.close_clients()
@@ -1,14 +1,46 @@
 import os
+import asyncio
+import logging
+from typing import Any, List
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
 from llama_index.vector_stores.chroma import ChromaVectorStore
+from app.engine.vectordb import get_quantization_mode
 
+logger = logging.getLogger("uvicorn")
 
-def get_vector_store():
-    collection_name = os.getenv("CHROMA_COLLECTION", "default")
+
+class AsyncChromaVectorStore(ChromaVectorStore):
+    """
+    A Chroma vector store whose async methods don't block the event loop,
+    the Chroma client is synchronous so they run in a thread.
+    """
+
+    async def aquery(
+        self, query: VectorStoreQuery, **kwargs: Any
+    ) -> VectorStoreQueryResult:
+        return await asyncio.to_thread(self.query, query, **kwargs)
+
+    async def async_add(self, nodes: List[BaseNode], **kwargs: Any) -> List[str]:
+        return await asyncio.to_thread(self.add, nodes, **kwargs)
+
+    async def adelete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        await asyncio.to_thread(self.delete, ref_doc_id, **delete_kwargs)
+
+
+def get_vector_store(collection_name=None):
+    if not collection_name:
+        collection_name = os.getenv("CHROMA_COLLECTION", "default")
+    if get_quantization_mode() != "none":
+        logger.warning("Chroma doesn't support VECTOR_QUANTIZATION, it's ignored")
     chroma_path = os.getenv("CHROMA_PATH")
     # if CHROMA_PATH is set, use a local ChromaVectorStore from the path
     # otherwise, use a remote ChromaVectorStore (ChromaDB Cloud is not supported yet)
     if chroma_path:
-        store = ChromaVectorStore.from_params(
+        store = AsyncChromaVectorStore.from_params(
             persist_dir=chroma_path, collection_name=collection_name
         )
     else:
@@ -16,9 +48,27 @@ def get_vector_store():
             raise ValueError(
                 "Please provide either CHROMA_PATH or CHROMA_HOST and CHROMA_PORT"
             )
-        store = ChromaVectorStore.from_params(
+        store = AsyncChromaVectorStore.from_params(
             host=os.getenv("CHROMA_HOST"),
             port=int(os.getenv("CHROMA_PORT")),
             collection_name=collection_name,
         )
     return store
+
+
+def delete_collection(collection_name: str):
+    """
+    Delete a collection from Chroma, if it exists.
+    """
+    import chromadb
+
+    chroma_path = os.getenv("CHROMA_PATH")
+    if chroma_path:
+        client = chromadb.PersistentClient(path=chroma_path)
+    else:
+        client = chromadb.HttpClient(
+            host=os.getenv("CHROMA_HOST"), port=int(os.getenv("CHROMA_PORT"))
+        )
+    if collection_name in [collection.name for collection in client.list_collections()]:
+        logger.info(f"Removing collection {collection_name}")
+        client.delete_collection(collection_name)
@@ -0,0 +1,1107 @@
+import os
+import json
+import asyncio
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterable, List, Tuple
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import (
+    metadata_dict_to_node,
+    node_to_metadata_dict,
+)
+from app.engine.vectordb import (
+    DEFAULT_QUANTIZATION_OVERSAMPLING,
+    QUANTIZATION_MODES,
+    get_quantization_mode,
+    get_quantization_oversampling,
+)
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_PATH = "storage/vectors"
+NODES_FILE = "nodes.sqlite"
+# The centroids of the inverted file (IVF) index and the number of rows they were trained on
+CENTROIDS_FILE = "centroids.npy"
+ANN_FILE = "ann.json"
+# The number of segments and the share of deleted rows that trigger a compaction
+DEFAULT_MAX_SEGMENTS = 16
+DEFAULT_MAX_DELETED_RATIO = 0.3
+# The number of rows scored at once, bounds the memory used to convert float16 segments
+QUERY_CHUNK_SIZE = 65536
+# The number of rows from which the IVF index is trained, 0 to always search exactly
+DEFAULT_ANN_MIN_ROWS = 100_000
+# The number of lists of the IVF index searched per query
+DEFAULT_NPROBE = 16
+# The IVF index is trained again when the collection has grown by this factor
+ANN_RETRAIN_GROWTH = 4
+ANN_TRAINING_ITERATIONS = 10
+# The number of sampled rows per list used to train the centroids
+ANN_TRAINING_SAMPLES_PER_LIST = 64
+# The number of set bits of every byte, to count the differing bits of binary codes
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+@dataclass
+class Segment:
+    id: int
+    # Memory-mapped matrix of the normalized vectors, one row per node
+    vectors: np.ndarray
+    # False for the rows of the deleted nodes (tombstones)
+    alive: np.ndarray
+    # The IVF list of every row, and the rows sorted by list with the offsets of the lists
+    lists: np.ndarray | None = None
+    list_order: np.ndarray | None = None
+    list_offsets: np.ndarray | None = None
+    # The quantized vectors kept in memory: the int8 codes with the scale of every row,
+    # or the packed sign bits of the binary quantization
+    codes: np.ndarray | None = None
+    scales: np.ndarray | None = None
+
+    def set_lists(self, lists: np.ndarray, list_count: int):
+        self.lists = lists
+        self.list_order = np.argsort(lists, kind="stable")
+        self.list_offsets = np.searchsorted(
+            lists[self.list_order], np.arange(list_count + 1)
+        )
+
+    def get_list_rows(self, list_ids: np.ndarray) -> np.ndarray:
+        return np.sort(
+            np.concatenate(
+                [
+                    self.list_order[self.list_offsets[i] : self.list_offsets[i + 1]]
+                    for i in list_ids
+                ]
+            )
+        )
+
+
+class LocalVectorStore(BasePydanticVectorStore):
+    """
+    A vector store embedded in the application for single-node deployments.
+    The vectors are kept in append-only segments of normalized float32 or float16 matrices,
+    memory-mapped and scored with a vectorized cosine similarity. The nodes are stored in SQLite,
+    a deleted node only leaves a tombstone in its segment until the segments are compacted.
+
+    Past `ann_min_rows` rows, an inverted file (IVF) index is trained: the rows are assigned
+    to the list of their closest centroid, and a query only scores the rows of the `nprobe`
+    lists closest to it. The compaction orders the rows by list, so that they are read contiguously.
+
+    With the int8 or binary `quantization`, the quantized vectors are kept in memory and scored
+    instead, and the `oversampling` times more best rows are rescored with the memory-mapped vectors,
+    only read from the disk for these rows.
+    """
+
+    stores_text: bool = True
+    path: str
+    dtype: str = "float32"
+    max_segments: int = DEFAULT_MAX_SEGMENTS
+    max_deleted_ratio: float = DEFAULT_MAX_DELETED_RATIO
+    ann_min_rows: int = DEFAULT_ANN_MIN_ROWS
+    nprobe: int = DEFAULT_NPROBE
+    quantization: str = "none"
+    oversampling: float = DEFAULT_QUANTIZATION_OVERSAMPLING
+
+    _conn: sqlite3.Connection = PrivateAttr()
+    _lock: threading.RLock = PrivateAttr()
+    _segments: List[Segment] = PrivateAttr()
+    _next_segment_id: int = PrivateAttr()
+    # The number of rows in the segments and of the deleted ones
+    _row_count: int = PrivateAttr()
+    _deleted_count: int = PrivateAttr()
+    # The centroids of the IVF index, None until it's trained
+    _centroids: np.ndarray | None = PrivateAttr()
+    _trained_rows: int = PrivateAttr()
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(path=path, **kwargs)
+        if self.quantization not in QUANTIZATION_MODES:
+            raise ValueError(
+                f"Unsupported vector quantization: {self.quantization}. "
+                f"Use one of {QUANTIZATION_MODES}"
+            )
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            os.path.join(path, NODES_FILE), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS nodes ("
+            "node_id TEXT PRIMARY KEY, ref_doc_id TEXT, segment INTEGER NOT NULL, "
+            "row INTEGER NOT NULL, node TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS nodes_ref_doc_id ON nodes (ref_doc_id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS nodes_segment_row ON nodes (segment, row)"
+        )
+        self._conn.commit()
+        self._centroids, self._trained_rows = self._load_ann()
+        self._segments = self._load_segments()
+        self._next_segment_id = (
+            max((segment.id for segment in self._segments), default=0) + 1
+        )
+        self._row_count = sum(len(segment.alive) for segment in self._segments)
+        self._deleted_count = self._row_count - sum(
+            int(segment.alive.sum()) for segment in self._segments
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.path, f"segment-{segment_id:06d}.npy")
+
+    def _lists_path(self, segment_id: int) -> str:
+        return os.path.join(self.path, f"segment-{segment_id:06d}.lists.npy")
+
+    def _codes_path(self, segment_id: int, quantization: str) -> str:
+        return os.path.join(self.path, f"segment-{segment_id:06d}.{quantization}.npz")
+
+    def _remove_segment_files(self, segment_id: int):
+        paths = [self._segment_path(segment_id), self._lists_path(segment_id)]
+        paths += [self._codes_path(segment_id, mode) for mode in QUANTIZATION_MODES]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_ann(self) -> Tuple[np.ndarray | None, int]:
+        centroids_path = os.path.join(self.path, CENTROIDS_FILE)
+        ann_path = os.path.join(self.path, ANN_FILE)
+        if not (os.path.exists(centroids_path) and os.path.exists(ann_path)):
+            return None, 0
+        with open(ann_path, "r") as f:
+            trained_rows = json.load(f)["trained_rows"]
+        return np.load(centroids_path), trained_rows
+
+    def _save_ann(self, centroids: np.ndarray, trained_rows: int):
+        centroids_path = os.path.join(self.path, CENTROIDS_FILE)
+        ann_path = os.path.join(self.path, ANN_FILE)
+        with open(f"{centroids_path}.tmp", "wb") as f:
+            np.save(f, centroids)
+        with open(f"{ann_path}.tmp", "w") as f:
+            json.dump({"lists": len(centroids), "trained_rows": trained_rows}, f)
+        os.replace(f"{centroids_path}.tmp", centroids_path)
+        os.replace(f"{ann_path}.tmp", ann_path)
+
+    def _load_segments(self) -> List[Segment]:
+        alive_rows: Dict[int, List[int]] = {}
+        for segment_id, row in self._conn.execute("SELECT segment, row FROM nodes"):
+            alive_rows.setdefault(segment_id, []).append(row)
+        segments = []
+        for name in sorted(os.listdir(self.path)):
+            if not name.startswith("segment-"):
+                continue
+            segment_id = int(name[len("segment-") :].split(".")[0])
+            path = os.path.join(self.path, name)
+            if (
+                segment_id not in alive_rows
+                or name.endswith(".tmp")
+                or (
+                    name.endswith(".npz")
+                    and path != self._codes_path(segment_id, self.quantization)
+                )
+            ):
+                # Only deleted rows, a file written before a crash
+                # or the codes of another quantization
+                os.remove(path)
+                continue
+            if path != self._segment_path(segment_id):
+                continue
+            vectors = np.load(os.path.join(self.path, name), mmap_mode="r")
+            alive = np.zeros(len(vectors), dtype=bool)
+            alive[alive_rows[segment_id]] = True
+            segment = Segment(id=segment_id, vectors=vectors, alive=alive)
+            if self._centroids is not None:
+                lists_path = self._lists_path(segment_id)
+                if os.path.exists(lists_path):
+                    lists = np.load(lists_path)
+                else:
+                    # Written before the index was trained, e.g. interrupted by a crash
+                    lists = self._assign_lists(vectors)
+                    self._save_lists(segment_id, lists)
+                segment.set_lists(lists, len(self._centroids))
+            if self.quantization != "none":
+                codes_path = self._codes_path(segment_id, self.quantization)
+                if os.path.exists(codes_path):
+                    with np.load(codes_path) as codes:
+                        segment.codes = codes["codes"]
+                        segment.scales = codes["scales"] if "scales" in codes else None
+                else:
+                    # Written with another quantization
+                    segment.codes, segment.scales = self._quantize(vectors)
+                    self._save_codes(segment_id, segment.codes, segment.scales)
+            segments.append(segment)
+        return segments
+
+    def _quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray | None]:
+        """
+        Get the int8 codes and the scale of every row, or the packed sign bits of the vectors.
+        """
+        codes, scales = [], []
+        for start in range(0, len(vectors), QUERY_CHUNK_SIZE):
+            chunk = np.asarray(
+                vectors[start : start + QUERY_CHUNK_SIZE], dtype=np.float32
+            )
+            if self.quantization == "binary":
+                codes.append(np.packbits(chunk > 0, axis=1))
+            else:
+                scale = np.abs(chunk).max(axis=1) / 127
+                scale[scale == 0] = 1
+                codes.append(np.round(chunk / scale[:, None]).astype(np.int8))
+                scales.append(scale.astype(np.float32))
+        return np.concatenate(codes), np.concatenate(scales) if scales else None
+
+    def _save_codes(
+        self, segment_id: int, codes: np.ndarray, scales: np.ndarray | None
+    ):
+        path = self._codes_path(segment_id, self.quantization)
+        arrays = (
+            {"codes": codes} if scales is None else {"codes": codes, "scales": scales}
+        )
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(f"{path}.tmp", path)
+
+    def _save_lists(self, segment_id: int, lists: np.ndarray):
+        path = self._lists_path(segment_id)
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, lists)
+        os.replace(f"{path}.tmp", path)
+
+    def _assign_lists(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Get the list of the closest centroid of every vector.
+        """
+        lists = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), QUERY_CHUNK_SIZE):
+            chunk = np.asarray(
+                vectors[start : start + QUERY_CHUNK_SIZE], dtype=np.float32
+            )
+            lists[start : start + len(chunk)] = np.argmax(
+                chunk @ self._centroids.T, axis=1
+            )
+        return lists
+
+    def _write_segment(
+        self,
+        vectors: Iterable[np.ndarray],
+        length: int,
+        lists: np.ndarray | None = None,
+    ) -> Segment:
+        """
+        Write the chunks of `vectors` to a new segment of `length` rows,
+        with the IVF lists of the rows if the index is trained.
+        """
+        segment_id = self._next_segment_id
+        self._next_segment_id += 1
+        path = self._segment_path(segment_id)
+        temp_path = f"{path}.tmp"
+        matrix = None
+        offset = 0
+        for chunk in vectors:
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(
+                    temp_path,
+                    mode="w+",
+                    dtype=self.dtype,
+                    shape=(length, chunk.shape[1]),
+                )
+            matrix[offset : offset + len(chunk)] = chunk
+            offset += len(chunk)
+        matrix.flush()
+        del matrix
+        vectors = np.load(temp_path, mmap_mode="r")
+        if self._centroids is not None:
+            if lists is None:
+                lists = self._assign_lists(vectors)
+            # Written first, a segment without its lists is assigned again when loaded
+            self._save_lists(segment_id, lists)
+        if self.quantization != "none":
+            codes, scales = self._quantize(vectors)
+            self._save_codes(segment_id, codes, scales)
+        os.replace(temp_path, path)
+        segment = Segment(
+            id=segment_id,
+            vectors=np.load(path, mmap_mode="r"),
+            alive=np.ones(length, dtype=bool),
+        )
+        if self._centroids is not None:
+            segment.set_lists(lists, len(self._centroids))
+        if self.quantization != "none":
+            segment.codes, segment.scales = codes, scales
+        return segment
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        vectors = self._normalize(
+            np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        )
+        with self._lock:
+            self._delete_rows(
+                "node_id IN ({})".format(",".join("?" * len(nodes))),
+                [node.node_id for node in nodes],
+            )
+            segment = self._write_segment([vectors], len(vectors))
+            self._conn.executemany(
+                "INSERT INTO nodes (node_id, ref_doc_id, segment, row, node) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        node.node_id,
+                        node.ref_doc_id,
+                        segment.id,
+                        row,
+                        json.dumps(
+                            node_to_metadata_dict(
+                                # The embedding is dropped anyway, don't copy it
+                                node.copy(update={"embedding": None}),
+                                remove_text=False,
+                                flat_metadata=False,
+                            )
+                        ),
+                    )
+                    for row, node in enumerate(nodes)
+                ],
+            )
+            self._conn.commit()
+            self._segments = self._segments + [segment]
+            self._row_count += len(nodes)
+            if not self._maybe_train():
+                self._maybe_compact()
+        return [node.node_id for node in nodes]
+
+    def _delete_rows(self, where: str, params: List[Any]):
+        rows = self._conn.execute(
+            f"SELECT segment, row FROM nodes WHERE {where}", params
+        ).fetchall()
+        if not rows:
+            return
+        self._conn.execute(f"DELETE FROM nodes WHERE {where}", params)
+        segments = {segment.id: segment for segment in self._segments}
+        for segment_id, row in rows:
+            if segment_id in segments:
+                segments[segment_id].alive[row] = False
+                self._deleted_count += 1
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock:
+            self._delete_rows("ref_doc_id = ?", [ref_doc_id])
+            self._conn.commit()
+            self._maybe_compact()
+
+    def _maybe_train(self) -> bool:
+        live_count = self._row_count - self._deleted_count
+        if self.ann_min_rows <= 0 or live_count < self.ann_min_rows:
+            return False
+        if (
+            self._centroids is not None
+            and live_count < self._trained_rows * ANN_RETRAIN_GROWTH
+        ):
+            return False
+        self.train()
+        return True
+
+    def train(self):
+        """
+        Train the centroids of the IVF index with a spherical k-means on a sample of the rows,
+        assign the rows to their lists and compact the segments ordered by list.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            live = [
+                (segment, np.flatnonzero(segment.alive)) for segment in self._segments
+            ]
+            count = sum(len(rows) for _, rows in live)
+            if not count:
+                return
+            list_count = max(1, int(np.sqrt(count)))
+            rng = np.random.default_rng(0)
+            sample_size = min(count, list_count * ANN_TRAINING_SAMPLES_PER_LIST)
+            sample_positions = np.sort(rng.choice(count, sample_size, replace=False))
+            sample, offset = [], 0
+            for segment, rows in live:
+                positions = sample_positions[
+                    (sample_positions >= offset)
+                    & (sample_positions < offset + len(rows))
+                ]
+                sample.append(
+                    np.asarray(
+                        segment.vectors[rows[positions - offset]], dtype=np.float32
+                    )
+                )
+                offset += len(rows)
+            centroids = _spherical_kmeans(np.concatenate(sample), list_count, rng)
+
+            self._centroids, self._trained_rows = centroids, count
+            # New segments, the queries in progress keep the lists of the previous centroids
+            segments = []
+            for segment in self._segments:
+                lists = self._assign_lists(segment.vectors)
+                self._save_lists(segment.id, lists)
+                segment = replace(segment)
+                segment.set_lists(lists, list_count)
+                segments.append(segment)
+            self._segments = segments
+            self._save_ann(centroids, count)
+            logger.info(
+                f"Trained the IVF index of {self.path} with {list_count} lists "
+                f"on {sample_size} of {count} rows in {time.perf_counter() - start:.2f}s"
+            )
+            self.compact()
+
+    def _maybe_compact(self):
+        if len(self._segments) > self.max_segments or (
+            self._row_count
+            and self._deleted_count / self._row_count > self.max_deleted_ratio
+        ):
+            self.compact()
+
+    def compact(self):
+        """
+        Merge the live rows of all the segments into a single segment,
+        ordered by IVF list if the index is trained.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            old_segments = self._segments
+            live = [
+                (segment, np.flatnonzero(segment.alive)) for segment in old_segments
+            ]
+            count = sum(len(rows) for _, rows in live)
+            # The segment and row of every live row, in the order of the new segment
+            segment_indexes = np.concatenate(
+                [np.full(len(rows), i) for i, (_, rows) in enumerate(live)]
+                or [np.empty(0, dtype=int)]
+            )
+            rows = np.concatenate(
+                [rows for _, rows in live] or [np.empty(0, dtype=int)]
+            )
+            lists = None
+            if self._centroids is not None and count:
+                lists = np.concatenate(
+                    [segment.lists[segment_rows] for segment, segment_rows in live]
+                )
+                order = np.argsort(lists, kind="stable")
+                segment_indexes, rows, lists = (
+                    segment_indexes[order],
+                    rows[order],
+                    lists[order],
+                )
+
+            # Copy the live rows chunk by chunk, the segments may not fit in memory
+            def chunks():
+                for chunk_start in range(0, count, QUERY_CHUNK_SIZE):
+                    chunk_segments = segment_indexes[
+                        chunk_start : chunk_start + QUERY_CHUNK_SIZE
+                    ]
+                    chunk_rows = rows[chunk_start : chunk_start + QUERY_CHUNK_SIZE]
+                    chunk = np.empty(
+                        (len(chunk_rows), live[0][0].vectors.shape[1]),
+                        dtype=self.dtype,
+                    )
+                    for i, (segment, _) in enumerate(live):
+                        mask = chunk_segments == i
+                        if mask.any():
+                            chunk[mask] = segment.vectors[chunk_rows[mask]]
+                    yield chunk
+
+            new_segments = (
+                [self._write_segment(chunks(), count, lists)] if count else []
+            )
+            if new_segments:
+                segment_ids = [segment.id for segment, _ in live]
+                self._conn.executemany(
+                    "UPDATE nodes SET segment = ?, row = ? WHERE segment = ? AND row = ?",
+                    [
+                        (new_segments[0].id, new_row, segment_ids[segment_index], row)
+                        for new_row, (segment_index, row) in enumerate(
+                            zip(segment_indexes.tolist(), rows.tolist())
+                        )
+                    ],
+                )
+                self._conn.commit()
+            self._segments = new_segments
+            self._row_count, self._deleted_count = count, 0
+            for segment in old_segments:
+                # The segments still being read by a query stay mapped until it's done
+                self._remove_segment_files(segment.id)
+            logger.info(
+                f"Compacted {len(old_segments)} segments of {self.path} into {count} rows "
+                f"in {time.perf_counter() - start:.2f}s"
+            )
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError(
+                "Metadata filters are not supported by the local vector store"
+            )
+        with self._lock:
+            segments = list(self._segments)
+            centroids = self._centroids
+        top_k = query.similarity_top_k
+        vector = self._normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        # The quantized scores are approximate, more rows are kept to be rescored
+        candidate_count = top_k
+        if self.quantization != "none":
+            candidate_count = int(np.ceil(top_k * self.oversampling))
+
+        if centroids is None or self.nprobe <= 0:
+            candidate_scores, candidate_rows = self._search_exact(
+                segments, vector, candidate_count
+            )
+        else:
+            candidate_scores, candidate_rows = self._search_lists(
+                segments, centroids, vector, candidate_count
+            )
+        if not candidate_rows:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        scores = np.concatenate(candidate_scores)
+        if self.quantization != "none":
+            best = np.argsort(-scores)[:candidate_count]
+            candidate_rows = [candidate_rows[i] for i in best]
+            scores = self._rescore(segments, candidate_rows, vector)
+        order = np.argsort(-scores)[:top_k]
+        return self._get_result(
+            [candidate_rows[i] for i in order], [float(scores[i]) for i in order]
+        )
+
+    def _score(
+        self, segment: Segment, rows: slice | np.ndarray, vector: np.ndarray
+    ) -> np.ndarray:
+        """
+        Get the cosine similarity of the rows of a segment, estimated from the quantized vectors
+        if the store is quantized.
+        """
+        if segment.codes is None:
+            return np.asarray(segment.vectors[rows], dtype=np.float32) @ vector
+        if self.quantization == "binary":
+            differing_bits = POPCOUNT[
+                np.bitwise_xor(segment.codes[rows], np.packbits(vector > 0))
+            ].sum(axis=1)
+            return (1 - 2 * differing_bits / len(vector)).astype(np.float32)
+        return (segment.codes[rows].astype(np.float32) @ vector) * segment.scales[rows]
+
+    def _rescore(
+        self, segments: List[Segment], rows: List[Tuple[int, int]], vector: np.ndarray
+    ) -> np.ndarray:
+        """
+        Get the exact cosine similarity of the (segment, row) rows from the original vectors.
+        """
+        segments_by_id = {segment.id: segment for segment in segments}
+        positions: Dict[int, List[int]] = {}
+        for i, (segment_id, _) in enumerate(rows):
+            positions.setdefault(segment_id, []).append(i)
+        scores = np.empty(len(rows), dtype=np.float32)
+        for segment_id, segment_positions in positions.items():
+            segment_rows = np.array([rows[i][1] for i in segment_positions])
+            scores[segment_positions] = (
+                np.asarray(
+                    segments_by_id[segment_id].vectors[segment_rows], dtype=np.float32
+                )
+                @ vector
+            )
+        return scores
+
+    @staticmethod
+    def _get_best(
+        scores: np.ndarray, rows: np.ndarray, top_k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.isfinite(scores[best])]
+        return scores[best], rows[best]
+
+    def _search_exact(
+        self, segments: List[Segment], vector: np.ndarray, top_k: int
+    ) -> Tuple[List[np.ndarray], List[Tuple[int, int]]]:
+        # Keep the best candidates of every chunk of rows
+        candidate_scores, candidate_rows = [], []
+        for segment in segments:
+            for start in range(0, len(segment.vectors), QUERY_CHUNK_SIZE):
+                scores = self._score(
+                    segment, slice(start, start + QUERY_CHUNK_SIZE), vector
+                )
+                scores[~segment.alive[start : start + QUERY_CHUNK_SIZE]] = -np.inf
+                scores, rows = self._get_best(
+                    scores, np.arange(start, start + len(scores)), top_k
+                )
+                candidate_scores.append(scores)
+                candidate_rows.extend((segment.id, int(row)) for row in rows)
+        return candidate_scores, candidate_rows
+
+    def _search_lists(
+        self,
+        segments: List[Segment],
+        centroids: np.ndarray,
+        vector: np.ndarray,
+        top_k: int,
+    ) -> Tuple[List[np.ndarray], List[Tuple[int, int]]]:
+        # Only score the rows of the lists closest to the query,
+        # more lists are searched if they don't have `top_k` live rows
+        list_order = np.argsort(-(centroids @ vector))
+        nprobe = min(self.nprobe, len(centroids))
+        while True:
+            list_ids = list_order[:nprobe]
+            candidates = [
+                (segment, rows[segment.alive[rows]])
+                for segment in segments
+                for rows in [segment.get_list_rows(list_ids)]
+            ]
+            if sum(len(rows) for _, rows in candidates) >= top_k or nprobe >= len(
+                centroids
+            ):
+                break
+            nprobe = min(nprobe * 2, len(centroids))
+        candidate_scores, candidate_rows = [], []
+        for segment, rows in candidates:
+            for start in range(0, len(rows), QUERY_CHUNK_SIZE):
+                chunk_rows = rows[start : start + QUERY_CHUNK_SIZE]
+                scores, best_rows = self._get_best(
+                    self._score(segment, chunk_rows, vector), chunk_rows, top_k
+                )
+                candidate_scores.append(scores)
+                candidate_rows.extend((segment.id, int(row)) for row in best_rows)
+        return candidate_scores, candidate_rows
+
+    def _get_result(
+        self, rows: List[Tuple[int, int]], similarities: List[float]
+    ) -> VectorStoreQueryResult:
+        with self._lock:
+            found = {
+                (segment_id, row): (node_id, node)
+                for segment_id, row, node_id, node in self._conn.execute(
+                    "SELECT segment, row, node_id, node FROM nodes WHERE "
+                    + " OR ".join(["(segment = ? AND row = ?)"] * len(rows)),
+                    [value for row in rows for value in row],
+                )
+            }
+        nodes, ids, scores = [], [], []
+        for row, similarity in zip(rows, similarities):
+            # The node may have been deleted or compacted since the scoring
+            if row in found:
+                node_id, node = found[row]
+                nodes.append(metadata_dict_to_node(json.loads(node)))
+                ids.append(node_id)
+                scores.append(similarity)
+        return VectorStoreQueryResult(nodes=nodes, similarities=scores, ids=ids)
+
+    # The async methods run in a thread not to block the event loop,
+    # NumPy and SQLite release the GIL while they work
+    async def aquery(
+        self, query: VectorStoreQuery, **kwargs: Any
+    ) -> VectorStoreQueryResult:
+        return await asyncio.to_thread(self.query, query, **kwargs)
+
+    async def async_add(self, nodes: List[BaseNode], **kwargs: Any) -> List[str]:
+        return await asyncio.to_thread(self.add, nodes, **kwargs)
+
+    async def adelete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        await asyncio.to_thread(self.delete, ref_doc_id, **delete_kwargs)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _spherical_kmeans(
+    vectors: np.ndarray, count: int, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Cluster the normalized vectors by cosine similarity, get the normalized centroids.
+    """
+    centroids = vectors[rng.choice(len(vectors), count, replace=False)]
+    for _ in range(ANN_TRAINING_ITERATIONS):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(labels, kind="stable")
+        sorted_labels = labels[order]
+        starts = np.searchsorted(sorted_labels, np.arange(count))
+        sizes = np.diff(np.append(starts, len(vectors)))
+        empty = sizes == 0
+        sums = np.empty_like(centroids)
+        sums[~empty] = np.add.reduceat(vectors[order], starts[~empty])
+        # An empty cluster starts again from a random vector
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = LocalVectorStore._normalize(sums).astype(np.float32)
+    return centroids
+
+
+# One vector store per collection
+_stores: Dict[str, LocalVectorStore] = {}
+_lock = threading.Lock()
+
+
+def _get_collection_path(collection_name: str) -> str:
+    return os.path.join(
+        os.getenv("LOCAL_VECTOR_STORE_PATH", DEFAULT_PATH), collection_name
+    )
+
+
+def get_vector_store(collection_name=None):
+    if not collection_name:
+        collection_name = os.getenv("QDRANT_COLLECTION", "default")
+    with _lock:
+        store = _stores.get(collection_name)
+        if store is None:
+            store = LocalVectorStore(
+                path=_get_collection_path(collection_name),
+                dtype=os.getenv("LOCAL_VECTOR_STORE_DTYPE", "float32"),
+                max_segments=int(
+                    os.getenv("LOCAL_VECTOR_STORE_MAX_SEGMENTS", DEFAULT_MAX_SEGMENTS)
+                ),
+                ann_min_rows=int(
+                    os.getenv("LOCAL_VECTOR_STORE_ANN_MIN_ROWS", DEFAULT_ANN_MIN_ROWS)
+                ),
+                nprobe=int(os.getenv("VECTOR_SEARCH_NPROBE", DEFAULT_NPROBE)),
+                quantization=get_quantization_mode(),
+                oversampling=get_quantization_oversampling(),
+            )
+            _stores[collection_name] = store
+        return store
+
+
+def delete_collection(collection_name: str):
+    """
+    Delete the vectors and nodes of a collection.
+    """
+    with _lock:
+        store = _stores.pop(collection_name, None)
+    if store is not None:
+        store.close()
+    path = _get_collection_path(collection_name)
+    if os.path.exists(path):
+        logger.info(f"Removing collection {collection_name}")
+        shutil.rmtree(path)
+
+
+def _get_benchmark_data(
+    path: str,
+    count: int,
+    dim: int,
+    queries: int,
+    top_k: int,
+    clusters: int = 0,
+) -> Tuple[np.ndarray, np.ndarray, List[set]]:
+    """
+    Get normalized random vectors memory-mapped in `path`, query vectors and the exact
+    top k rows of every query. With `clusters`, the vectors are drawn around random centers
+    like the embeddings of documents on a few topics, instead of uniformly.
+    """
+    batch_size = 10_000
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((clusters, dim)) if clusters else None
+
+    def sample(size: int) -> np.ndarray:
+        vectors = rng.standard_normal((size, dim))
+        if centers is not None:
+            vectors = centers[rng.integers(clusters, size=size)] + 2 * vectors
+        return LocalVectorStore._normalize(vectors).astype(np.float32)
+
+    vectors = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.float32, shape=(count, dim)
+    )
+    for start in range(0, count, batch_size):
+        vectors[start : start + batch_size] = sample(min(batch_size, count - start))
+    query_vectors = sample(queries)
+    expected = []
+    for query_vector in query_vectors:
+        scores = np.concatenate(
+            [
+                vectors[start : start + QUERY_CHUNK_SIZE] @ query_vector
+                for start in range(0, count, QUERY_CHUNK_SIZE)
+            ]
+        )
+        expected.append(set(np.argpartition(-scores, top_k)[:top_k].tolist()))
+    return vectors, query_vectors, expected
+
+
+def _add_benchmark_vectors(
+    store: LocalVectorStore, batch_start: int, batch: np.ndarray
+) -> None:
+    from llama_index.core.schema import TextNode
+
+    nodes = []
+    for i, vector in enumerate(batch):
+        node = TextNode(id_=str(batch_start + i), text="")
+        # Not validated, the validation of the embeddings takes longer than the ingestion
+        node.embedding = vector.tolist()
+        nodes.append(node)
+    store.add(nodes)
+
+
+def _search_benchmark_vectors(
+    store: LocalVectorStore, query_vector: np.ndarray, top_k: int
+) -> List[int]:
+    result = store.query(
+        VectorStoreQuery(query_embedding=query_vector.tolist(), similarity_top_k=top_k)
+    )
+    return [int(node_id) for node_id in result.ids]
+
+
+def _measure_queries(
+    query_vectors: np.ndarray, expected: List[set], search, top_k: int
+) -> dict:
+    latencies, recalled = [], 0
+    for query_vector, expected_ids in zip(query_vectors, expected):
+        start = time.perf_counter()
+        ids = search(query_vector)
+        latencies.append(time.perf_counter() - start)
+        recalled += len(expected_ids & set(ids))
+    latencies.sort()
+    return {
+        "mean_ms": 1000 * sum(latencies) / len(latencies),
+        "p95_ms": 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+        f"recall@{top_k}": recalled / (len(expected) * top_k),
+    }
+
+
+def benchmark_vector_stores(
+    count: int = 1_000_000,
+    dim: int = 384,
+    queries: int = 100,
+    top_k: int = 10,
+    qdrant_url: str | None = None,
+) -> List[dict]:
+    """
+    Report the ingestion time, query latency and recall@k (against an exact search)
+    of the local vector store in float32 and float16 on random vectors,
+    and of Qdrant if `qdrant_url` is given.
+    """
+    import tempfile
+
+    batch_size = 10_000
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vectors, query_vectors, expected = _get_benchmark_data(
+            os.path.join(temp_dir, "vectors.npy"), count, dim, queries, top_k
+        )
+
+        def measure(name: str, add_batch, search, after_ingest=None) -> dict:
+            start = time.perf_counter()
+            for batch_start in range(0, count, batch_size):
+                add_batch(batch_start, vectors[batch_start : batch_start + batch_size])
+            if after_ingest is not None:
+                after_ingest()
+            return {
+                "store": name,
+                "vectors": count,
+                "ingest_seconds": time.perf_counter() - start,
+                **_measure_queries(query_vectors, expected, search, top_k),
+            }
+
+        results = []
+        for dtype in ["float32", "float16"]:
+            # An exact search, the IVF index is benchmarked by `benchmark_ann`
+            store = LocalVectorStore(
+                path=os.path.join(temp_dir, dtype),
+                dtype=dtype,
+                max_segments=count,
+                ann_min_rows=0,
+            )
+            # Query a single segment, compacted after the ingestion
+            results.append(
+                measure(
+                    f"local-{dtype}",
+                    lambda batch_start, batch: _add_benchmark_vectors(
+                        store, batch_start, batch
+                    ),
+                    lambda query_vector: _search_benchmark_vectors(
+                        store, query_vector, top_k
+                    ),
+                    after_ingest=store.compact,
+                )
+            )
+            store.close()
+
+        if qdrant_url:
+            from qdrant_client import QdrantClient, models
+
+            client = QdrantClient(url=qdrant_url, timeout=300)
+            collection_name = "local_vector_store_benchmark"
+            client.recreate_collection(
+                collection_name,
+                vectors_config=models.VectorParams(
+                    size=dim, distance=models.Distance.COSINE
+                ),
+            )
+
+            def add_batch(batch_start, batch):
+                client.upload_collection(
+                    collection_name,
+                    vectors=batch,
+                    ids=range(batch_start, batch_start + len(batch)),
+                    wait=True,
+                )
+
+            def search(query_vector):
+                return [
+                    point.id
+                    for point in client.search(
+                        collection_name, query_vector=query_vector, limit=top_k
+                    )
+                ]
+
+            results.append(measure("qdrant", add_batch, search))
+            client.delete_collection(collection_name)
+        return results
+
+
+def benchmark_ann(
+    count: int = 1_000_000,
+    dim: int = 384,
+    queries: int = 100,
+    top_k: int = 10,
+    nprobes: Iterable[int] = (1, 2, 4, 8, 16, 32, 64),
+    clusters: int = 1000,
+) -> List[dict]:
+    """
+    Report the query latency and recall@k of the IVF index of the local vector store
+    for every `nprobe`, and of the exact search (nprobe 0), on clustered random vectors.
+    """
+    import tempfile
+
+    batch_size = 10_000
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vectors, query_vectors, expected = _get_benchmark_data(
+            os.path.join(temp_dir, "vectors.npy"),
+            count,
+            dim,
+            queries,
+            top_k,
+            clusters=clusters,
+        )
+        # The index is trained with the last batch
+        store = LocalVectorStore(
+            path=os.path.join(temp_dir, "store"), max_segments=count, ann_min_rows=count
+        )
+        start = time.perf_counter()
+        for batch_start in range(0, count, batch_size):
+            _add_benchmark_vectors(
+                store, batch_start, vectors[batch_start : batch_start + batch_size]
+            )
+        logger.info(
+            f"Ingested {count} vectors in {time.perf_counter() - start:.2f}s "
+            f"into {len(store._centroids)} lists"
+        )
+        results = []
+        for nprobe in [0, *nprobes]:
+            store.nprobe = nprobe
+            results.append(
+                {
+                    "nprobe": nprobe,
+                    **_measure_queries(
+                        query_vectors,
+                        expected,
+                        lambda query_vector: _search_benchmark_vectors(
+                            store, query_vector, top_k
+                        ),
+                        top_k,
+                    ),
+                }
+            )
+        store.close()
+        return results
+
+
+def benchmark_quantization(
+    count: int = 1_000_000,
+    dim: int = 384,
+    queries: int = 100,
+    top_k: int = 10,
+    oversamplings: Iterable[float] = (1.0, DEFAULT_QUANTIZATION_OVERSAMPLING),
+    clusters: int = 1000,
+) -> List[dict]:
+    """
+    Report the memory of the searched vectors per million vectors, the query latency
+    and the recall@k (against an exact search on float32 vectors) of the local vector store
+    for every quantization and oversampling, on clustered random vectors.
+    """
+    import tempfile
+
+    batch_size = 10_000
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vectors, query_vectors, expected = _get_benchmark_data(
+            os.path.join(temp_dir, "vectors.npy"),
+            count,
+            dim,
+            queries,
+            top_k,
+            clusters=clusters,
+        )
+        results = []
+        for quantization in QUANTIZATION_MODES:
+            store = LocalVectorStore(
+                path=os.path.join(temp_dir, quantization),
+                max_segments=count,
+                ann_min_rows=0,
+                quantization=quantization,
+            )
+            for batch_start in range(0, count, batch_size):
+                _add_benchmark_vectors(
+                    store, batch_start, vectors[batch_start : batch_start + batch_size]
+                )
+            store.compact()
+            segment = store._segments[0]
+            if segment.codes is None:
+                memory = segment.vectors.nbytes
+            else:
+                memory = segment.codes.nbytes
+                if segment.scales is not None:
+                    memory += segment.scales.nbytes
+            for oversampling in oversamplings if quantization != "none" else [1.0]:
+                store.oversampling = oversampling
+                results.append(
+                    {
+                        "quantization": quantization,
+                        "oversampling": oversampling,
+                        "memory_mb_per_million": memory / count * 1_000_000 / 2**20,
+                        **_measure_queries(
+                            query_vectors,
+                            expected,
+                            lambda query_vector: _search_benchmark_vectors(
+                                store, query_vector, top_k
+                            ),
+                            top_k,
+                        ),
+                    }
+                )
+            store.close()
+        return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    benchmark = sys.argv[2] if len(sys.argv) > 2 else None
+    if benchmark == "ann":
+        results = benchmark_ann(count)
+    elif benchmark == "quantization":
+        results = benchmark_quantization(count)
+    else:
+        results = benchmark_vector_stores(count, qdrant_url=os.getenv("QDRANT_URL"))
+    for result in results:
+        logger.info(result)
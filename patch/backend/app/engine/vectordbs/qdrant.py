@@ -1,20 +1,260 @@
 import os
+import logging
+import threading
+from typing import Any, Dict, Tuple
+import httpx
+from grpc import RpcError
+from qdrant_client import QdrantClient, AsyncQdrantClient, models
+from qdrant_client.http.exceptions import UnexpectedResponse
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores.types import (
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
 from llama_index.vector_stores.qdrant import QdrantVectorStore
+from llama_index.vector_stores.qdrant.base import DOCUMENT_ID_KEY
+from app.engine.vectordb import get_quantization_mode, get_quantization_oversampling
+
+logger = logging.getLogger("uvicorn")
+
+# One pooled sync and async client per Qdrant URL, shared by the vector stores of all its collections
+_clients: Dict[str, Tuple[QdrantClient, AsyncQdrantClient]] = {}
+# One vector store per (URL, collection)
+_stores: Dict[Tuple[str, str], QdrantVectorStore] = {}
+_lock = threading.Lock()
+
+
+def _get_client_kwargs() -> dict:
+    max_connections = int(os.getenv("QDRANT_MAX_CONNECTIONS", "20"))
+    kwargs = {
+        "api_key": os.getenv("QDRANT_API_KEY") or None,
+        "timeout": int(os.getenv("QDRANT_TIMEOUT", "30")),
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+    }
+    # Opt-in to the faster gRPC transport (exposed on port 6334 by docker-compose)
+    if os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true":
+        kwargs["prefer_grpc"] = True
+        kwargs["grpc_port"] = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+    return kwargs
+
+
+def get_clients(url: str | None = None) -> Tuple[QdrantClient, AsyncQdrantClient]:
+    """
+    Get the shared sync and async clients of the Qdrant server.
+    """
+    url = url or os.getenv("QDRANT_URL", "http://localhost:6333")
+    with _lock:
+        clients = _clients.get(url)
+        if clients is None:
+            kwargs = _get_client_kwargs()
+            clients = (
+                QdrantClient(url=url, **kwargs),
+                AsyncQdrantClient(url=url, **kwargs),
+            )
+            _clients[url] = clients
+        return clients
+
+
+def get_quantization_config() -> models.QuantizationConfig | None:
+    """
+    Get the quantization of the collections for the configured VECTOR_QUANTIZATION,
+    the quantized vectors are always kept in RAM.
+    """
+    mode = get_quantization_mode()
+    if mode == "int8":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=0.99, always_ram=True
+            )
+        )
+    if mode == "binary":
+        return models.BinaryQuantization(
+            binary=models.BinaryQuantizationConfig(always_ram=True)
+        )
+    return None
+
+
+class QuantizedQdrantVectorStore(QdrantVectorStore):
+    """
+    A Qdrant vector store creating its collection with quantized vectors, the original vectors
+    are stored on disk and only read to rescore the oversampled results of the quantized search.
+    """
+
+    _quantization_config: Any = PrivateAttr()
+    _oversampling: float = PrivateAttr()
+
+    def __init__(self, quantization_config: Any, oversampling: float, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._quantization_config = quantization_config
+        self._oversampling = oversampling
+
+    def _get_collection_config(self, vector_size: int) -> dict:
+        return {
+            "vectors_config": models.VectorParams(
+                size=vector_size, distance=models.Distance.COSINE, on_disk=True
+            ),
+            "quantization_config": self._quantization_config,
+        }
+
+    def _create_collection(self, collection_name: str, vector_size: int) -> None:
+        if self.enable_hybrid:
+            return super()._create_collection(collection_name, vector_size)
+        try:
+            self._client.create_collection(
+                collection_name=collection_name,
+                **self._get_collection_config(vector_size),
+            )
+            if self.index_doc_id:
+                self._client.create_payload_index(
+                    collection_name=collection_name,
+                    field_name=DOCUMENT_ID_KEY,
+                    field_schema=models.PayloadSchemaType.KEYWORD,
+                )
+        except (RpcError, ValueError, UnexpectedResponse) as exc:
+            if "already exists" not in str(exc):
+                raise exc
+            logger.warning(f"Collection {collection_name} already exists")
+        self._collection_initialized = True
+
+    async def _acreate_collection(self, collection_name: str, vector_size: int) -> None:
+        if self.enable_hybrid:
+            return await super()._acreate_collection(collection_name, vector_size)
+        try:
+            await self._aclient.create_collection(
+                collection_name=collection_name,
+                **self._get_collection_config(vector_size),
+            )
+            if self.index_doc_id:
+                await self._aclient.create_payload_index(
+                    collection_name=collection_name,
+                    field_name=DOCUMENT_ID_KEY,
+                    field_schema=models.PayloadSchemaType.KEYWORD,
+                )
+        except (RpcError, ValueError, UnexpectedResponse) as exc:
+            if "already exists" not in str(exc):
+                raise exc
+            logger.warning(f"Collection {collection_name} already exists")
+        self._collection_initialized = True
+
+    def _get_search_kwargs(self, query: VectorStoreQuery, **kwargs: Any) -> dict:
+        return {
+            "collection_name": self.collection_name,
+            "query_vector": query.query_embedding,
+            "limit": query.similarity_top_k,
+            "query_filter": kwargs.get("qdrant_filters")
+            or self._build_query_filter(query),
+            "search_params": models.SearchParams(
+                quantization=models.QuantizationSearchParams(
+                    rescore=True, oversampling=self._oversampling
+                )
+            ),
+        }
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        # The hybrid and sparse searches don't use the quantized dense vectors
+        if self.enable_hybrid or query.mode != VectorStoreQueryMode.DEFAULT:
+            return super().query(query, **kwargs)
+        response = self._client.search(**self._get_search_kwargs(query, **kwargs))
+        return self.parse_to_query_result(response)
+
+    async def aquery(
+        self, query: VectorStoreQuery, **kwargs: Any
+    ) -> VectorStoreQueryResult:
+        if self.enable_hybrid or query.mode != VectorStoreQueryMode.DEFAULT:
+            return await super().aquery(query, **kwargs)
+        response = await self._aclient.search(
+            **self._get_search_kwargs(query, **kwargs)
+        )
+        return self.parse_to_query_result(response)
 
 
 def get_vector_store(collection_name):
     if not collection_name:
         collection_name = os.getenv("QDRANT_COLLECTION", "default")
     url = os.getenv("QDRANT_URL", "http://localhost:6333")
-    api_key = os.getenv("QDRANT_API_KEY")
     if not collection_name or not url:
         raise ValueError(
             "Please set QDRANT_COLLECTION, QDRANT_URL"
             " to your environment variables or config them in the .env file"
         )
-    store = QdrantVectorStore(
-        collection_name=collection_name,
-        url=url,
-        api_key=api_key,
-    )
-    return store
\ No newline at end of file
+    key = (url, collection_name)
+    store = _stores.get(key)
+    if store is None:
+        client, aclient = get_clients(url)
+        kwargs = {
+            "collection_name": collection_name,
+            "client": client,
+            "aclient": aclient,
+            "batch_size": int(os.getenv("QDRANT_BATCH_SIZE", "64")),
+        }
+        # The quantization only applies to the collections created from now on
+        quantization_config = get_quantization_config()
+        if quantization_config is None:
+            store = QdrantVectorStore(**kwargs)
+        else:
+            store = QuantizedQdrantVectorStore(
+                quantization_config=quantization_config,
+                oversampling=get_quantization_oversampling(),
+                **kwargs,
+            )
+        with _lock:
+            store = _stores.setdefault(key, store)
+    return store
+
+
+def forget_vector_store(collection_name: str):
+    """
+    Drop the cached vector store of a collection, e.g. after the collection has been deleted.
+    """
+    url = os.getenv("QDRANT_URL", "http://localhost:6333")
+    with _lock:
+        _stores.pop((url, collection_name), None)
+
+
+def delete_collection(collection_name: str):
+    """
+    Delete a collection from the Qdrant server, if it exists.
+    """
+    client, _ = get_clients()
+    if client.collection_exists(collection_name):
+        logger.info(f"Removing collection {collection_name}")
+        client.delete_collection(collection_name)
+    forget_vector_store(collection_name)
+
+
+def check_health() -> bool:
+    """
+    Check that all the Qdrant servers with open clients are reachable.
+    The clients of an unreachable server are dropped, so the next request reconnects.
+    """
+    with _lock:
+        clients = list(_clients.items())
+    healthy = True
+    for url, (client, _) in clients:
+        try:
+            client.get_collections()
+        except Exception as e:
+            logger.warning(f"Qdrant at {url} is not reachable: {e}")
+            healthy = False
+            with _lock:
+                _clients.pop(url, None)
+                for key in [key for key in _stores if key[0] == url]:
+                    _stores.pop(key)
+    return healthy
+
+
+async def close_clients():
+    """
+    Close the pooled clients, called on the application shutdown.
+    """
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _stores.clear()
+    for client, aclient in clients:
+        client.close()
+        await aclient.close()
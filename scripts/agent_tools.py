@@ -0,0 +1,164 @@
+"""
+Check the timeouts, the cache and the prefetched calls of the agent tools on local stub
+tools, without an LLM or a tool service. Run it from the root of the repo, with the
+create_llama backend installed:
+
+    PYTHONPATH=.:./create_llama/backend python -m scripts.agent_tools
+
+It fails with an AssertionError if a slow tool doesn't give an error output after its
+timeout, a cached result is not reused or outlives its TTL, or a call prefetched by a
+`ToolStep` is used by another step or kept after its step ends.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict
+from llama_index.core.tools import FunctionTool
+from app.engine.agent import GuardedTool, ToolStep
+
+logger = logging.getLogger("uvicorn")
+
+
+class StubTool:
+    """
+    A search tool answering after `latency` seconds, counting its calls per query.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def search(self, query: str) -> str:
+        """Search the web for the query."""
+        with self._lock:
+            self.calls[query] += 1
+        time.sleep(self.latency)
+        if query == "fail":
+            raise ValueError("Search service error")
+        return f"Results for {query}"
+
+    def get_tool(self, timeout: float, cache_ttl: float) -> GuardedTool:
+        tool = FunctionTool.from_defaults(fn=self.search, name="search")
+        return GuardedTool(tool, timeout=timeout, cache_ttl=cache_ttl)
+
+
+def check_timeout() -> Dict[str, Any]:
+    """
+    A tool slower than its timeout gives an error output in about the timeout,
+    in the sync and async calls, and the error is not cached.
+    """
+    stub = StubTool(latency=1.0)
+    tool = stub.get_tool(timeout=0.2, cache_ttl=60)
+
+    start = time.perf_counter()
+    output = tool(query="slow")
+    seconds = time.perf_counter() - start
+    assert output.is_error, "The slow tool call didn't give an error output"
+    assert isinstance(output.raw_output, TimeoutError)
+    assert "did not answer" in output.content
+    assert seconds < 0.8, f"The timed out call took {seconds:.2f}s"
+
+    async def acall_timed():
+        # Timed in the event loop, `asyncio.run` waits for the timed out call to return
+        start = time.perf_counter()
+        output = await tool.acall(query="slow")
+        return output, time.perf_counter() - start
+
+    output, async_seconds = asyncio.run(acall_timed())
+    assert output.is_error and isinstance(output.raw_output, TimeoutError)
+    assert async_seconds < 0.8, f"The timed out async call took {async_seconds:.2f}s"
+
+    # The errors are retried on the next call
+    failing_stub = StubTool()
+    failing_tool = failing_stub.get_tool(timeout=5, cache_ttl=60)
+    output = failing_tool(query="fail")
+    assert output.is_error and "Search service error" in output.content
+    failing_tool(query="fail")
+    assert failing_stub.calls["fail"] == 2, "An error output was cached"
+    return {"timeout_seconds": seconds, "async_timeout_seconds": async_seconds}
+
+
+def check_cache() -> Dict[str, Any]:
+    """
+    The result of a call is reused for the same arguments until its TTL has passed,
+    and only for the same arguments.
+    """
+    stub = StubTool()
+    tool = stub.get_tool(timeout=5, cache_ttl=0.5)
+
+    first = tool(query="cached")
+    second = tool(query="cached")
+    asyncio.run(tool.acall(query="cached"))
+    assert not first.is_error and second.content == first.content
+    assert stub.calls["cached"] == 1, "The cached result wasn't reused"
+    tool(query="other")
+    assert stub.calls["other"] == 1
+
+    time.sleep(0.6)
+    tool(query="cached")
+    assert stub.calls["cached"] == 2, "The cached result outlived its TTL"
+
+    # Without a TTL, every call runs the tool
+    uncached_tool = stub.get_tool(timeout=5, cache_ttl=0)
+    uncached_tool(query="uncached")
+    uncached_tool(query="uncached")
+    assert stub.calls["uncached"] == 2, "The result of a tool without TTL was cached"
+    return {"calls": dict(stub.calls)}
+
+
+def check_prefetch() -> Dict[str, Any]:
+    """
+    The calls prefetched in a `ToolStep` run at once and give their result to the calls
+    of the step, not to the other steps, and are dropped when the step ends.
+    """
+    latency = 0.3
+    stub = StubTool(latency=latency)
+    tool = stub.get_tool(timeout=5, cache_ttl=0)
+    queries = [f"query {i}" for i in range(4)]
+
+    # The calls of the step use the calls started together
+    start = time.perf_counter()
+    with ToolStep([tool]):
+        for query in queries:
+            tool.prefetch(query=query)
+        outputs = [tool(query=query) for query in queries]
+    seconds = time.perf_counter() - start
+    assert [output.content for output in outputs] == [
+        f"Results for {query}" for query in queries
+    ]
+    assert all(stub.calls[query] == 1 for query in queries), "A call ran twice"
+    assert seconds < latency * len(queries) / 2, f"The calls took {seconds:.2f}s"
+
+    # Another step with the same arguments calls the tool itself
+    with ToolStep([tool]) as step:
+        tool.prefetch(query="scoped")
+        with ToolStep([tool]):
+            asyncio.run(tool.acall(query="scoped"))
+            tool(query="scoped")
+        assert stub.calls["scoped"] == 3, "A step used the call prefetched by another"
+        # The call of the step is still pending until it exits
+        assert any(key[0] == step.id for key in tool._pending)
+    assert not tool._pending, "The unused prefetched call was kept after its step"
+
+    # Outside of a step, nothing is prefetched
+    tool.prefetch(query="no step")
+    assert not tool._pending and stub.calls["no step"] == 0
+    return {"prefetch_seconds": seconds, "sequential_seconds": latency * len(queries)}
+
+
+def check_agent_tools() -> Dict[str, Any]:
+    return {
+        "timeout": check_timeout(),
+        "cache": check_cache(),
+        "prefetch": check_prefetch(),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for name, result in check_agent_tools().items():
+        logger.info(f"{name}: {result}")
@@ -0,0 +1,170 @@
+"""
+Check the throttling path of the embedding executor against a local stub embedding
+service which rate limits the requests of more than a number of texts, without an
+embedding provider. Run it from the root of the repo, with the create_llama backend installed:
+
+    PYTHONPATH=.:./create_llama/backend python -m scripts.embedding_throttling
+
+It fails with an AssertionError if the executor doesn't halve the batch size on the
+rate limits, back off and retry the failed texts, return the embeddings in the order of
+the texts, grow the batch size back once the rate limit is lifted, or retries other errors.
+"""
+
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from app.engine.embedding_executor import EmbeddingExecutor
+
+logger = logging.getLogger("uvicorn")
+
+EMBED_DIM = 8
+
+
+class RateLimitError(Exception):
+    """
+    The error of an embedding provider rejecting a request with a 429 status code.
+    """
+
+
+class ThrottlingEmbedding(BaseEmbedding):
+    """
+    An embedding service rejecting the requests of more than `max_texts` texts with a
+    429 error, or every request with another error if `broken` is set. The size of each
+    request and the number of concurrent requests are recorded.
+    """
+
+    max_texts: Optional[int] = None
+    broken: bool = False
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _requests: List[Dict[str, Any]] = PrivateAttr(default_factory=list)
+    _in_flight: int = PrivateAttr(default=0)
+    _max_in_flight: int = PrivateAttr(default=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ThrottlingEmbedding"
+
+    @property
+    def requests(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._requests)
+
+    @property
+    def max_in_flight(self) -> int:
+        return self._max_in_flight
+
+    def reset(self):
+        with self._lock:
+            self._requests = []
+            self._max_in_flight = 0
+
+    @staticmethod
+    def embed(text: str) -> List[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [byte / 255 for byte in digest[:EMBED_DIM]]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self.embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self.embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        try:
+            # Give the other requests time to be sent concurrently
+            time.sleep(0.01)
+            throttled = self.max_texts is not None and len(texts) > self.max_texts
+            with self._lock:
+                self._requests.append({"texts": len(texts), "throttled": throttled})
+            if self.broken:
+                raise ValueError("Invalid embedding request")
+            if throttled:
+                raise RateLimitError(
+                    f"Error code: 429 - rate limit exceeded, {len(texts)} texts "
+                    f"in a request, at most {self.max_texts} allowed"
+                )
+            return [self.embed(text) for text in texts]
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+def check_embedding_throttling(
+    batch_size: int = 64, concurrency: int = 4, max_texts: int = 20, texts: int = 500
+) -> Dict[str, Any]:
+    """
+    Embed `texts` texts through the executor while the stub service only accepts
+    `max_texts` texts per request, then without the rate limit, and assert the behavior
+    of the executor at each step.
+    """
+    embed_model = ThrottlingEmbedding(max_texts=max_texts)
+    executor = EmbeddingExecutor(embed_model, batch_size, concurrency)
+    inputs = [f"Text {i} of the embedding throttling check" for i in range(texts)]
+    expected = [embed_model.embed(text) for text in inputs]
+
+    # The rate limited requests are split until the batches are accepted
+    start = time.perf_counter()
+    embeddings = executor.embed(inputs)
+    throttled_seconds = time.perf_counter() - start
+    requests = embed_model.requests
+    throttled = [request for request in requests if request["throttled"]]
+    accepted = [request for request in requests if not request["throttled"]]
+    assert embeddings == expected, "The embeddings are not in the order of the texts"
+    assert throttled, "The stub service didn't rate limit any request"
+    assert all(request["texts"] <= max_texts for request in accepted)
+    assert sum(request["texts"] for request in accepted) == texts
+    # Halved until the batches are accepted, it may have grown back and been halved again
+    throttled_batch_size = executor.batch_size
+    assert (
+        throttled_batch_size <= max_texts
+    ), f"Batch size {throttled_batch_size}, expected at most {max_texts}"
+    # At least the first backoff of half a second before retrying
+    assert throttled_seconds >= 0.5, "The executor retried without backing off"
+    assert embed_model.max_in_flight <= concurrency
+
+    # Without the rate limit, the batch size doubles back after a few batches
+    embed_model.max_texts = None
+    embed_model.reset()
+    executor.embed(inputs)
+    assert (
+        executor.batch_size == batch_size
+    ), f"Batch size {executor.batch_size}, expected {batch_size}"
+    embed_model.reset()
+    assert executor.embed(inputs) == expected
+    assert max(request["texts"] for request in embed_model.requests) == batch_size
+
+    # The other errors are raised at once, retrying wouldn't help
+    embed_model.broken = True
+    embed_model.reset()
+    try:
+        executor.embed(inputs[:batch_size])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("The error of the embedding service wasn't raised")
+    assert len(embed_model.requests) == 1, "The executor retried a non-throttling error"
+
+    return {
+        "texts": texts,
+        "max_texts": max_texts,
+        "throttled_requests": len(throttled),
+        "accepted_requests": len(accepted),
+        "throttled_seconds": throttled_seconds,
+        "throttled_batch_size": throttled_batch_size,
+        "grown_batch_size": executor.batch_size,
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info(check_embedding_throttling())
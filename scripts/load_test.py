@@ -0,0 +1,592 @@
+"""
+Load tests of the chat API on local stub services, without an LLM, embedding or vector
+database service. Run them from the root of the repo, with the create_llama backend installed:
+
+    PYTHONPATH=.:./create_llama/backend python -m scripts.load_test chat [concurrency ...]
+    PYTHONPATH=.:./create_llama/backend python -m scripts.load_test ingestion [concurrency files]
+    PYTHONPATH=.:./create_llama/backend python -m scripts.load_test isolation [concurrency files]
+
+- chat: the throughput and latency of the sync and async chat paths at each concurrency
+- ingestion: the chat latency before and while files are uploaded and ingested
+- isolation: the chat requests on several collections while their files are ingested
+  only cite the files of their collection, on the local vector store
+
+The stubs only exist in this script: they are set in the settings and injected in place
+of the configured vector store provider by the test itself. The tests run in a temporary
+directory, the uploaded files and the stores don't touch the data and storage folders.
+"""
+
+import os
+import time
+import types
+import random
+import shutil
+import asyncio
+import hashlib
+import itertools
+import logging
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, List, Sequence
+import anyio
+import httpx
+from fastapi import Depends, FastAPI
+from llama_index.core.base.llms.generic_utils import (
+    astream_completion_response_to_chat_response,
+    completion_response_to_chat_response,
+)
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.chat_engine.types import BaseChatEngine
+from llama_index.core.llms import CustomLLM
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.schema import BaseNode, TextNode
+from llama_index.core.settings import Settings
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+import app.settings as app_settings
+from app.api.routers.chat import chat_router
+from app.engine import get_chat_engine, vectordb
+from app.engine.engine_cache import invalidate_engine_cache
+
+logger = logging.getLogger("uvicorn")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EMBED_DIM = 64
+# The stub vector store answers the queries of the collection, whatever is ingested
+LOAD_TEST_COLLECTION = "load_test"
+
+# Each question is new, none is answered from a cache
+_question_ids = itertools.count()
+
+
+class StubLLM(CustomLLM):
+    """
+    An LLM streaming `tokens` tokens in `latency` seconds, like a remote LLM service.
+    """
+
+    latency: float = Field(default=1.0)
+    tokens: int = Field(default=20)
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="stub")
+
+    @llm_completion_callback()
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        time.sleep(self.latency)
+        return CompletionResponse(text="token " * self.tokens)
+
+    @llm_completion_callback()
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        text = ""
+        for _ in range(self.tokens):
+            time.sleep(self.latency / self.tokens)
+            text += "token "
+            yield CompletionResponse(text=text, delta="token ")
+
+    @llm_chat_callback()
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        return completion_response_to_chat_response(
+            await self.acomplete(self.messages_to_prompt(messages), formatted=True)
+        )
+
+    @llm_chat_callback()
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        return astream_completion_response_to_chat_response(
+            await self.astream_complete(
+                self.messages_to_prompt(messages), formatted=True
+            )
+        )
+
+    @llm_completion_callback()
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        await asyncio.sleep(self.latency)
+        return CompletionResponse(text="token " * self.tokens)
+
+    @llm_completion_callback()
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        async def gen() -> CompletionResponseAsyncGen:
+            text = ""
+            for _ in range(self.tokens):
+                await asyncio.sleep(self.latency / self.tokens)
+                text += "token "
+                yield CompletionResponse(text=text, delta="token ")
+
+        return gen()
+
+
+class StubEmbedding(BaseEmbedding):
+    """
+    An embedding model with a different vector for each text, so the questions of the load test
+    are neither answered by the semantic cache nor by the retrieval cache. The texts of the
+    ingestion are embedded in `latency` seconds per batch, like a remote embedding service.
+    """
+
+    embed_dim: int = EMBED_DIM
+    latency: float = 0.0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StubEmbedding"
+
+    def _embed(self, text: str) -> List[float]:
+        digest = hashlib.sha512(text.encode("utf-8")).digest()
+        return [byte / 255 - 0.5 for byte in digest[: self.embed_dim]]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+
+class StubVectorStore(BasePydanticVectorStore):
+    """
+    A vector store answering after `latency` seconds, like a remote vector database.
+    It stores nothing and answers with made up nodes.
+    """
+
+    stores_text: bool = True
+    latency: float = 0.05
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        pass
+
+    def _get_result(self, query: VectorStoreQuery) -> VectorStoreQueryResult:
+        nodes = [
+            TextNode(id_=f"node-{i}", text=f"Context {i} of {query.query_str}")
+            for i in range(query.similarity_top_k)
+        ]
+        return VectorStoreQueryResult(
+            nodes=nodes,
+            similarities=[1.0] * len(nodes),
+            ids=[node.node_id for node in nodes],
+        )
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        time.sleep(self.latency)
+        return self._get_result(query)
+
+    async def aquery(
+        self, query: VectorStoreQuery, **kwargs: Any
+    ) -> VectorStoreQueryResult:
+        await asyncio.sleep(self.latency)
+        return self._get_result(query)
+
+
+@contextmanager
+def use_work_dir():
+    """
+    Run in a temporary directory with the config of the repo.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="load-test-") as work_dir:
+        shutil.copytree(
+            os.path.join(REPO_DIR, "config"), os.path.join(work_dir, "config")
+        )
+        os.makedirs(os.path.join(work_dir, "data"))
+        os.chdir(work_dir)
+        try:
+            yield work_dir
+        finally:
+            os.chdir(cwd)
+
+
+def use_stub_models(llm_latency: float, embedding_latency: float):
+    """
+    Use the stub LLM and embedding model, also when the ingestion initializes the settings.
+    """
+
+    def init_stub_settings():
+        Settings.llm = StubLLM(latency=llm_latency)
+        Settings.embed_model = StubEmbedding(latency=embedding_latency)
+
+    app_settings.init_settings = init_stub_settings
+    init_stub_settings()
+
+
+def use_stub_vector_store(latency: float):
+    """
+    Serve every collection from a stub vector store, in place of the configured provider.
+    """
+    provider = types.SimpleNamespace(
+        get_vector_store=lambda collection_name: StubVectorStore(latency=latency)
+    )
+    vectordb.get_vector_store_module = lambda: provider
+
+
+def _get_sources(response) -> List[str]:
+    return [node.metadata.get("file_path", "") for node in response.source_nodes]
+
+
+def create_load_test_app(
+    llm_latency: float = 1.0,
+    vector_store_latency: float | None = 0.05,
+    embedding_latency: float = 0.0,
+) -> FastAPI:
+    """
+    Get an app answering the chat requests with the chat engine of `get_chat_engine` on the stub
+    services: on the chat router of the app (`/api/chat`, async), and synchronously in the
+    threadpool on `/sync` (like a sync endpoint) and asynchronously on `/async` with the files
+    of the cited nodes. The files API ingests the uploaded files in the background like the app.
+    The configured vector store is used if `vector_store_latency` is None. The other settings
+    (retrieval mode, caches, reranker...) are the configured ones.
+    """
+    use_stub_models(llm_latency, embedding_latency)
+    if vector_store_latency is not None:
+        use_stub_vector_store(vector_store_latency)
+    # The cached engines use the previous settings
+    invalidate_engine_cache()
+    # Only imported now, the ingestion imports `init_settings` and must get the stub one
+    from src.routers.management.files import files_router
+
+    app = FastAPI()
+    app.include_router(chat_router, prefix="/api/chat")
+    app.include_router(files_router, prefix="/api/management/files")
+
+    @app.post("/sync")
+    def sync_chat(
+        data: dict, chat_engine: BaseChatEngine = Depends(get_chat_engine)
+    ) -> dict:
+        response = chat_engine.stream_chat(data["messages"][-1]["content"])
+        return {
+            "response": "".join(response.response_gen),
+            "sources": _get_sources(response),
+        }
+
+    @app.post("/async")
+    async def async_chat(
+        data: dict, chat_engine: BaseChatEngine = Depends(get_chat_engine)
+    ) -> dict:
+        response = await chat_engine.astream_chat(data["messages"][-1]["content"])
+        return {
+            "response": "".join(
+                [token async for token in response.async_response_gen()]
+            ),
+            "sources": _get_sources(response),
+        }
+
+    return app
+
+
+def _get_client(app: FastAPI) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://load-test",
+        timeout=None,
+    )
+
+
+async def _ask(client: httpx.AsyncClient, path: str, collection: str) -> httpx.Response:
+    """
+    Ask a new question in a collection and wait for the whole response.
+    """
+    response = await client.post(
+        path,
+        params={"collection": collection},
+        json={
+            "messages": [{"role": "user", "content": f"Question {next(_question_ids)}"}]
+        },
+    )
+    response.raise_for_status()
+    return response
+
+
+async def _send_chat(
+    client: httpx.AsyncClient, path: str, collection: str = LOAD_TEST_COLLECTION
+) -> float:
+    """
+    Ask a new question and return the latency of the response.
+    """
+    start = time.perf_counter()
+    await _ask(client, path, collection)
+    return time.perf_counter() - start
+
+
+def _percentile_ms(latencies: List[float], share: float) -> float:
+    latencies = sorted(latencies)
+    return 1000 * latencies[int(share * (len(latencies) - 1))]
+
+
+async def run_load_test(
+    concurrencies: Sequence[int] = (10, 40, 100, 200, 400),
+    llm_latency: float = 1.0,
+    vector_store_latency: float = 0.05,
+) -> List[dict]:
+    """
+    Send `concurrency` chat requests at once to the sync and async chat paths, and report
+    their throughput, latency and the CPU time of the process per request: a path using
+    little CPU but not scaling waits on a blocking step, not on the Python overhead.
+    """
+    app = create_load_test_app(llm_latency, vector_store_latency)
+    thread_limit = anyio.to_thread.current_default_thread_limiter().total_tokens
+    results = []
+    async with _get_client(app) as client:
+        # The first requests create the shared engine components
+        for path in ["/sync", "/api/chat"]:
+            await _send_chat(client, path)
+        for concurrency in concurrencies:
+            for path in ["/sync", "/api/chat"]:
+                start = time.perf_counter()
+                cpu_start = time.process_time()
+                latencies = await asyncio.gather(
+                    *[_send_chat(client, path) for _ in range(concurrency)]
+                )
+                seconds = time.perf_counter() - start
+                cpu_seconds = time.process_time() - cpu_start
+                results.append(
+                    {
+                        "path": path,
+                        "concurrency": concurrency,
+                        "thread_limit": thread_limit,
+                        "requests_per_second": concurrency / seconds,
+                        "mean_ms": 1000 * sum(latencies) / len(latencies),
+                        "p95_ms": _percentile_ms(latencies, 0.95),
+                        "cpu_ms_per_request": 1000 * cpu_seconds / concurrency,
+                        "cpu_utilization": cpu_seconds / seconds,
+                    }
+                )
+    return results
+
+
+def _get_file_content(lines: int, prefix: str = "Line") -> bytes:
+    words = [f"word{i}" for i in range(1000)]
+    return "\n".join(
+        f"{prefix} {i}: {' '.join(random.choices(words, k=12))}" for i in range(lines)
+    ).encode("utf-8")
+
+
+async def _upload_file(
+    client: httpx.AsyncClient, collection: str, file_name: str, content: bytes
+) -> str:
+    """
+    Upload a file with the files API, return the id of its ingestion job.
+    """
+    response = await client.post(
+        f"/api/management/files/{collection}",
+        files={"file": (file_name, content, "text/plain")},
+    )
+    response.raise_for_status()
+    return response.json()["job_id"]
+
+
+async def _wait_for_jobs(client: httpx.AsyncClient, job_ids: List[str]) -> List[dict]:
+    """
+    Poll the ingestion jobs until they are finished, return them.
+    """
+    while True:
+        jobs = []
+        for job_id in job_ids:
+            response = await client.get(f"/api/management/files/jobs/{job_id}")
+            response.raise_for_status()
+            jobs.append(response.json())
+        if all(job["status"] in ("indexed", "failed") for job in jobs):
+            return jobs
+        await asyncio.sleep(0.5)
+
+
+async def run_ingestion_load_test(
+    concurrency: int = 20,
+    files: int = 10,
+    lines: int = 2000,
+    idle_seconds: float = 10.0,
+    llm_latency: float = 1.0,
+    vector_store_latency: float = 0.05,
+    embedding_latency: float = 0.05,
+) -> List[dict]:
+    """
+    Keep `concurrency` chat requests in flight, first without ingestion for `idle_seconds`,
+    then while `files` files of `lines` lines are uploaded and ingested in the background.
+    Report the chat latency of the requests started in each phase, and the ingestion time.
+    """
+    app = create_load_test_app(llm_latency, vector_store_latency, embedding_latency)
+    latencies: Dict[str, List[float]] = {"idle": [], "ingestion": []}
+    state = {"phase": "idle"}
+    stop = asyncio.Event()
+    async with _get_client(app) as client:
+        # The first request creates the shared engine components
+        await _send_chat(client, "/api/chat")
+
+        async def chat_loop():
+            while not stop.is_set():
+                phase = state["phase"]
+                latencies[phase].append(await _send_chat(client, "/api/chat"))
+
+        chat_loops = [asyncio.create_task(chat_loop()) for _ in range(concurrency)]
+        await asyncio.sleep(idle_seconds)
+
+        state["phase"] = "ingestion"
+        start = time.perf_counter()
+        job_ids = [
+            await _upload_file(
+                client, LOAD_TEST_COLLECTION, f"file-{i}.txt", _get_file_content(lines)
+            )
+            for i in range(files)
+        ]
+        jobs = await _wait_for_jobs(client, job_ids)
+        ingestion_seconds = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*chat_loops)
+
+    failed = [job for job in jobs if job["status"] == "failed"]
+    if failed:
+        raise RuntimeError(f"{len(failed)} ingestion jobs failed: {failed[0]['error']}")
+    results = [
+        {
+            "phase": phase,
+            "concurrency": concurrency,
+            "requests": len(phase_latencies),
+            "p50_ms": _percentile_ms(phase_latencies, 0.5),
+            "p99_ms": _percentile_ms(phase_latencies, 0.99),
+            "max_ms": 1000 * max(phase_latencies),
+        }
+        for phase, phase_latencies in latencies.items()
+    ]
+    results.append(
+        {
+            "phase": "ingestion",
+            "files": files,
+            "lines": files * lines,
+            "ingestion_seconds": ingestion_seconds,
+        }
+    )
+    return results
+
+
+def _is_in_collection(file_path: str, collection: str) -> bool:
+    # The files of a collection are in data/<collection>
+    return os.path.basename(os.path.dirname(file_path)) == collection
+
+
+async def run_isolation_load_test(
+    concurrency: int = 30,
+    files: int = 5,
+    collections: int = 3,
+    lines: int = 200,
+    llm_latency: float = 0.2,
+) -> List[dict]:
+    """
+    Upload a file to each of `collections` collections, then keep `concurrency` chat requests
+    on random collections in flight, on the sync and async paths, while `files` more files
+    are uploaded to each collection and ingested. Check that every response cites nodes,
+    only of the files of its collection. The collections are stored in the local vector store.
+    """
+    os.environ["VECTOR_STORE_PROVIDER"] = "local"
+    app = create_load_test_app(llm_latency, vector_store_latency=None)
+    names = [f"tenant-{i}" for i in range(collections)]
+    responses = []
+    stop = asyncio.Event()
+
+    async def upload(file_index: int) -> List[str]:
+        return [
+            await _upload_file(
+                client,
+                name,
+                f"{name}-{file_index}.txt",
+                _get_file_content(lines, prefix=name),
+            )
+            for name in names
+        ]
+
+    async with _get_client(app) as client:
+        # Each collection has documents before the chat requests start
+        jobs = await _wait_for_jobs(client, await upload(0))
+
+        async def chat_loop():
+            while not stop.is_set():
+                collection = random.choice(names)
+                path = random.choice(["/sync", "/async"])
+                response = await _ask(client, path, collection)
+                responses.append((collection, response.json()["sources"]))
+
+        chat_loops = [asyncio.create_task(chat_loop()) for _ in range(concurrency)]
+        job_ids = []
+        for file_index in range(1, files + 1):
+            job_ids += await upload(file_index)
+        jobs += await _wait_for_jobs(client, job_ids)
+        stop.set()
+        await asyncio.gather(*chat_loops)
+
+    failed = [job for job in jobs if job["status"] == "failed"]
+    if failed:
+        raise RuntimeError(f"{len(failed)} ingestion jobs failed: {failed[0]['error']}")
+    foreign = [
+        (collection, source)
+        for collection, sources in responses
+        for source in sources
+        if not _is_in_collection(source, collection)
+    ]
+    without_sources = sum(1 for _, sources in responses if not sources)
+    result = {
+        "collections": collections,
+        "files": len(jobs),
+        "requests": len(responses),
+        "sources": sum(len(sources) for _, sources in responses),
+        "foreign_sources": len(foreign),
+        "responses_without_sources": without_sources,
+    }
+    if foreign or without_sources:
+        raise AssertionError(
+            f"The responses are not isolated: {result}, e.g. {foreign[:1]}"
+        )
+    return [result]
+
+
+SCENARIOS = {
+    "chat": lambda args: run_load_test(args or [10, 40, 100, 200, 400]),
+    "ingestion": lambda args: run_ingestion_load_test(*args),
+    "isolation": lambda args: run_isolation_load_test(*args),
+}
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    scenario = sys.argv[1] if len(sys.argv) > 1 else "chat"
+    if scenario not in SCENARIOS:
+        raise SystemExit(f"Unknown scenario {scenario}, use one of {list(SCENARIOS)}")
+    with use_work_dir():
+        results = asyncio.run(SCENARIOS[scenario]([int(arg) for arg in sys.argv[2:]]))
+    for result in results:
+        logger.info(result)
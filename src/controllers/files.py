@@ -1,8 +1,18 @@
 import os
-from src.tasks.indexing import index_all
+import uuid
+import anyio
+from src.tasks.indexing import get_index_diff
+from src.tasks.ingestion import get_ingestion_queue
 from src.models.file import File, FileStatus, SUPPORTED_FILE_EXTENSIONS
 from typing import List, Union
 from fastapi import UploadFile, HTTPException
+from app.engine.vectordb import validate_collection_name
+
+# Uploads are streamed to disk in chunks of this size instead of being read into memory
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Prefix of the temporary files of the uploads in progress
+UPLOAD_TEMP_PREFIX = ".upload-"
+
 
 class UnsupportedFileExtensionError(Exception):
     pass
@@ -14,40 +24,113 @@ class FileNotFoundError(Exception):
 
 class FileHandler:
 
+    @staticmethod
+    def _get_collection_path(collection: str) -> str:
+        """
+        Get the data folder of a collection, its name is checked before it's used in a path.
+        """
+        try:
+            return os.path.join("data", validate_collection_name(collection))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
     @classmethod
-    def remove_file(cls, collection: str, file_name: str) -> None:
+    def remove_file(cls, collection: str, file_name: str) -> str:
         """
-        Remove a file from the data folder.
+        Remove a file from the data folder and queue its removal from the index.
+        Returns the id of the ingestion job.
         """
         # Adjust the file path to include the collection
-        file_path = f"data/{collection}/{file_name}"
-        
+        file_path = os.path.join(cls._get_collection_path(collection), file_name)
+
         try:
             os.remove(file_path)
         except FileNotFoundError:
             raise HTTPException(
                 status_code=404,
-                detail=f"File '{file_name}' not found in collection '{collection}'."
+                detail=f"File '{file_name}' not found in collection '{collection}'.",
             )
-        # Re-index the data
-        index_all()
+        # Remove only the nodes of the removed file from the index, in the background
+        job = get_ingestion_queue().submit_remove(collection, file_name)
+        return job.id
 
     @classmethod
     def get_current_files(cls, collection: str) -> List[File]:
         """
         Construct the list of files for a specific collection.
         """
-        collection_path = os.path.join("data", collection)
-        
+        collection_path = cls._get_collection_path(collection)
+
         if not os.path.exists(collection_path):
             return []
-        
-        file_names = os.listdir(collection_path)
-        
+
+        file_names = [
+            file_name
+            for file_name in os.listdir(collection_path)
+            if not file_name.startswith(UPLOAD_TEMP_PREFIX)
+        ]
+        ingestion_queue = get_ingestion_queue()
+
         return [
-            File(name=file_name, status=FileStatus.UPLOADED) for file_name in file_names
+            File(
+                name=file_name,
+                # Show the ingestion progress of the file if it has been (re-)uploaded recently
+                status=ingestion_queue.get_file_status(collection, file_name)
+                or FileStatus.UPLOADED,
+            )
+            for file_name in file_names
         ]
 
+    @classmethod
+    def get_changed_files(cls, collection: str):
+        """
+        Get the files of a collection that would be indexed again by the next full indexing.
+        """
+        return get_index_diff(collection)
+
+    @staticmethod
+    def _check_extension(file_name: str) -> UnsupportedFileExtensionError | None:
+        if file_name.split(".")[-1] not in SUPPORTED_FILE_EXTENSIONS:
+            return UnsupportedFileExtensionError(
+                f"File {file_name} with extension {file_name.split('.')[-1]} is not supported."
+            )
+        return None
+
+    @staticmethod
+    def _get_max_upload_size() -> int:
+        return int(float(os.getenv("MAX_UPLOAD_SIZE_MB", "100")) * 1024 * 1024)
+
+    @staticmethod
+    def _file_too_large(file_name: str, max_size: int) -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"File {file_name} exceeds the maximum upload size of {max_size / (1024 * 1024):g} MB.",
+        )
+
+    @classmethod
+    async def _save_file(cls, collection_path: str, file: UploadFile, file_name: str):
+        """
+        Stream the upload to a temporary file in chunks, then rename it to the file name,
+        so a partial upload never replaces an existing file or gets indexed.
+        """
+        max_size = cls._get_max_upload_size()
+        file_location = os.path.join(collection_path, file_name)
+        temp_location = os.path.join(
+            collection_path, f"{UPLOAD_TEMP_PREFIX}{uuid.uuid4().hex}"
+        )
+        size = 0
+        try:
+            async with await anyio.open_file(temp_location, "wb") as f:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise cls._file_too_large(file_name, max_size)
+                    await f.write(chunk)
+            os.replace(temp_location, file_location)
+        finally:
+            if os.path.exists(temp_location):
+                os.remove(temp_location)
+
     @classmethod
     async def upload_file(
         cls, collection: str, file: UploadFile, file_name: str
@@ -55,23 +138,57 @@ class FileHandler:
         """
         Upload a file to the data folder under the specified collection.
         """
+        collection_path = cls._get_collection_path(collection)
+        # Keep the file in the collection folder whatever the name sent by the client
+        file_name = os.path.basename(file_name)
         # Check if the file extension is supported
-        if file_name.split(".")[-1] not in SUPPORTED_FILE_EXTENSIONS:
-            return UnsupportedFileExtensionError(
-                f"File {file_name} with extension {file_name.split('.')[-1]} is not supported."
-            )
-        
+        error = cls._check_extension(file_name)
+        if error is not None:
+            return error
+        # Reject a file declared too large before reading it
+        max_size = cls._get_max_upload_size()
+        if file.size is not None and file.size > max_size:
+            raise cls._file_too_large(file_name, max_size)
+
         # Create collection folder if it does not exist
-        collection_path = f"data/{collection}"
         if not os.path.exists(collection_path):
             os.makedirs(collection_path)
 
         # Save the file to the collection folder
-        file_location = f"{collection_path}/{file_name}"
-        with open(file_location, "wb") as f:
-            f.write(await file.read())
+        await cls._save_file(collection_path, file, file_name)
+
+        # Index only the uploaded file in the background
+        job = get_ingestion_queue().submit_index(collection, [file_name])
 
-        # Index the data (ensure this function is defined somewhere)
-        index_all()
+        return File(name=file_name, status=job.status, job_id=job.id)
 
-        return File(name=file_name, status=FileStatus.UPLOADED)
\ No newline at end of file
+    @classmethod
+    async def upload_files(
+        cls, collection: str, files: List[UploadFile]
+    ) -> Union[List[File], UnsupportedFileExtensionError]:
+        """
+        Upload several files to the specified collection and index them in a single ingestion job.
+        """
+        collection_path = cls._get_collection_path(collection)
+        file_names = [os.path.basename(file.filename) for file in files]
+        # Check all the files before saving anything
+        max_size = cls._get_max_upload_size()
+        for file, file_name in zip(files, file_names):
+            error = cls._check_extension(file_name)
+            if error is not None:
+                return error
+            if file.size is not None and file.size > max_size:
+                raise cls._file_too_large(file_name, max_size)
+
+        if not os.path.exists(collection_path):
+            os.makedirs(collection_path)
+
+        for file, file_name in zip(files, file_names):
+            await cls._save_file(collection_path, file, file_name)
+
+        job = get_ingestion_queue().submit_index(collection, file_names)
+
+        return [
+            File(name=file_name, status=job.status, job_id=job.id)
+            for file_name in file_names
+        ]
@@ -8,16 +8,27 @@ SUPPORTED_FILE_EXTENSIONS = ["txt", "pdf", "csv"]
 class FileStatus:
     UPLOADED = "uploaded"
     UPLOADING = "uploading"
+    # Ingestion progress of an uploaded file
+    QUEUED = "queued"
+    PARSING = "parsing"
+    EMBEDDING = "embedding"
+    INDEXED = "indexed"
+    FAILED = "failed"
 
 
 class File(BaseModel):
     name: str = Field(..., description="The name of the file.")
     status: str = Field(..., description="The status of the file.")
+    job_id: str | None = Field(
+        default=None,
+        description="The id of the ingestion job processing the file.",
+    )
 
     class Config:
         json_schema_extra = {
             "example": {
                 "name": "example.txt",
-                "status": "uploaded",
+                "status": "queued",
+                "job_id": "3f1c5b1e2a5d4c0e9b7a6f8d2c4e1a0b",
             }
         }
@@ -0,0 +1,42 @@
+import time
+from typing import List, Literal
+from pydantic import BaseModel, Field
+from src.models.file import FileStatus
+
+
+class IngestionJob(BaseModel):
+    id: str = Field(..., description="The id of the job.")
+    kind: Literal["index", "remove"] = Field(
+        default="index",
+        description="Whether the job indexes or removes the files.",
+    )
+    collection: str = Field(..., description="The collection of the files.")
+    file_names: List[str] = Field(..., description="The files handled by the job.")
+    status: str = Field(
+        default=FileStatus.QUEUED,
+        description="The current stage of the job.",
+    )
+    error: str | None = Field(
+        default=None,
+        description="The error message if the job failed.",
+    )
+    created_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (FileStatus.INDEXED, FileStatus.FAILED)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "id": "3f1c5b1e2a5d4c0e9b7a6f8d2c4e1a0b",
+                "kind": "index",
+                "collection": "default",
+                "file_names": ["example.txt"],
+                "status": "embedding",
+                "error": None,
+                "created_at": 1718000000.0,
+                "updated_at": 1718000003.5,
+            }
+        }
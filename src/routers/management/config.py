@@ -4,8 +4,11 @@ from fastapi.responses import JSONResponse
 from src.models.model_config import ModelConfig
 from src.models.chat_config import ChatConfig
 from src.controllers.providers import AIProvider
-from src.tasks.indexing import reset_index
+from src.tasks.reindex import get_reindexer
+from llama_index.core.settings import Settings
 from create_llama.backend.app.settings import init_settings
+from app.engine.collection_registry import get_embedding_config
+from app.engine.engine_cache import invalidate_engine_cache
 
 config_router = r = APIRouter()
 
@@ -35,6 +38,7 @@ def update_chat_config(
     if new_config.system_prompt != config.system_prompt:
         # Reload the llama_index settings
         init_settings()
+        invalidate_engine_cache()
 
     return JSONResponse(
         {
@@ -56,16 +60,28 @@ def update_model_config(
     new_config: ModelConfig,
     config: ModelConfig = Depends(ModelConfig.get_config),
 ):
+    # The embedding model the current index was built with
+    serving_embed_model = Settings.embed_model if config.configured else None
+    serving_embedding = get_embedding_config()
     new_config.to_runtime_env()
     new_config.to_env_file()
-    # If the new config has a different model provider
+    # If the new config has a different model provider or embedding model
     # Or the model config has not been configured yet
     # We need to:
     # 1. Reload the llama_index settings
-    # 2. Reset the index
+    # 2. Re-index the data into new collection versions in the background,
+    #    the current ones keep serving the chat until they are built
     init_settings()
-    if (new_config.model_provider != config.model_provider) or not config.configured:
-        reset_index()
+    if (
+        (new_config.model_provider != config.model_provider)
+        or (new_config.embedding_model != config.embedding_model)
+        or not config.configured
+    ):
+        get_reindexer().start(
+            serving_embed_model=serving_embed_model,
+            serving_embedding=serving_embedding,
+        )
+    invalidate_engine_cache()
 
     # Response with the updated config
     config = ModelConfig.get_config()
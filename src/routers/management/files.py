@@ -1,8 +1,18 @@
-from fastapi import APIRouter, UploadFile, Request, HTTPException, Query, File as FastAPIFile
+from fastapi import (
+    APIRouter,
+    UploadFile,
+    Request,
+    HTTPException,
+    Query,
+    File as FastAPIFile,
+)
 from typing import List
 from fastapi.responses import JSONResponse
 from src.models.file import File
+from src.models.job import IngestionJob
 from src.controllers.files import FileHandler, UnsupportedFileExtensionError
+from src.tasks.ingestion import get_ingestion_queue
+from app.engine.manifest import ManifestDiff
 
 files_router = r = APIRouter()
 
@@ -17,10 +27,32 @@ def fetch_files(collection: str = Query(...)) -> List[File]:
     except FileNotFoundError:
         raise HTTPException(
             status_code=404,
-            detail=f"Collection '{collection}' not found or has no files."
+            detail=f"Collection '{collection}' not found or has no files.",
         )
 
 
+@r.get("/jobs/{job_id}")
+def fetch_job(job_id: str) -> IngestionJob:
+    """
+    Get the progress of an ingestion job.
+    """
+    job = get_ingestion_queue().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return job
+
+
+@r.get("/{collection}/diff")
+def fetch_changed_files(collection: str) -> ManifestDiff:
+    """
+    Get the new, modified and deleted files of a collection since it was indexed, without indexing them.
+    """
+    try:
+        return FileHandler.get_changed_files(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @files_router.post("/{collection}")
 async def add_file(collection: str, file: UploadFile = FastAPIFile(...)):
     """
@@ -40,8 +72,27 @@ async def add_file(collection: str, file: UploadFile = FastAPIFile(...)):
     except FileNotFoundError:
         raise HTTPException(
             status_code=404,
-            detail=f"Collection '{collection}' not found. File upload failed."
+            detail=f"Collection '{collection}' not found. File upload failed.",
+        )
+
+
+@files_router.post("/{collection}/batch")
+async def add_files(
+    collection: str, files: List[UploadFile] = FastAPIFile(...)
+) -> List[File]:
+    """
+    Upload several files to a specific collection, they are indexed in a single ingestion job.
+    """
+    res = await FileHandler.upload_files(collection, files)
+    if isinstance(res, UnsupportedFileExtensionError):
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": "UnsupportedFileExtensionError",
+                "message": str(res),
+            },
         )
+    return res
 
 
 # Example file removal endpoint
@@ -51,7 +102,7 @@ async def remove_file(collection: str, file_name: str):
     Remove a file from a specific collection.
     """
     try:
-        FileHandler.remove_file(collection, file_name)
+        job_id = FileHandler.remove_file(collection, file_name)
     except HTTPException as e:
         return JSONResponse(
             status_code=e.status_code,
@@ -70,7 +121,10 @@ async def remove_file(collection: str, file_name: str):
         )
     return JSONResponse(
         status_code=200,
-        content={"message": f"File '{file_name}' removed successfully from collection '{collection}'."},
+        content={
+            "message": f"File '{file_name}' removed successfully from collection '{collection}'.",
+            "job_id": job_id,
+        },
     )
 
 
@@ -80,12 +134,15 @@ async def remove_file(collection: str, file_name: str):
     Remove a file from a specific collection.
     """
     try:
-        FileHandler.remove_file(collection, file_name)
+        job_id = FileHandler.remove_file(collection, file_name)
     except HTTPException as e:
         raise e  # Propagate the exception with the appropriate status code and message
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"An error occurred while trying to remove the file: {str(e)}"
+            detail=f"An error occurred while trying to remove the file: {str(e)}",
         )
-    return {"message": f"File '{file_name}' removed successfully from collection '{collection}'."}
\ No newline at end of file
+    return {
+        "message": f"File '{file_name}' removed successfully from collection '{collection}'.",
+        "job_id": job_id,
+    }
@@ -0,0 +1,44 @@
+import logging
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.engine.condense import get_condense_cache
+from app.engine.context_assembly import get_context_stats
+from app.engine.embedding_cache import get_embedding_cache
+from app.engine.embedding_executor import get_embedding_stats
+from app.engine.retrieval_cache import get_retrieval_cache
+from app.engine.semantic_cache import get_semantic_cache
+from app.engine.vectordb import check_vector_store_health
+
+metrics_router = r = APIRouter()
+
+logger = logging.getLogger("uvicorn")
+
+
+@r.get("")
+def get_metrics():
+    """
+    Get the metrics of the ingestion, the chat caches and the context sent to the LLM.
+    """
+    embedding_cache = get_embedding_cache()
+    retrieval_cache = get_retrieval_cache()
+    semantic_cache = get_semantic_cache()
+    return {
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "embedding": get_embedding_stats(),
+        "retrieval_cache": retrieval_cache.stats() if retrieval_cache else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "condense": get_condense_cache().stats(),
+        "context": get_context_stats().stats(),
+    }
+
+
+@r.get("/health")
+def get_health():
+    """
+    Check the connection to the vector store.
+    """
+    healthy = check_vector_store_health()
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={"vector_store": "ok" if healthy else "unreachable"},
+    )
@@ -0,0 +1,54 @@
+from typing import List
+from fastapi import APIRouter, HTTPException
+from app.engine.collection_registry import CollectionState, get_collection_registry
+from app.engine.vectordb import resolve_collection
+from src.tasks.reindex import get_reindexer
+
+reindex_router = r = APIRouter()
+
+
+@r.get("")
+def fetch_reindex_states() -> List[CollectionState]:
+    """
+    Get the versions and the re-indexing progress of the collections.
+    """
+    return get_collection_registry().get_states()
+
+
+@r.get("/{collection}")
+def fetch_reindex_state(collection: str) -> CollectionState:
+    """
+    Get the versions and the re-indexing progress of a collection.
+    """
+    try:
+        return get_collection_registry().get_state(resolve_collection(collection))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@r.post("/{collection}")
+def reindex_collection(collection: str) -> CollectionState:
+    """
+    Re-index a collection into a new version, the active version keeps serving until it's built.
+    """
+    try:
+        collection = resolve_collection(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if get_collection_registry().get_state(collection).status == "building":
+        raise HTTPException(
+            status_code=409,
+            detail=f"Collection '{collection}' is already being re-indexed.",
+        )
+    return get_reindexer().start([collection])[0]
+
+
+@r.post("/{collection}/rollback")
+def rollback_collection(collection: str) -> CollectionState:
+    """
+    Switch a collection back to its previous version.
+    """
+    try:
+        return get_reindexer().rollback(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -5,6 +5,7 @@ from fastapi.responses import JSONResponse
 
 from src.controllers.tools import ToolsManager, tools_manager
 from src.models.tools import Tools
+from app.engine.engine_cache import invalidate_engine_cache
 
 tools_router = r = APIRouter()
 
@@ -31,4 +32,5 @@ def update_tool(
     Update a tool configuration.
     """
     tools_manager.update_tool(tool_name, data)
+    invalidate_engine_cache()
     return JSONResponse(content={"message": "Tool updated."})
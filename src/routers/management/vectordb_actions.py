@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import os
+from app.engine.vectordb import set_default_collection
 
 vectordb_actions_router = r = APIRouter()
 
@@ -19,11 +19,18 @@ async def set_collection(request: Request, collection: CollectionRequest):
         # For demonstration, we'll just log it and return a response
         print(f"Received collection name: {collection_name}")
 
-        os.environ['QDRANT_COLLECTION'] = collection_name
+        # Only change the default collection of the process, the chat requests
+        # can still select another collection with the `collection` query parameter
+        try:
+            set_default_collection(collection_name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
         # Return a JSON response
         return JSONResponse(content={"message": f"Collection '{collection_name}' received successfully."})
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
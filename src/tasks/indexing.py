@@ -1,58 +1,45 @@
-import os
-import shutil
 import logging
-from create_llama.backend.app.engine.generate import generate_datasource
+from typing import List
+from create_llama.backend.app.engine.generate import (
+    generate_datasource,
+    get_collection_diff,
+    get_documents_from_files,
+    index_documents,
+    remove_files,
+)
 
 
 logger = logging.getLogger("uvicorn")
 
 
-def index_all():
+def index_all(collection: str | None = None):
     # Just call the generate_datasource from create_llama for now
-    generate_datasource()
+    generate_datasource(collection)
 
 
-def reset_index():
+def load_files(file_paths: List[str]):
     """
-    Reset the index by removing the vector store data and STORAGE_DIR then re-indexing the data.
+    Parse the given files into documents without indexing them.
     """
+    return get_documents_from_files(file_paths)
 
-    def reset_index_chroma():
-        from chromadb import PersistentClient
 
-        # Todo: Consider using other method to clear the vector store data
-        chroma_path = os.getenv("CHROMA_PATH")
-        collection_name = os.getenv("CHROMA_COLLECTION", "default")
-        chroma_client = PersistentClient(path=chroma_path)
-        if chroma_client.get_or_create_collection(collection_name):
-            logger.info(f"Removing collection {collection_name}")
-            chroma_client.delete_collection(collection_name)
-
-    def reset_index_qdrant():
-        from app.engine.vectordbs.qdrant import get_vector_store
+def index_loaded_files(file_paths: List[str], documents, collection: str | None = None):
+    """
+    Index the documents returned by `load_files`.
+    """
+    index_documents(file_paths, documents, collection)
 
-        store = get_vector_store()
-        store.client.delete_collection(
-            store.collection_name,
-        )
-        store._create_collection(
-            collection_name=store.collection_name,
-            vector_size=int(os.getenv("EMBEDDING_DIM", 1536)),
-        )
 
-    vector_store_provider = os.getenv("VECTOR_STORE_PROVIDER", "chroma")
-    if vector_store_provider == "chroma":
-        reset_index_chroma()
-    elif vector_store_provider == "qdrant":
-        reset_index_qdrant()
-    else:
-        raise ValueError(f"Unsupported vector provider: {vector_store_provider}")
+def get_index_diff(collection: str | None = None):
+    """
+    Get the new, modified and deleted files of a collection since they were indexed.
+    """
+    return get_collection_diff(collection)
 
-    # Remove STORAGE_DIR
-    storage_context_dir = os.getenv("STORAGE_DIR")
-    logger.info(f"Removing {storage_context_dir}")
-    if os.path.exists(storage_context_dir):
-        shutil.rmtree(storage_context_dir)
 
-    # Run the indexing
-    index_all()
+def remove_file_from_index(file_path: str, collection: str | None = None):
+    """
+    Remove the nodes of a single file from the index.
+    """
+    remove_files([file_path], collection)
@@ -0,0 +1,116 @@
+import os
+import uuid
+import time
+import logging
+import threading
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from src.models.file import FileStatus
+from src.models.job import IngestionJob
+from src.tasks.indexing import load_files, index_loaded_files, remove_file_from_index
+
+
+logger = logging.getLogger("uvicorn")
+
+# Number of finished jobs to keep around for status polling
+MAX_FINISHED_JOBS = 1000
+
+
+class IngestionQueue:
+    """
+    Run the ingestion of uploaded files in a bounded pool of background workers,
+    so the requests return right away and the event loop is never blocked by the embedding.
+    """
+
+    def __init__(self, max_workers: int | None = None):
+        if max_workers is None:
+            max_workers = int(os.getenv("INGESTION_WORKERS", "1"))
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingestion"
+        )
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._lock = threading.Lock()
+
+    def submit_index(self, collection: str, file_names: List[str]) -> IngestionJob:
+        """
+        Queue the indexing of the given files of a collection.
+        """
+        return self._submit("index", collection, file_names)
+
+    def submit_remove(self, collection: str, file_name: str) -> IngestionJob:
+        """
+        Queue the removal of a file of a collection from the index.
+        """
+        return self._submit("remove", collection, [file_name])
+
+    def get_job(self, job_id: str) -> IngestionJob | None:
+        """
+        Get a snapshot of a job, the workers keep updating the job itself.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.copy() if job is not None else None
+
+    def get_file_status(self, collection: str, file_name: str) -> str | None:
+        """
+        Get the status of the latest indexing job of a file, if there is any.
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in reversed(jobs):
+            if (
+                job.kind == "index"
+                and job.collection == collection
+                and file_name in job.file_names
+            ):
+                return job.status
+        return None
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, kind: str, collection: str, file_names: List[str]):
+        job = IngestionJob(
+            id=uuid.uuid4().hex,
+            kind=kind,
+            collection=collection,
+            file_names=file_names,
+        )
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune_finished_jobs()
+        self._executor.submit(self._run, job)
+        return job
+
+    def _prune_finished_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            self._jobs.pop(job_id)
+
+    def _set_status(self, job: IngestionJob, status: str, error: str | None = None):
+        with self._lock:
+            job.status = status
+            job.error = error
+            job.updated_at = time.time()
+
+    def _run(self, job: IngestionJob):
+        file_paths = [f"data/{job.collection}/{name}" for name in job.file_names]
+        try:
+            if job.kind == "remove":
+                remove_file_from_index(file_paths[0], job.collection)
+            else:
+                self._set_status(job, FileStatus.PARSING)
+                documents = load_files(file_paths)
+                self._set_status(job, FileStatus.EMBEDDING)
+                index_loaded_files(file_paths, documents, job.collection)
+            self._set_status(job, FileStatus.INDEXED)
+        except Exception as e:
+            logger.exception(f"Ingestion job {job.id} failed", exc_info=True)
+            self._set_status(job, FileStatus.FAILED, error=str(e))
+
+
+ingestion_queue = IngestionQueue()
+
+
+def get_ingestion_queue() -> IngestionQueue:
+    return ingestion_queue
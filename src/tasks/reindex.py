@@ -0,0 +1,170 @@
+import os
+import shutil
+import logging
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from create_llama.backend.app.engine.generate import (
+    STORAGE_DIR,
+    generate_datasource,
+    get_index_lock,
+)
+from app.engine.collection_registry import (
+    CollectionState,
+    EmbeddingConfig,
+    get_collection_registry,
+    get_embedding_config,
+)
+from app.engine.engine_cache import invalidate_engine_cache
+from app.engine.hybrid_retriever import forget_sparse_index
+from app.engine.vectordb import (
+    COLLECTION_NAME_PATTERN,
+    delete_vector_store_collection,
+    resolve_collection,
+)
+
+
+logger = logging.getLogger("uvicorn")
+
+
+def get_collections() -> List[str]:
+    """
+    Get the collections to re-index: the default collection, the folders in `data`
+    and the collections that were re-indexed before.
+    """
+    collections = {resolve_collection()}
+    if os.path.isdir("data"):
+        collections.update(
+            name
+            for name in os.listdir("data")
+            if os.path.isdir(os.path.join("data", name))
+            and COLLECTION_NAME_PATTERN.match(name)
+        )
+    collections.update(
+        state.collection for state in get_collection_registry().get_states()
+    )
+    return sorted(collections)
+
+
+class Reindexer:
+    """
+    Re-index the collections into new versions in the background (blue/green),
+    the active versions keep serving the chat and uploads until the new ones are built.
+    """
+
+    def __init__(self):
+        # One build at a time, they compete for the same embedding model
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reindex")
+
+    def start(
+        self,
+        collections: List[str] | None = None,
+        serving_embed_model: BaseEmbedding | None = None,
+        serving_embedding: EmbeddingConfig | None = None,
+    ) -> List[CollectionState]:
+        """
+        Start building a new version of the collections with the current embedding model.
+        `serving_embed_model` is the model the active versions were built with (of the
+        `serving_embedding` config), it keeps embedding their queries and uploads until the switch.
+        """
+        registry = get_collection_registry()
+        states = []
+        for collection in collections or get_collections():
+            if serving_embed_model is not None and serving_embedding is not None:
+                # Keeps the config of an earlier change if the version is still being replaced
+                registry.pin_embed_model(
+                    registry.get_active_name(collection),
+                    serving_embedding,
+                    serving_embed_model,
+                )
+            if registry.get_state(collection).status == "building":
+                # The running build starts over if the embedding model changed
+                logger.info(f"Collection {collection} is already being re-indexed")
+            else:
+                registry.start_build(collection)
+                self._executor.submit(self._build, collection)
+            states.append(registry.get_state(collection))
+        return states
+
+    def resume(self):
+        """
+        Continue the builds interrupted by a restart, their manifest keeps the indexed files.
+        """
+        for state in get_collection_registry().get_states():
+            if state.status == "building":
+                logger.info(f"Resume re-indexing collection {state.collection}")
+                self._executor.submit(self._build, state.collection)
+
+    def rollback(self, collection: str) -> CollectionState:
+        """
+        Switch a collection back to its previous version, then index the files
+        uploaded or removed since that version was replaced.
+        """
+        collection = resolve_collection(collection)
+        # Not while files are written to the active version
+        with get_index_lock(collection):
+            state = get_collection_registry().rollback(collection)
+        invalidate_engine_cache(state.collection)
+        self._executor.submit(self._catch_up, state.collection)
+        return state
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _catch_up(self, collection: str):
+        logger.info(f"Index the files changed since {collection} was rolled back")
+        try:
+            generate_datasource(collection)
+        except Exception:
+            logger.exception(f"Indexing the changed files of {collection} failed")
+            return
+        invalidate_engine_cache(collection)
+
+    def _build(self, collection: str):
+        registry = get_collection_registry()
+        version = registry.get_state(collection).building
+        logger.info(f"Re-index collection {collection} into {version.name}")
+        try:
+            generate_datasource(
+                version.name,
+                on_progress=lambda done, total: registry.set_progress(
+                    collection, done, total
+                ),
+            )
+            # Block the uploads of the collection while the files uploaded
+            # during the build are indexed, then switch to the new version
+            with get_index_lock(collection):
+                generate_datasource(version.name)
+                if version.embedding != get_embedding_config():
+                    raise RuntimeError("The embedding model changed during the build")
+                dropped = registry.finish_build(collection)
+        except Exception as e:
+            logger.exception(f"Re-indexing collection {collection} failed")
+            failed = registry.fail_build(collection, str(e))
+            if failed is not None:
+                self._delete_version(failed.name)
+            if version.embedding != get_embedding_config():
+                self.start([collection])
+            return
+        invalidate_engine_cache(collection)
+        if dropped is not None:
+            self._delete_version(dropped.name)
+
+    @staticmethod
+    def _delete_version(name: str):
+        try:
+            delete_vector_store_collection(name)
+        except Exception:
+            logger.exception(f"Failed to remove the collection {name}")
+        # Not `get_storage_dir`, it resolves a collection to its active version
+        storage_dir = os.path.join(STORAGE_DIR, name)
+        forget_sparse_index(storage_dir)
+        if os.path.exists(storage_dir):
+            shutil.rmtree(storage_dir)
+
+
+reindexer = Reindexer()
+
+
+def get_reindexer() -> Reindexer:
+    return reindexer